@@ -29,8 +29,151 @@ def Second3Point(function, eval_point, step_size):
 def RelativeError(experiment, truth):
     E = np.array(experiment)
     T = np.array(truth)
-    error = np.zeros(len(T))
     assert len(E)==len(T), "input lists must have the same length"
-    for entry in zip(E,T):
-        error = abs(E-T)/(1+abs(T))
-    return error   
\ No newline at end of file
+    # Truth given per point is compared with all columns of a
+    # (points x steps) matrix from the batched methods
+    T = T.reshape(T.shape + (1,)*(E.ndim - T.ndim))
+    return abs(E-T)/(1+abs(T))
+
+def ComplexStep(function, eval_point, step_size=1.0e-20):
+    """
+    First derivative as Im(f(x + i*h))/h. The function must accept
+    complex arguments and be analytic.
+    """
+    x = np.asarray(eval_point, dtype=np.float64)
+    h = step_size
+    return np.imag(function(x + 1j*h))/h
+
+def OptimalStep(eval_point, method=FirstSymmetric):
+    """
+    Step size balancing truncation and round-off errors of FirstForward,
+    FirstSymmetric, or Second3Point
+    """
+    x = np.asarray(eval_point, dtype=np.float64)
+    eps = np.finfo(np.float64).eps
+    if method is FirstForward:
+        power = 1.0/2.0
+    elif method is FirstSymmetric:
+        power = 1.0/3.0
+    elif method is Second3Point:
+        power = 1.0/4.0
+    else:
+        raise ValueError("Unknown finite difference method")
+    h = eps**power*np.maximum(np.abs(x), 1.0)
+    return (x + h) - x
+
+# Richardson extrapolation table for the flat array of points x with
+# the initial steps h0. Returns the best estimates, their errors, and
+# the flags of the points for which all differences are finite.
+def _RichardsonTable(function, x, h0, order, levels, factor):
+    # Exactly representable steps for all levels, shape (levels, npoints)
+    scale = factor**-np.arange(levels, dtype=np.float64)
+    h = (x + scale[:,np.newaxis]*h0) - x
+    # All stencil points in one call
+    if order == 1:
+        points = np.concatenate(((x + h).ravel(), (x - h).ravel()))
+    else:
+        points = np.concatenate(((x + h).ravel(), (x - h).ravel(), x))
+    # Points outside of the function domain are handled by the caller
+    with np.errstate(invalid="ignore", divide="ignore"):
+        values = np.asarray(function(points), dtype=np.float64)
+    n = h.size
+    fplus = values[:n].reshape(h.shape)
+    fminus = values[n:2*n].reshape(h.shape)
+    if order == 1:
+        differences = (fplus - fminus)/(2.0*h)
+    else:
+        f0 = values[2*n:]
+        differences = ((fplus - f0) + (fminus - f0))/(h*h)
+    # One row per level. The symmetric differences have errors in even
+    # powers of h only. Non-finite entries are never chosen.
+    best = differences[0].copy()
+    error = np.full(x.shape, np.inf)
+    previous = [differences[0]]
+    for k in range(1, levels):
+        row = [differences[k]]
+        fac = 1.0
+        for j in range(1, k + 1):
+            fac *= factor*factor
+            row.append(row[j-1] + (row[j-1] - previous[j-1])/(fac - 1.0))
+            estimate = np.maximum(np.abs(row[j] - row[j-1]),
+                                  np.abs(row[j] - previous[j-1]))
+            better = estimate <= error
+            best[better] = row[j][better]
+            error[better] = estimate[better]
+        previous = row
+    return best, error, np.isfinite(differences).all(axis=0)
+
+def Richardson(function, eval_point, step_size=None, order=1, levels=8,
+               factor=2.0, full_output=False):
+    """
+    First or second derivative from symmetric differences with steps
+    h/factor**k, Richardson-extrapolated to zero step. All stencil points
+    go to the function in one call. The default initial step 0.1*max(|x|, 1)
+    is reduced, with another call, where the stencil gives non-finite values
+    (e.g., outside the function domain). full_output=True also returns error estimates.
+    """
+    if order not in (1, 2):
+        raise ValueError("Only first and second derivatives are supported")
+    if levels < 2:
+        raise ValueError("Need at least two extrapolation levels")
+    x = np.asarray(eval_point, dtype=np.float64)
+    shape = x.shape
+    x = x.reshape(-1)
+    automatic = step_size is None
+    if automatic:
+        step_size = 0.1*np.maximum(np.abs(x), 1.0)
+    h0 = np.array(np.broadcast_to(np.asarray(step_size, dtype=np.float64), x.shape))
+    best, error, finite = _RichardsonTable(function, x, h0, order, levels, factor)
+    if automatic:
+        # Restart the failed points from the smallest step tried
+        smallest = 4.0*np.finfo(np.float64).eps*np.maximum(np.abs(x), 1.0)
+        retry = ~finite & (h0 > smallest)
+        while retry.any():
+            h0[retry] *= factor**(1 - levels)
+            best[retry], error[retry], finite[retry] = _RichardsonTable(
+                function, x[retry], h0[retry], order, levels, factor)
+            retry &= ~finite & (h0 > smallest)
+    best = best.reshape(shape)
+    if full_output:
+        return best, error.reshape(shape)
+    return best
+
+# Calls the function once with all stencil points, splits the result
+def _EvaluateStencil(function, *grids):
+    points = np.concatenate([g.ravel() for g in grids])
+    values = np.asarray(function(points))
+    result = []
+    start = 0
+    for g in grids:
+        result.append(values[start:start+g.size].reshape(g.shape))
+        start += g.size
+    return result
+
+def _StencilGrid(eval_points, step_sizes):
+    x = np.asarray(eval_points, dtype=np.float64).reshape(-1, 1)
+    h = np.asarray(step_sizes, dtype=np.float64).reshape(1, -1)
+    return x, h
+
+def FirstForwardBatch(function, eval_points, step_sizes):
+    "FirstForward for all points and steps, as a (points x steps) matrix"
+    x, h = _StencilGrid(eval_points, step_sizes)
+    f0, f1 = _EvaluateStencil(function, x, x + h)
+    return (f1 - f0)/h
+
+def FirstSymmetricBatch(function, eval_points, step_sizes):
+    "FirstSymmetric for all points and steps, as a (points x steps) matrix"
+    x, h = _StencilGrid(eval_points, step_sizes)
+    x1 = x + h
+    x2 = x - h
+    f1, f2 = _EvaluateStencil(function, x1, x2)
+    return (f1 - f2)/(x1 - x2)
+
+def Second3PointBatch(function, eval_points, step_sizes):
+    "Second3Point for all points and steps, as a (points x steps) matrix"
+    x, h = _StencilGrid(eval_points, step_sizes)
+    x1 = x + h
+    x2 = x - h
+    f0, f1, f2 = _EvaluateStencil(function, x, x1, x2)
+    h = (x1 - x2)/2
+    return ((f1 - f0) + (f2 - f0))/h**2
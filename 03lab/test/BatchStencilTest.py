@@ -0,0 +1,47 @@
+"""
+Created: Sun Oct 18 15:32:47 2026
+Description: checks the batched stencils against the scalar ones and the
+             broadcasting of RelativeError. Run with 03lab/src in PYTHONPATH.
+"""
+import numpy as np
+from derivatives import *
+
+calls = []
+def f(x):
+    calls.append(np.size(x))
+    return np.exp(np.sin(x))
+
+x = np.linspace(-1.5, 2.5, 9)
+h = np.logspace(-8, -1, 8)
+
+n, m = len(x), len(h)
+# Unshifted points are evaluated once per point, not once per step
+for batch, scalar, npoints in ((FirstForwardBatch, FirstForward, n + n*m),
+                               (FirstSymmetricBatch, FirstSymmetric, 2*n*m),
+                               (Second3PointBatch, Second3Point, n + 2*n*m)):
+    del calls[:]
+    D = batch(f, x, h)
+    # One call with all stencil points
+    assert calls == [npoints], calls
+    assert D.shape == (len(x), len(h))
+    for i in range(len(x)):
+        for j in range(len(h)):
+            assert D[i, j] == scalar(f, x[i], h[j]), (batch, i, j)
+print("batched stencils match scalar calls ok")
+
+# RelativeError compares per-point truth with every column
+truth = np.cos(x)*np.exp(np.sin(x))
+D = FirstSymmetricBatch(f, x, h)
+E = RelativeError(D, truth)
+assert E.shape == D.shape
+for j in range(len(h)):
+    assert np.array_equal(E[:, j], RelativeError(D[:, j], truth))
+assert np.median(E[:, 3]) < 1e-9 and np.median(E[:, -1]) > 1e-4
+# Scalars and lists still work as before
+assert RelativeError([2.0, 1.0], [1.0, 1.0]).tolist() == [0.5, 0.0]
+try:
+    RelativeError([1.0, 2.0], [1.0])
+    assert False, "AssertionError expected"
+except AssertionError as e:
+    assert "same length" in str(e)
+print("RelativeError ok")
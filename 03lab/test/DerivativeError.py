@@ -34,6 +34,8 @@ call_true = {'exp_1true': exp_true, 'exp_2true': exp_true, 'log_1true': log_1tru
              'log_2true': log_2true, 'sin_1true': sin_1true, 'sin_2true': sin_2true}
 call_f = {exp: 'exp', log: 'log', sin: 'sin'}
 call_m = {FirstForward: 'first forward', FirstSymmetric: 'first symmetric', Second3Point: 'second 3-point'}
+batched = {FirstForward: FirstForwardBatch, FirstSymmetric: FirstSymmetricBatch,\
+           Second3Point: Second3PointBatch}
 
 #run the loop for the approximations and save the median errors to a graph
 step_sizes = np.linspace(1e-14, 0.1, 2000)
@@ -41,14 +43,13 @@ step_sizes = np.linspace(1e-14, 0.1, 2000)
 for function in functions:
     plt.figure()
     for method in methods:
-        medians = np.zeros(len(step_sizes))
-        for i, size in enumerate(step_sizes):
-            approx = method(function, x_array, size)
-            if method == Second3Point:
-                error = RelativeError(approx, call_true[call_f[function]+'_2true'])
-            else:
-                error = RelativeError(approx, call_true[call_f[function]+'_1true'])
-            medians[i] = np.median(error)
+        #all points and step sizes at once, as a (points x steps) matrix
+        approx = batched[method](function, x_array, step_sizes)
+        if method == Second3Point:
+            error = RelativeError(approx, call_true[call_f[function]+'_2true'])
+        else:
+            error = RelativeError(approx, call_true[call_f[function]+'_1true'])
+        medians = np.median(error, axis=0)
         plt.loglog(step_sizes, medians, linewidth=1.0, label=call_m[method])
     
     #decorate the plots    
@@ -0,0 +1,56 @@
+"""
+Created: Sun Oct 18 15:10:22 2026
+Description: checks Richardson, ComplexStep, and OptimalStep against exact
+             derivatives, including points next to the edge of the domain.
+             Run with 03lab/src in PYTHONPATH.
+"""
+import numpy as np
+from derivatives import *
+
+x = np.linspace(-2.0, 2.0, 21)
+
+# Richardson reaches near machine precision for smooth functions
+first = Richardson(np.exp, x)
+assert np.all(RelativeError(first, np.exp(x)) < 1e-12), first
+second = Richardson(np.sin, x, order=2)
+assert np.all(RelativeError(second, -np.sin(x)) < 1e-9), second
+best, error = Richardson(np.cos, x, full_output=True)
+assert best.shape == x.shape and error.shape == x.shape
+assert np.all(np.abs(best + np.sin(x)) <= 10*error + 1e-14)
+# Scalar and array shapes are kept
+assert np.ndim(Richardson(np.exp, 1.0)) == 0
+assert Richardson(np.exp, x.reshape(3, 7)).shape == (3, 7)
+print("Richardson accuracy ok")
+
+# The default step of log at small x leaves the domain; the automatic
+# retry gives finite, accurate values there
+xs = np.array([1e-3, 1e-2, 0.05, 1.0])
+d = Richardson(np.log, xs)
+assert np.all(np.isfinite(d)), d
+assert np.all(np.abs(d*xs - 1.0) < 1e-8), d*xs
+d2 = Richardson(np.log, xs, order=2)
+assert np.all(np.abs(-d2*xs*xs - 1.0) < 1e-6), -d2*xs*xs
+print("Richardson near domain edge ok")
+
+# Complex step has no subtractive cancellation
+c = ComplexStep(np.exp, x)
+assert np.all(RelativeError(c, np.exp(x)) < 1e-15), c
+c = ComplexStep(np.log, xs)
+assert np.all(np.abs(c*xs - 1.0) < 1e-15), c*xs
+print("ComplexStep ok")
+
+# Optimal steps beat steps ten times larger or smaller
+for method, power, truth in ((FirstForward, 1, np.cos(x)),
+                             (FirstSymmetric, 2, np.cos(x)),
+                             (Second3Point, 3, -np.sin(x))):
+    h = OptimalStep(x, method)
+    assert np.all(h > 0)
+    errors = [np.median(RelativeError(method(np.sin, x, s*h), truth))
+              for s in (0.01, 1.0, 100.0)]
+    assert errors[1] < errors[0] and errors[1] < errors[2], (method, errors)
+try:
+    OptimalStep(x, ComplexStep)
+    assert False, "ValueError expected"
+except ValueError:
+    pass
+print("OptimalStep ok")
@@ -1,14 +1,18 @@
 """
-This module implements Gauss-Legendre quadrature formulas for selected
-values of N
+This module implements Gauss-Legendre quadrature formulas. For selected
+values of N, the abscissae and weights are tabulated. For all other
+values of N, they are calculated when first needed and cached, both
+in memory and on disk.
 """
 
 __author__="Igor Volobouev (i.volobouev@ttu.edu)"
 __version__="0.4"
 __date__ ="Feb 12 2018"
 
+import os
 import operator
 import functools
+import numpy as np
 
 # Weights and abscissae for Gauss-Legendre quadratures
 # originally calculated in extended precision. Only even
@@ -607,14 +611,134 @@ __glw = {
 }
 
 
+# Abscissae and weights calculated for the values of N which are not
+# tabulated above, keyed by N. Each entry is a tuple (abscissae, weights)
+# with the nonnegative abscissae in the increasing order (for odd N, the
+# first abscissa is 0) and their weights.
+__computed = {}
+
+# Directory in which the calculated abscissae and weights are saved, so
+# that they do not have to be recalculated in another Python session.
+# The disk cache is off (None) unless this variable is assigned a
+# directory name or the GAUSS_LEGENDRE_CACHE environment variable is set.
+# Only the tables with at least __diskCacheMinN points are saved: the
+# smaller ones are faster to calculate than to read.
+cacheDirectory = os.environ.get("GAUSS_LEGENDRE_CACHE")
+__diskCacheMinN = 100
+
+
 def validNValues():
     """
-    This function returns the list of supported values of N for
-    Gauss-Legendre quadratures.
+    This function returns the list of values of N for which
+    the Gauss-Legendre abscissae and weights are tabulated in
+    extended precision. Other values of N are supported as well,
+    with the abscissae and weights calculated in double precision.
     """
     return sorted([N*2 for N in __glx.keys()])
 
 
+def __cacheFile(N):
+    return os.path.join(cacheDirectory, "gaussLegendre_%d.npy" % N)
+
+
+def __readCache(N):
+    if cacheDirectory is None or N < __diskCacheMinN:
+        return None
+    try:
+        table = np.load(__cacheFile(N))
+    except (OSError, ValueError):
+        return None
+    if table.shape != (2, (N + 1)//2):
+        return None
+    return table[0], table[1]
+
+
+# Failure to write the cache is not an error: the table
+# will simply be calculated again next time
+def __writeCache(N, abscissae, weights):
+    if cacheDirectory is None or N < __diskCacheMinN:
+        return
+    filename = __cacheFile(N)
+    temporary = "%s.%d.tmp" % (filename, os.getpid())
+    try:
+        os.makedirs(cacheDirectory, exist_ok=True)
+        with open(temporary, "wb") as f:
+            np.save(f, np.array([abscissae, weights]))
+        os.replace(temporary, filename)
+    except OSError:
+        try:
+            os.remove(temporary)
+        except OSError:
+            pass
+
+
+def __legendre(N, x):
+    """
+    Legendre polynomial of degree N and its derivative at
+    the array of points x (which must not contain -1 or 1)
+    """
+    p0 = np.ones_like(x)
+    p1 = x.copy()
+    for k in range(2, N + 1):
+        p0, p1 = p1, ((2*k - 1)*x*p1 - (k - 1)*p0)/k
+    return p1, N*(x*p1 - p0)/(x*x - 1.0)
+
+
+def __calculate(N):
+    """
+    Nonnegative abscissae and weights of the N-point Gauss-Legendre
+    quadrature. The roots of the Legendre polynomial are found by Newton
+    iterations started from the asymptotic approximation of Tricomi,
+    which is so close that a few iterations reach the full double
+    precision for any N. All roots are iterated together.
+    """
+    n = (N + 1)//2
+    i = np.arange(n, 0, -1, dtype=np.float64)
+    x = (1.0 - (N - 1.0)/(8.0*N**3))*np.cos(np.pi*(i - 0.25)/(N + 0.5))
+    if N % 2:
+        x[0] = 0.0
+    for iteration in range(100):
+        p, dp = __legendre(N, x)
+        dx = p/dp
+        x -= dx
+        if np.max(np.abs(dx)) < 1.0e-14:
+            break
+    # One more step, to clean up after the convergence
+    p, dp = __legendre(N, x)
+    x -= p/dp
+    if N % 2:
+        x[0] = 0.0
+    p, dp = __legendre(N, x)
+    weights = 2.0/((1.0 - x*x)*dp*dp)
+    return x, weights
+
+
+def abscissaeAndWeights(N):
+    """
+    This function returns the nonnegative abscissae (in the increasing
+    order) and the corresponding weights of the N-point Gauss-Legendre
+    quadrature on the interval [-1, 1], as two lists. For odd N, the first
+    abscissa is 0. Any positive N is supported. The tabulated values
+    are used when available, otherwise the abscissae and weights are
+    calculated and cached in memory (and, optionally, on disk: see
+    the "cacheDirectory" variable).
+    """
+    if N != int(N) or N < 1:
+        raise ValueError("Number of integration points must be a positive integer")
+    N = int(N)
+    if N % 2 == 0 and N//2 in __glx:
+        return __glx[N//2], __glw[N//2]
+    table = __computed.get(N)
+    if table is None:
+        table = __readCache(N)
+        if table is None:
+            table = __calculate(N)
+            __writeCache(N, *table)
+        table = (table[0].tolist(), table[1].tolist())
+        __computed[N] = table
+    return table
+
+
 def integrate(f, N, xmin, xmax):
     """
     This function performs Gauss-Legendre quadratures. Arguments are
@@ -622,25 +746,27 @@ def integrate(f, N, xmin, xmax):
 
     f          -- The function (callable) to integrate. It will be called
                   with one argument.
-    N          -- Number of points to use for integration. Call "validNValues()"
-                  function to find out which values of N are supported.
+    N          -- Number of points to use for integration. Any positive
+                  N can be used. For the N values returned by the
+                  "validNValues()" function, the abscissae and weights
+                  are tabulated, for others they are calculated once
+                  and cached.
     xmin, xmax -- Integration interval.
     """
-    half = N // 2
-    if N % 2 or half not in __glx:
-        raise ValueError("This number of integration points is not supported")
+    abscissae, weights = abscissaeAndWeights(N)
     midpoint = (xmin + xmax)/2.0
     unit = (xmax - xmin)/2.0
     values = []
-    for a, w in zip(__glx[half], __glw[half]):
-        values.append(w*f(midpoint - unit*a))
-        values.append(w*f(midpoint + unit*a))
+    for a, w in zip(abscissae, weights):
+        if a == 0.0:
+            values.append(w*f(midpoint))
+        else:
+            values.append(w*f(midpoint - unit*a))
+            values.append(w*f(midpoint + unit*a))
     # To reduce round-off errors, we will sort all calculated values
     # in the order of increasing magnitude and then add them up, the
     # smallest ones first
     if N > 2:
         values.sort(key=abs)
-        sum = functools.reduce(operator.add, values)
-    else:
-        sum = values[0] + values[1]
+    sum = functools.reduce(operator.add, values)
     return unit*sum
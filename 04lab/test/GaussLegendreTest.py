@@ -0,0 +1,70 @@
+"""
+Created: Sun Oct 18 15:58:31 2026
+Description: checks the calculated Gauss-Legendre abscissae and weights
+             against numpy.polynomial.legendre.leggauss, polynomial
+             exactness, and the opt-in disk cache. Run with 04lab/src
+             in PYTHONPATH and GAUSS_LEGENDRE_CACHE unset.
+"""
+import os
+import tempfile
+import numpy as np
+from numpy.polynomial.legendre import leggauss
+import gaussLegendreQuadrature as glq
+
+# The disk cache stays off unless asked for
+assert glq.cacheDirectory is None, "unset GAUSS_LEGENDRE_CACHE to run this test"
+
+def fullTable(N):
+    a, w = (np.array(v) for v in glq.abscissaeAndWeights(N))
+    if N % 2:
+        return np.concatenate((-a[:0:-1], a)), np.concatenate((w[:0:-1], w))
+    return np.concatenate((-a[::-1], a)), np.concatenate((w[::-1], w))
+
+# Calculated and tabulated values against numpy, small and large N.
+# The weights are compared in absolute terms: leggauss loses relative
+# precision in the tiny weights next to the interval ends.
+for N in (1, 2, 3, 7, 20, 33, 64, 101, 250, 500, 1000):
+    x, w = fullTable(N)
+    xref, wref = leggauss(N)
+    assert len(x) == N
+    assert np.all(np.diff(x) > 0)
+    assert np.max(np.abs(x - xref)) < 1e-14, (N, np.max(np.abs(x - xref)))
+    assert np.max(np.abs(w - wref)) < 1e-13, (N, np.max(np.abs(w - wref)))
+    assert abs(np.sum(w) - 2.0) < 1e-13, N
+print("abscissae and weights ok")
+
+# Exact for polynomials up to degree 2N-1
+for N in (5, 11, 37):
+    for degree in (2*N - 2, 2*N - 1):
+        exact = (3.0**(degree + 1) - (-1.0)**(degree + 1))/(degree + 1)
+        result = glq.integrate(lambda t: t**degree, N, -1.0, 3.0)
+        assert abs(result/exact - 1.0) < 1e-12, (N, degree, result, exact)
+print("polynomial exactness ok")
+
+for bad in (0, -3, 2.5):
+    try:
+        glq.abscissaeAndWeights(bad)
+        assert False, "ValueError expected"
+    except ValueError:
+        pass
+print("argument checks ok")
+
+# Nothing is written while the cache is off; once on, tables from the
+# disk are used by a fresh module state
+with tempfile.TemporaryDirectory() as directory:
+    N = 317
+    glq.abscissaeAndWeights(N)
+    glq.cacheDirectory = directory
+    try:
+        assert os.listdir(directory) == []
+        glq.abscissaeAndWeights(N + 2)
+        assert os.listdir(directory) == ["gaussLegendre_%d.npy" % (N + 2)]
+        expected = glq.abscissaeAndWeights(N + 2)
+        del glq.__dict__["__computed"][N + 2]
+        assert glq.abscissaeAndWeights(N + 2) == expected
+        # Small tables are not saved
+        glq.abscissaeAndWeights(21)
+        assert len(os.listdir(directory)) == 1
+    finally:
+        glq.cacheDirectory = None
+print("disk cache ok")
@@ -5,6 +5,7 @@ Description:
 """
 from physical_pendulum import *
 from cpode import *
+from cphistory import SampledHistory
 import numpy as np
 
 def PendulumAngles(thetaInitial, F_D):
@@ -30,13 +31,11 @@ def PendulumAngles(thetaInitial, F_D):
     # Simulation stopping condition
     whenToStop = TimeLimit(400*periodD)
 
-    # Run the simulation
-    pendulum.run(thetaInitial, omegaInitial, dt, whenToStop)
-    
+    # Run the simulation, keeping only the states sampled once per period
     period_times = np.arange(200*periodD,400*periodD,periodD)
-    period_angle = []
-    for t in period_times:
-        x, v = pendulum.interpolate(t)
-        period_angle.append(standard_angle(x))
+    samples = SampledHistory(period_times)
+    pendulum.run(thetaInitial, omegaInitial, dt, whenToStop, history=samples)
+    
+    period_angle = [standard_angle(x) for x in pendulum.x]
           
     return period_angle
\ No newline at end of file
@@ -9,6 +9,8 @@ __date__ ="Jan 29 2018"
 
 import v3
 import math
+import time
+import collections
 import numpy as np
 
 # Physical forces should behave like vectors. However, there is
@@ -45,11 +47,57 @@ import numpy as np
 # step, no matter how many times it was used when the linear combination
 # was originally contructed.
 #
+# Forces can also describe compiled kernels which allow the ODE solvers
+# to run their integration loops natively (see the cpkernels module).
+# The "kernel" method returns a plain tuple (name, params, dim) which
+# names a compiled force function of the cpkernels module and lists its
+# parameters. The force parameters are copied into this tuple at the time
+# the method is called. The kernels are built from these descriptions
+# by the solvers, so the force models never load the compiled backend.
+#
+# Force classes declare which of the arguments t, x, and v they actually
+# depend upon with the class variables dependsOnT, dependsOnX, and
+# dependsOnV. A force which depends on none of them is constant. Constant
+# forces may be evaluated only once, with arguments (0.0, None, None),
+# and the result reused. CompositeForce uses this to sum all its constant
+# terms (for example, the force of gravity) once instead of at every call.
+#
+# Finally, forces can be evaluated for batches of states with the method
+# "evalBatch(t, X, V)". X and V are NumPy arrays of shape (n, 3) for 3-d
+# motion (or of shape (n,) for 1-d motion) with one state per row, and t
+# is either a number or an array which broadcasts against X. The result
+# is an array with the same shape as X. The piecewise formulas (like the
+# drag coefficients) are evaluated without branching on the state, so that
+# thousands of states can be processed by a single call. The ensemble mode
+# of the ODE solvers evaluates forces through this method.
+#
+# Any force can be wrapped into InstrumentedForce which counts and times
+# its evaluations and remembers a few recent results. The ODE solvers
+# report the statistics of such forces after each run.
+#
 class BasicForce:
     "Base class for all forces in ODE solvers."
+    # By default, forces depend on everything
+    dependsOnT = True
+    dependsOnX = True
+    dependsOnV = True
+    def isConstant(self):
+        return _isConstant(self)
     # Derived classes should override the __call__ function
     def __call__(self, t, x, v):
         raise NotImplementedError("Operation not implemented")
+    # Derived classes which can be evaluated by the compiled
+    # backend should override the "kernel" function
+    def kernel(self):
+        return None
+    # Returns a callable which evaluates this force as fast as possible.
+    # A basic force is already a single callable.
+    def compile(self):
+        return self
+    # Batch evaluation. By default, assume that the __call__ function
+    # works with NumPy arrays. Derived classes should override this.
+    def evalBatch(self, t, X, V):
+        return self(t, X, V)
     # __hash__ and __cmp__ functions will allow us to use
     # BasicForce instances as dictionary keys
     def __hash__(self):
@@ -72,6 +120,28 @@ class BasicForce:
     def __pos__(self):
         return CompositeForce(1.0, self, 0.0, self)
 
+# Convert a V3 object into a NumPy array. Other objects are unchanged.
+def _asArray(a):
+    if isinstance(a, v3.V3):
+        return np.array((a.x, a.y, a.z))
+    return a
+
+# Lengths of the velocities in a batch of states
+def _speeds(V):
+    if V.ndim == 1:
+        return np.abs(V)
+    return np.sqrt(np.sum(V*V, axis=1))
+
+# Multiply every row of a batch by the corresponding factor
+def _scaleRows(factors, V):
+    if V.ndim == 1:
+        return factors*V
+    return factors[:,np.newaxis]*V
+
+def _isConstant(f):
+    return not (getattr(f, "dependsOnT", True) or getattr(f, "dependsOnX", True)
+                or getattr(f, "dependsOnV", True))
+
 class CompositeForce(BasicForce):
     def __init__(self, c1, f1, c2, f2):
         # _basisCallables is a dictionary. Objects of type BasicForce
@@ -83,6 +153,19 @@ class CompositeForce(BasicForce):
             self._include(c1, f1)
         if (c2 != 0.0):
             self._include(c2, f2)
+        # Split the basis into constant and variable terms.
+        # The constant terms are summed when first needed.
+        self._constantTerms = []
+        self._variableTerms = []
+        for k, val in self._basisCallables.items():
+            if _isConstant(k):
+                self._constantTerms.append((k, val))
+            else:
+                self._variableTerms.append((k, val))
+        self._constantSum = None
+        self.dependsOnT = any(getattr(k, "dependsOnT", True) for k, val in self._variableTerms)
+        self.dependsOnX = any(getattr(k, "dependsOnX", True) for k, val in self._variableTerms)
+        self.dependsOnV = any(getattr(k, "dependsOnV", True) for k, val in self._variableTerms)
     def _include(self, c, f):
         # Is f itself a composite force?
         if (hasattr(f, "_basisCallables")):
@@ -90,14 +173,213 @@ class CompositeForce(BasicForce):
                 self._basisCallables[k] = self._basisCallables.get(k,0.0) + c*v
         else:
             self._basisCallables[f] = self._basisCallables.get(f,0.0) + c
+    def _constant(self):
+        # Sum of the constant terms, or None if there are no such terms
+        if self._constantSum is None and self._constantTerms:
+            sum = None
+            for k, val in self._constantTerms:
+                if sum is None:
+                    sum = k(0.0, None, None)*val
+                else:
+                    sum += k(0.0, None, None)*val
+            self._constantSum = sum
+        return self._constantSum
     def __call__(self, t, x, v):
         sum = None
-        for k, val in self._basisCallables.items():
+        for k, val in self._variableTerms:
             if sum is None:
                 sum = k(t, x, v)*val
             else:
                 sum += k(t, x, v)*val
+        const = self._constant()
+        if const is not None:
+            if sum is None:
+                # Return a copy, so that the cached sum
+                # can not be modified by the caller
+                sum = const*1.0
+            else:
+                sum += const
         return sum
+    def evalBatch(self, t, X, V):
+        sum = None
+        for k, val in self._variableTerms:
+            batch = getattr(k, "evalBatch", k)
+            if sum is None:
+                sum = batch(t, X, V)*val
+            else:
+                sum += batch(t, X, V)*val
+        const = self._constant()
+        if const is not None:
+            const = _asArray(const)
+            if sum is None:
+                sum = np.zeros(X.shape) + const
+            else:
+                sum += const
+        return sum
+    def kernel(self):
+        terms = []
+        for k, val in self._basisCallables.items():
+            description = k.kernel()
+            if description is None:
+                return None
+            terms.append((val, description))
+        return ("linearCombination", tuple(terms), None)
+    def compile(self):
+        """
+        Returns a single Python function f(t, x, v) which evaluates the
+        linear combination of basis forces. The basis forces and their
+        coefficients are bound to this function, so the dictionary of
+        the basis forces is not used. For V3 velocities, the terms are
+        accumulated component by component, without making intermediate
+        V3 objects, and a new V3 object is returned by every call.
+        The returned function has the "kernel" attribute, so it can also
+        be used with the compiled backend of the ODE solvers. Note that
+        the coefficients (and the constant terms) are frozen at the time
+        "compile" is called.
+        """
+        terms = [(k, val) for k, val in self._variableTerms if val != 0.0]
+        const = self._constant()
+        if not terms and const is None:
+            terms = self._variableTerms[:1]
+        # Components of the constant term for V3 states. Constant
+        # terms which are not 3-d vectors can not be used with them.
+        if const is None:
+            constXYZ = (0.0, 0.0, 0.0)
+        elif isinstance(const, v3.V3):
+            constXYZ = (const.x, const.y, const.z)
+        elif np.shape(const) == (3,):
+            constXYZ = tuple(float(c) for c in const)
+        else:
+            constXYZ = None
+        V3 = v3.V3
+        def fused(t, x, v):
+            if v.__class__ is V3:
+                if constXYZ is None:
+                    raise TypeError("Constant force term of type %s can not be "
+                                    "combined with V3 forces" % type(const).__name__)
+                ax = ay = az = 0.0
+                for k, val in terms:
+                    r = k(t, x, v)
+                    ax += r.x*val
+                    ay += r.y*val
+                    az += r.z*val
+                # The constant is added last, as in __call__
+                if const is not None:
+                    ax += constXYZ[0]
+                    ay += constXYZ[1]
+                    az += constXYZ[2]
+                return V3(ax, ay, az)
+            # Generic states: the same formula as in __call__
+            sum = None
+            for k, val in terms:
+                if sum is None:
+                    sum = k(t, x, v)*val
+                else:
+                    sum += k(t, x, v)*val
+            if const is not None:
+                if sum is None:
+                    sum = const*1.0
+                else:
+                    sum += const
+            return sum
+        fused.kernel = self.kernel
+        fused.force = self
+        return fused
+
+# Hashable key which identifies a state exactly. Returns None
+# for states which can not be used as keys.
+def _stateKey(a):
+    if a is None or isinstance(a, float):
+        return a
+    if isinstance(a, v3.V3):
+        return (a.x, a.y, a.z)
+    if isinstance(a, np.ndarray):
+        return (a.dtype.str, a.shape, a.tobytes())
+    try:
+        hash(a)
+    except TypeError:
+        return None
+    return a
+
+class InstrumentedForce(BasicForce):
+    """
+    Wrapper which counts and times the evaluations of another force and
+    keeps the results of the last few distinct evaluations in a small
+    LRU cache. The cache is keyed on the exact values of t, x, and v, so
+    that repeated calls with the same arguments (for example, the first
+    stage of a rejected RKF45 trial step which is retried from the same
+    state) return the remembered result instead of evaluating the force
+    again. The wrapped force must be a deterministic function of its
+    arguments. Note that the cache must be larger than the number of
+    stages of the ODE scheme if the results are to survive until the step
+    is retried (RKF45 makes 6 evaluations per step). Use cacheSize=0 in
+    order to only count the calls.
+
+    The following members are updated by every call:
+
+    calls       -- Number of calls
+    evaluations -- Number of actual evaluations of the wrapped force
+    cacheHits   -- Number of calls answered from the cache
+    time        -- Cumulative time spent in the wrapped force, seconds
+
+    The ODE solvers copy the changes of these counters over the run into
+    their "forceStatistics" member. Batch evaluations (see "evalBatch")
+    are counted and timed but not cached. The wrapper does not provide
+    a compiled kernel, so the solvers always evaluate it in Python.
+    """
+    def __init__(self, force, cacheSize=16):
+        if cacheSize < 0:
+            raise ValueError("Cache size can not be negative")
+        self.force = force
+        self.cacheSize = cacheSize
+        self.dependsOnT = getattr(force, "dependsOnT", True)
+        self.dependsOnX = getattr(force, "dependsOnX", True)
+        self.dependsOnV = getattr(force, "dependsOnV", True)
+        self._cache = collections.OrderedDict()
+        self.reset()
+    def reset(self):
+        "Reset the counters and clear the cache"
+        self.calls = 0
+        self.evaluations = 0
+        self.cacheHits = 0
+        self.time = 0.0
+        self._cache.clear()
+    def statistics(self):
+        "Current counters as a dictionary"
+        return dict(calls=self.calls, evaluations=self.evaluations,
+                    cacheHits=self.cacheHits, time=self.time)
+    def _evaluate(self, function, t, x, v):
+        self.evaluations += 1
+        start = time.perf_counter()
+        try:
+            return function(t, x, v)
+        finally:
+            self.time += time.perf_counter() - start
+    def __call__(self, t, x, v):
+        self.calls += 1
+        if self.cacheSize == 0:
+            return self._evaluate(self.force, t, x, v)
+        key = (_stateKey(t), _stateKey(x), _stateKey(v))
+        if key[0] is None and t is not None or \
+               key[1] is None and x is not None or \
+               key[2] is None and v is not None:
+            return self._evaluate(self.force, t, x, v)
+        cache = self._cache
+        result = cache.get(key)
+        if result is not None:
+            self.cacheHits += 1
+            cache.move_to_end(key)
+        else:
+            result = self._evaluate(self.force, t, x, v)*1.0
+            cache[key] = result
+            if len(cache) > self.cacheSize:
+                cache.popitem(last=False)
+        # The caller may modify the result in place, so the cache
+        # always keeps its own copy
+        return result*1.0
+    def evalBatch(self, t, X, V):
+        self.calls += 1
+        return self._evaluate(getattr(self.force, "evalBatch", self.force), t, X, V)
 
 ########################################################################
 #
@@ -107,22 +389,45 @@ class CompositeForce(BasicForce):
 
 class ForceOfGravity(BasicForce):
     "The force of gravity near the Earth surface"
+    dependsOnT = False
+    dependsOnX = False
+    dependsOnV = False
     def __init__(self, m):
         # Standard acceleration due to free fall is defined by
         # the ISO standard 80000-3
         self.f = v3.V3(0.0, -9.80665*m, 0.0)
     def __call__(self, t, x, v):
         return self.f
+    def evalBatch(self, t, X, V):
+        # The force points along the y axis. For 1-d motion,
+        # the coordinate is assumed to be vertical.
+        F = np.zeros_like(X, dtype=np.float64)
+        if F.ndim == 1:
+            F[...] = self.f.y
+        else:
+            F[...,1] = self.f.y
+        return F
+    def kernel(self):
+        return ("constantForce", (self.f.x, self.f.y, self.f.z), 3)
 
 class MagnusForce(BasicForce):
     "Magnus force assuming rotation with constant agular velocity"
+    dependsOnT = False
+    dependsOnX = False
     def __init__(self, S0, omega):
         self.somega = S0*omega
     def __call__(self, t, x, v):
         return self.somega.cross(v)
+    def evalBatch(self, t, X, V):
+        return np.cross(_asArray(self.somega), V)
+    def kernel(self):
+        s = self.somega
+        return ("magnusForce", (s.x, s.y, s.z), 3)
 
 class QuadraticDrag(BasicForce):
     "Quadratic drag with constant drag coefficient"
+    dependsOnT = False
+    dependsOnX = False
     def __init__(self, dragCoefficient, frontalArea, airDensity):
         self.C = dragCoefficient
         self.A = frontalArea
@@ -135,9 +440,15 @@ class QuadraticDrag(BasicForce):
         # by a vector only at the very end (this saves a little
         # bit of CPU time).
         return -0.5*self.C*self.A*self.rho*abs(v)*v
+    def evalBatch(self, t, X, V):
+        return _scaleRows(-0.5*self.C*self.A*self.rho*_speeds(V), V)
+    def kernel(self):
+        return ("quadraticDrag", (0.5*self.C*self.A*self.rho,), None)
 
 class BulletDrag(BasicForce):
     "Quadratic drag for objects moving near the speed of sound"
+    dependsOnT = False
+    dependsOnX = False
     def __init__(self, frontalArea, airDensity):
         self.A = frontalArea
         self.rho = airDensity
@@ -150,12 +461,25 @@ class BulletDrag(BasicForce):
         else:
             C = 0.45/np.sqrt(M)
         return -0.5*C*self.A*self.rho*abs(v)*v
+    def evalBatch(self, t, X, V):
+        s = _speeds(V)
+        M = s/340.0
+        # The argument of sqrt is clipped so that the unused
+        # branch of np.where does not divide by zero
+        C = np.where(M <= 0.9, 0.15,
+                     np.where(M <= 1.0, 0.15 + 3*(M - 0.9),
+                              0.45/np.sqrt(np.maximum(M, 1.0))))
+        return _scaleRows(-0.5*self.A*self.rho*C*s, V)
+    def kernel(self):
+        return ("bulletDrag", (self.A*self.rho,), None)
         
 class GolfBallDrag(BasicForce):
     """
     Air drag acting on a golf ball using the model of Giordano
     and Nakanishi (Section 2.5)
     """
+    dependsOnT = False
+    dependsOnX = False
     def __init__(self):
         # Golf ball has a diameter of 42.67 mm
         self.A = math.pi * 42.67e-3**2 / 4.0
@@ -167,25 +491,45 @@ class GolfBallDrag(BasicForce):
         else:
             C = 7.0/s
         return -C*self.A*self.rho*s*v
+    def evalBatch(self, t, X, V):
+        s = _speeds(V)
+        C = np.where(s < 14.0, 0.5, 7.0/np.maximum(s, 14.0))
+        return _scaleRows(-self.A*self.rho*C*s, V)
+    def kernel(self):
+        return ("golfBallDrag", (self.A*self.rho,), None)
 
 class AltitudeDrag(BasicForce):
     """
     Quadratic drag with air density dependence on altitude using
     isothermal atmosphere
     """
+    dependsOnT = False
     def __init__(self, dragCoefficient, frontalArea, seaLevelAirDensity):
         self.C = dragCoefficient
         self.A = frontalArea
         self.rho0 = seaLevelAirDensity
         self.y0 = 1.0e4
     def __call__(self, t, x, v):
-        rho = self.rho0*exp(-x.y/self.y0)
+        rho = self.rho0*math.exp(-x.y/self.y0)
         return -0.5*self.C*self.A*rho*abs(v)*v
+    def evalBatch(self, t, X, V):
+        rho = self.rho0*np.exp(-X[:,1]/self.y0)
+        return _scaleRows(-0.5*self.C*self.A*rho*_speeds(V), V)
 
 class RestoringForce(BasicForce):
     "Restoring force proportional to linear displacement"
+    dependsOnT = False
+    dependsOnV = False
     def __init__(self, springConstant, x0):
         self.springConstant = springConstant
         self.x0 = x0
     def __call__(self, t, x, v):
         return -self.springConstant*(x - self.x0)
+    def evalBatch(self, t, X, V):
+        return -self.springConstant*(X - _asArray(self.x0))
+    def kernel(self):
+        x0 = self.x0
+        if isinstance(x0, v3.V3):
+            x0 = (x0.x, x0.y, x0.z)
+        x0 = np.array(x0, dtype=np.float64).ravel()
+        return ("restoringForce", (self.springConstant,) + tuple(x0), len(x0))
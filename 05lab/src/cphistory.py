@@ -0,0 +1,461 @@
+"""
+This module implements storage for the histories accumulated by the ODE
+solvers of the Computational Physics course. Classes implemented in this
+file are:
+
+  StateLayout  -- Describes how particle states (floats, V3 vectors, or
+                  NumPy arrays) are mapped onto rows of float64 arrays.
+
+  ArrayHistory -- Growable history store backed by preallocated contiguous
+                  float64 arrays for time, coordinates, and velocities.
+
+  DecimatedHistory -- Keeps every Nth integration step (and the last one).
+
+  SampledHistory   -- Keeps only the states at requested times. These are
+                      interpolated on the fly from the two bracketing steps.
+
+  CallbackHistory  -- Passes every state to a user callable and stores
+                      nothing.
+
+All of these classes can be given to the "run" method of the ODE solvers
+(the "history" argument). The solver calls "start(t, x, v)" with the
+initial state, "append(t, x, v)" after every step, and "finish()" when
+the run is over. Note that the solver may update x and v in place between
+the calls, so the history sinks must not keep references to them.
+
+Solvers with dense output (see the cpode module) also call the method
+"setAcceleration(a)" of the sinks whose "storesAccelerations" member is
+True. The accelerations arrive in the order of the history points, but
+one step later than the points themselves: the acceleration at a point
+becomes known only when the solver makes the step which starts there.
+"""
+
+import numpy as np
+from v3 import V3
+from interpolate import interpolate_linear, interpolate_Hermite, \
+                        interpolate_Hermite_quintic
+
+
+class StateLayout:
+    """
+    Describes the memory layout of a particle state. The layout is
+    determined from an example state:
+
+      float (or anything convertible to float) -- one float64 number
+      V3                                       -- three float64 numbers
+      NumPy array                              -- array of the same shape
+
+    States of any other type are stored as Python object references.
+    """
+    def __init__(self, state):
+        if isinstance(state, V3):
+            self.kind = "V3"
+            self.shape = (3,)
+            self.dtype = np.float64
+        elif isinstance(state, np.ndarray):
+            self.kind = "array"
+            self.shape = state.shape
+            self.dtype = np.float64
+        else:
+            try:
+                float(state)
+            except TypeError:
+                self.kind = "object"
+                self.dtype = object
+            else:
+                self.kind = "float"
+                self.dtype = np.float64
+            self.shape = ()
+
+    def matches(self, state):
+        "Check whether another state has the same layout"
+        if self.kind == "V3":
+            return isinstance(state, V3)
+        elif self.kind == "array":
+            return isinstance(state, np.ndarray) and state.shape == self.shape
+        elif self.kind == "float":
+            return not isinstance(state, (V3, np.ndarray))
+        else:
+            return True
+
+    def allocate(self, n):
+        "Allocate storage for n states"
+        return np.empty((n,) + self.shape, dtype=self.dtype)
+
+    def store(self, buffer, i, state):
+        "Copy the state into row i of the buffer"
+        if self.kind == "V3":
+            row = buffer[i]
+            row[0] = state.x
+            row[1] = state.y
+            row[2] = state.z
+        else:
+            buffer[i] = state
+
+    def box(self, row):
+        "Convert a row of the buffer back into an independent state object"
+        if self.kind == "V3":
+            return V3(row[0], row[1], row[2])
+        elif self.kind == "array":
+            return np.array(row, dtype=np.float64)
+        elif self.kind == "float":
+            return float(row)
+        else:
+            return row
+
+
+class ArrayHistory:
+    """
+    History store for ODE integration runs. Time stamps, coordinates,
+    and velocities are copied into preallocated contiguous float64 arrays
+    whose capacity is doubled whenever they fill up. The accumulated
+    history is available as NumPy views (no copying) through the "t",
+    "x", and "v" properties. For V3 states, "x" and "v" have shape
+    (n, 3). For NumPy array states of shape s, they have shape (n,) + s.
+
+    If the solver provides dense output, the accelerations at the history
+    points are stored as well (the "a" property). These are used by the
+    "interpolate" method of the solver.
+    """
+    storesAccelerations = True
+
+    def __init__(self, capacity=1024):
+        if capacity < 2:
+            capacity = 2
+        self.capacity = int(capacity)
+        self.layout = None
+        self._n = 0
+        self._na = 0
+        self._t = None
+        self._x = None
+        self._v = None
+        self._a = None
+
+    def _allocate(self, x):
+        self.layout = StateLayout(x)
+        self._t = np.empty(self.capacity, dtype=np.float64)
+        self._x = self.layout.allocate(self.capacity)
+        self._v = self.layout.allocate(self.capacity)
+        self._a = None
+        self._n = 0
+        self._na = 0
+
+    def start(self, t, x, v):
+        "Begin a new history with the initial state"
+        self._allocate(x)
+        ArrayHistory.append(self, t, x, v)
+
+    def _resize(self, capacity):
+        for name in ("_t", "_x", "_v", "_a"):
+            old = getattr(self, name)
+            if old is not None:
+                new = np.empty((capacity,) + old.shape[1:], dtype=old.dtype)
+                new[:self._n] = old[:self._n]
+                setattr(self, name, new)
+        self.capacity = capacity
+
+    def _grow(self):
+        self._resize(2*self.capacity)
+
+    # Only the filled part of the buffers is pickled (for example, into
+    # the checkpoint files). The spare capacity is restored on unpickling.
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self._t is not None:
+            for name in ("_t", "_x", "_v", "_a"):
+                if state[name] is not None:
+                    state[name] = state[name][:self._n]
+            state["capacity"] = self._n
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self._t is not None:
+            self._resize(max(2*self._n, 2))
+
+    def append(self, t, x, v):
+        "Add the state at time t to the history"
+        n = self._n
+        if n == self.capacity:
+            self._grow()
+        self._t[n] = t
+        self.layout.store(self._x, n, x)
+        self.layout.store(self._v, n, v)
+        self._n = n + 1
+
+    # Add a state which has already been converted into buffer rows
+    def _appendRows(self, t, xRow, vRow):
+        n = self._n
+        if n == self.capacity:
+            self._grow()
+        self._t[n] = t
+        self._x[n] = xRow
+        self._v[n] = vRow
+        self._n = n + 1
+
+    # Direct access to the buffers for the compiled integration loops
+    # (see the cpkernels module). Returns the time buffer and the views
+    # of the coordinate, velocity, and (if "dense" is True) acceleration
+    # buffers with shape (capacity, dim).
+    def _rowBuffers(self, dim, dense):
+        if dense and self._a is None:
+            self._a = self.layout.allocate(self.capacity)
+        a = None
+        if dense:
+            a = self._a.reshape(self.capacity, dim)
+        return self._t, self._x.reshape(self.capacity, dim), \
+               self._v.reshape(self.capacity, dim), a
+
+    # Set the number of points filled by the compiled loops. Points
+    # n - 1 and later do not have the accelerations yet.
+    def _setLength(self, n, dense):
+        self._n = n
+        if dense:
+            self._na = n - 1
+
+    def setAcceleration(self, a):
+        "Set the acceleration for the earliest point which does not have it"
+        if self._a is None:
+            self._a = self.layout.allocate(self.capacity)
+        self.layout.store(self._a, self._na, a)
+        self._na += 1
+
+    def finish(self):
+        "Called by the solver once the run is completed"
+        pass
+
+    def __len__(self):
+        return self._n
+
+    def hasAccelerations(self):
+        "Returns True if the accelerations are known for all history points"
+        return self._n > 0 and self._na == self._n
+
+    @property
+    def t(self):
+        return self._t[:self._n]
+
+    @property
+    def x(self):
+        return self._x[:self._n]
+
+    @property
+    def v(self):
+        return self._v[:self._n]
+
+    @property
+    def a(self):
+        if self._a is None:
+            return None
+        return self._a[:self._na]
+
+    def state(self, i):
+        "Returns the tuple t, x, v for history point i as independent objects"
+        return float(self._t[i]), self.layout.box(self._x[i]), \
+               self.layout.box(self._v[i])
+
+    def acceleration(self, i):
+        "Returns the acceleration at history point i"
+        return self.layout.box(self._a[i])
+
+
+class DecimatedHistory(ArrayHistory):
+    """
+    History store which keeps only every Nth integration step. The initial
+    and the final states of the run are always kept. Accelerations are not
+    stored, so the solver interpolates decimated histories with the cubic
+    Hermite method.
+    """
+    storesAccelerations = False
+
+    def __init__(self, every, capacity=1024):
+        if every < 1:
+            raise ValueError("Decimation factor must be positive")
+        ArrayHistory.__init__(self, capacity)
+        self.every = int(every)
+
+    def start(self, t, x, v):
+        ArrayHistory.start(self, t, x, v)
+        self._count = 0
+        # One-row scratch buffers for the most recent state
+        self._lastT = t
+        self._lastX = self.layout.allocate(1)
+        self._lastV = self.layout.allocate(1)
+        self._lastKept = True
+
+    def append(self, t, x, v):
+        self._count += 1
+        if self._count % self.every == 0:
+            ArrayHistory.append(self, t, x, v)
+            self._lastKept = True
+        else:
+            self._lastT = t
+            self.layout.store(self._lastX, 0, x)
+            self.layout.store(self._lastV, 0, v)
+            self._lastKept = False
+
+    def finish(self):
+        if not self._lastKept:
+            self._appendRows(self._lastT, self._lastX[0], self._lastV[0])
+            self._lastKept = True
+
+
+class SampledHistory(ArrayHistory):
+    """
+    History store which keeps only the states at the requested times
+    (for example, once per driving period for Poincare sections). Each
+    sample is interpolated as soon as the integration passes its time,
+    from the two bracketing steps. For solvers with dense output, the
+    interpolation is quintic Hermite in the coordinates (the samples are
+    then produced one step later, when the acceleration at the end of the
+    step becomes known). Otherwise, the cubic Hermite interpolation is
+    used for the coordinates and the linear interpolation for velocities.
+    The memory used does not depend on the length of the run. Requested
+    times outside of the simulated interval are never filled, so the
+    history may end up shorter than the list of times. For runs backward
+    in time, the samples are stored in the order of decreasing times.
+    """
+    def __init__(self, times):
+        self.times = np.sort(np.asarray(times, dtype=np.float64).ravel())
+        ArrayHistory.__init__(self, len(self.times))
+
+    def start(self, t, x, v):
+        self._allocate(x)
+        # Scratch rows for the two most recent states (row 0 is
+        # the earlier one) and for the acceleration at row 0
+        self._rowT = [t, t]
+        self._rowX = self.layout.allocate(2)
+        self._rowV = self.layout.allocate(2)
+        self._rowA = self.layout.allocate(1)
+        self._dense = False
+        self._pending = False
+        # The direction of the run becomes known with the first step
+        self._direction = 0
+        self._order = self.times
+        self._next = 0
+        k = int(np.searchsorted(self.times, t, side="left"))
+        if k < len(self.times) and self.times[k] == t:
+            ArrayHistory.append(self, t, x, v)
+        self._remember(0, t, x, v)
+
+    # Order the sample times in the direction of the run and skip
+    # the times which precede its start (already sampled at t0)
+    def _setDirection(self, t):
+        t0 = self._rowT[0]
+        if t >= t0:
+            self._direction = 1
+            self._order = self.times
+            self._next = int(np.searchsorted(self.times, t0, side="right"))
+        else:
+            self._direction = -1
+            self._order = self.times[::-1]
+            self._next = len(self.times) - int(
+                np.searchsorted(self.times, t0, side="left"))
+
+    def _remember(self, row, t, x, v):
+        self._rowT[row] = t
+        self.layout.store(self._rowX, row, x)
+        self.layout.store(self._rowV, row, v)
+
+    # Fill the samples inside the interval between (t0, x0, v0) and
+    # (t, x, v). Accelerations a0 and a1 are None for the cubic method.
+    def _sample(self, t0, x0, v0, a0, t, x, v, a1):
+        times = self._order
+        ntimes = len(times)
+        while self._next < ntimes and \
+                  (times[self._next] - t)*self._direction <= 0.0:
+            tSample = times[self._next]
+            if tSample == t:
+                ArrayHistory.append(self, t, x, v)
+            elif a0 is None:
+                xSample = interpolate_Hermite(tSample, t0, x0, v0, t, x, v)
+                vSample = interpolate_linear(tSample, t0, v0, t, v)
+                ArrayHistory.append(self, tSample, xSample, vSample)
+            else:
+                xSample, vSample = interpolate_Hermite_quintic(
+                    tSample, t0, x0, v0, a0, t, x, v, a1)
+                ArrayHistory.append(self, tSample, xSample, vSample)
+            self._next += 1
+
+    def _boxRow(self, row):
+        return self._rowT[row], self.layout.box(self._rowX[row]), \
+               self.layout.box(self._rowV[row])
+
+    def _needSample(self, t):
+        return self._next < len(self._order) and \
+               (self._order[self._next] - t)*self._direction <= 0.0
+
+    # Process the pending interval between rows 0 and 1
+    def _flush(self, a1):
+        if self._needSample(self._rowT[1]):
+            t0, x0, v0 = self._boxRow(0)
+            t1, x1, v1 = self._boxRow(1)
+            a0 = None
+            if a1 is not None:
+                a0 = self.layout.box(self._rowA[0])
+            self._sample(t0, x0, v0, a0, t1, x1, v1, a1)
+        self._rowT[0] = self._rowT[1]
+        self._rowX[0] = self._rowX[1]
+        self._rowV[0] = self._rowV[1]
+        self._pending = False
+
+    def setAcceleration(self, a):
+        if self._pending:
+            self._flush(a)
+        self.layout.store(self._rowA, 0, a)
+        self._dense = True
+
+    def append(self, t, x, v):
+        if not self._direction:
+            self._setDirection(t)
+        if self._dense:
+            # Wait for the acceleration at the end of the step
+            self._remember(1, t, x, v)
+            self._pending = True
+        else:
+            if self._needSample(t):
+                t0, x0, v0 = self._boxRow(0)
+                self._sample(t0, x0, v0, None, t, x, v, None)
+            self._remember(0, t, x, v)
+
+    def finish(self):
+        if self._pending:
+            self._flush(None)
+
+
+class CallbackHistory:
+    """
+    History sink which stores nothing. Instead, the callable provided
+    in the constructor is called as callback(t, x, v) with the initial
+    state and after every integration step. The solver updates x and v
+    in place, so the callback should copy them if it needs to keep them.
+    Once the run is completed, the "t", "x", and "v" members of this
+    object (and of the solver) contain the final state.
+    """
+    storesAccelerations = False
+
+    def __init__(self, callback):
+        self.callback = callback
+        self.t = None
+        self.x = None
+        self.v = None
+        self._n = 0
+
+    def start(self, t, x, v):
+        self._n = 0
+        self.append(t, x, v)
+
+    def append(self, t, x, v):
+        self.callback(t, x, v)
+        self._n += 1
+        self.t = t
+        self.x = x
+        self.v = v
+
+    def finish(self):
+        # Detach the final state from the running variables of the solver
+        self.x = self.x*1.0
+        self.v = self.v*1.0
+
+    def __len__(self):
+        return self._n
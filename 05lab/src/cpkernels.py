@@ -0,0 +1,469 @@
+"""
+This module implements the optional compiled backend of the ODE solvers
+for the Computational Physics course. The compilation is performed by
+numba (http://numba.pydata.org). If numba is not installed, the module
+can still be imported but the backend is not available, and the solvers
+run their usual Python integration loops.
+
+The backend runs complete constant step and adaptive step integration
+loops of the explicit Runge-Kutta schemes natively, without calling
+Python code at each step. It works for force models which provide
+a kernel description through their "kernel" method (see the cpforces
+module). The descriptions are plain tuples (name, params, dim), where
+"name" is the name of one of the compiled force functions of this module
+and "params" is the sequence of its parameters. The combinations of
+forces are described by ("linearCombination", terms, None), where "terms"
+is a sequence of (coefficient, description) pairs. The "build" function
+turns a description into the kernel. Kernels are tuples (function,
+params, dim):
+
+  function -- A compiled function called as function(t, x, v, p, c, out).
+              It must add c times the force at (t, x, v) to the array
+              "out". x, v, and out are 1-d float64 arrays with one
+              element per dimension, p is the float64 array of parameters.
+
+  params   -- 1-d float64 array of parameters passed to the function.
+
+  dim      -- Dimensionality of the states the kernel works with,
+              or None if the kernel works in any dimension.
+
+The functions of this module which build kernels return None when the
+backend is not available.
+"""
+
+import math
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+available = numba is not None
+
+# Small functions called inside the integration loops are inlined
+# by numba at the level of its intermediate representation. Otherwise
+# the call overhead dominates the cost of a force evaluation.
+if available:
+    _njit = numba.njit
+    _inline = numba.njit(inline="always")
+else:
+    def _njit(f):
+        return f
+    _inline = _njit
+
+# Status codes returned by the integration loop
+FINISHED = 0
+BUFFER_FULL = 1
+TOO_MANY_TRIES = 2
+BAD_TOLERANCE = 3
+
+def makeKernel(function, params=(), dim=None):
+    "Pack the kernel tuple. Returns None if the backend is not available."
+    if not available:
+        return None
+    return function, np.array(params, dtype=np.float64).ravel(), dim
+
+def build(description):
+    """
+    Build the kernel from its description returned by the "kernel" method
+    of a force model. Returns None if the description is None, if it names
+    an unknown function, or if the backend is not available.
+    """
+    if description is None or not available:
+        return None
+    name, params, dim = description
+    if name == "linearCombination":
+        return linearCombination([(coeff, build(term)) for coeff, term in params])
+    function = _forceFunctions.get(name)
+    if function is None:
+        return None
+    return makeKernel(function, params, dim)
+
+###########################################################################
+#
+# Compiled force functions
+#
+###########################################################################
+
+@_inline
+def _norm(a):
+    s = 0.0
+    for i in range(a.shape[0]):
+        s += a[i]*a[i]
+    return math.sqrt(s)
+
+@_inline
+def constantForce(t, x, v, p, c, out):
+    for i in range(out.shape[0]):
+        out[i] += c*p[i]
+
+@_inline
+def magnusForce(t, x, v, p, c, out):
+    out[0] += c*(p[1]*v[2] - p[2]*v[1])
+    out[1] += c*(p[2]*v[0] - p[0]*v[2])
+    out[2] += c*(p[0]*v[1] - p[1]*v[0])
+
+@_inline
+def quadraticDrag(t, x, v, p, c, out):
+    # p[0] is 0.5*C*A*rho
+    f = -c*p[0]*_norm(v)
+    for i in range(out.shape[0]):
+        out[i] += f*v[i]
+
+@_inline
+def bulletDrag(t, x, v, p, c, out):
+    # p[0] is the product of the frontal area and the air density
+    s = _norm(v)
+    M = s/340.0
+    if M <= 0.9:
+        C = 0.15
+    elif M <= 1.0:
+        C = 0.15 + 3*(M - 0.9)
+    else:
+        C = 0.45/math.sqrt(M)
+    f = -c*0.5*C*p[0]*s
+    for i in range(out.shape[0]):
+        out[i] += f*v[i]
+
+@_inline
+def golfBallDrag(t, x, v, p, c, out):
+    # p[0] is the product of the frontal area and the air density
+    s = _norm(v)
+    if s < 14.0:
+        C = 0.5
+    else:
+        C = 7.0/s
+    f = -c*C*p[0]*s
+    for i in range(out.shape[0]):
+        out[i] += f*v[i]
+
+@_inline
+def restoringForce(t, x, v, p, c, out):
+    # p[0] is the spring constant, p[1:] is the equilibrium position
+    for i in range(out.shape[0]):
+        out[i] -= c*p[0]*(x[i] - p[1 + i])
+
+@_inline
+def drivenPendulum(t, x, v, p, c, out):
+    # p is (omega0, q, F_D, omegaD)
+    out[0] += c*(-p[0]*p[0]*math.sin(x[0]) - p[1]*v[0] +
+                 p[2]*math.cos(p[3]*t))
+
+# Compiled force functions by the names used in the kernel descriptions
+_forceFunctions = dict(constantForce=constantForce, magnusForce=magnusForce,
+                       quadraticDrag=quadraticDrag, bulletDrag=bulletDrag,
+                       golfBallDrag=golfBallDrag, restoringForce=restoringForce,
+                       drivenPendulum=drivenPendulum)
+
+###########################################################################
+#
+# Linear combinations of kernels (used by cpforces.CompositeForce)
+#
+###########################################################################
+
+# Fused functions are cached by the structure of the combination,
+# so that numba compiles each structure only once
+_fusedCache = dict()
+
+def _scaled(f):
+    @_inline
+    def scaled(t, x, v, p, c, out):
+        f(t, x, v, p[1:], c*p[0], out)
+    return scaled
+
+def _pair(f1, n1, f2):
+    @_inline
+    def pair(t, x, v, p, c, out):
+        f1(t, x, v, p[:n1], c, out)
+        f2(t, x, v, p[n1:], c, out)
+    return pair
+
+def linearCombination(terms):
+    """
+    Kernel of the linear combination of forces. The argument is
+    a sequence of (coefficient, kernel) pairs. Returns None if any
+    of the kernels is None or if their dimensions are inconsistent.
+    """
+    if not available or not terms:
+        return None
+    dim = None
+    for coeff, kernel in terms:
+        if kernel is None:
+            return None
+        if kernel[2] is not None:
+            if dim is not None and dim != kernel[2]:
+                return None
+            dim = kernel[2]
+    key = tuple((kernel[0], len(kernel[1])) for coeff, kernel in terms)
+    fused = _fusedCache.get(key)
+    if fused is None:
+        fused = _scaled(terms[0][1][0])
+        nFused = len(terms[0][1][1]) + 1
+        for coeff, kernel in terms[1:]:
+            fused = _pair(fused, nFused, _scaled(kernel[0]))
+            nFused += len(kernel[1]) + 1
+        _fusedCache[key] = fused
+    params = []
+    for coeff, kernel in terms:
+        params.append(coeff)
+        params.extend(kernel[1])
+    return makeKernel(fused, params, dim)
+
+###########################################################################
+#
+# Integration loops
+#
+###########################################################################
+
+def tableau(c, a, b, e=None, e3=None, fsal=False):
+    """
+    Convert the Butcher tableau of an explicit Runge-Kutta scheme into
+    the form used by the integration loop. "a" is the sequence of the
+    lower triangular rows of stage coefficients (the first row is empty).
+    The error weights "e" (and "e3" for the DOP853 error estimate) may
+    include one extra weight for the force evaluation at the end of the
+    step. If "fsal" is True, this evaluation is reused by the next step.
+    """
+    nstages = len(c)
+    A = np.zeros((nstages, nstages))
+    for i, row in enumerate(a):
+        A[i, :len(row)] = row
+    errMode = 0
+    E = np.zeros(nstages + 1)
+    E3 = np.zeros(nstages + 1)
+    if e is not None:
+        errMode = 1
+        E[:len(e)] = e
+        if e3 is not None:
+            errMode = 2
+            E3[:len(e3)] = e3
+    endStage = fsal or (e is not None and len(e) > nstages)
+    return (np.array(c, dtype=np.float64), A,
+            np.array(b, dtype=np.float64), E, E3, errMode, endStage, fsal)
+
+# Compiled integration loops, by force function
+_integrators = dict()
+
+def integrator(force):
+    """
+    Returns the compiled integration loop for the given force function
+    (the first element of the kernel tuple). The force function is built
+    into the loop rather than passed as an argument because numba calls
+    functions passed as arguments much more slowly. The loops are cached,
+    so numba compiles the loop only once for each force function.
+    """
+    loop = _integrators.get(force)
+    if loop is None:
+        loop = _makeIntegrator(force)
+        _integrators[force] = loop
+    return loop
+
+def _makeIntegrator(force):
+    @_inline
+    def _acceleration(p, mass, t, x, v, out):
+        out[:] = 0.0
+        force(t, x, v, p, 1.0, out)
+        for i in range(out.shape[0]):
+            out[i] /= mass
+
+    # One Runge-Kutta step. The first stage acceleration is kv[0].
+    # Fills dx, dv and, if needed, the acceleration at the end of
+    # the step (in kv[nstages]). Returns the error estimates.
+    @_njit
+    def _rkStep(p, mass, c, A, b, E, E3, errMode, endStage,
+                dt, t, x, v, kx, kv, xs, vs, dx, dv):
+        nstages = c.shape[0]
+        dim = x.shape[0]
+        for j in range(dim):
+            kx[0, j] = v[j]
+        for i in range(1, nstages):
+            for j in range(dim):
+                sx = 0.0
+                sv = 0.0
+                for k in range(i):
+                    sx += A[i, k]*kx[k, j]
+                    sv += A[i, k]*kv[k, j]
+                xs[j] = x[j] + dt*sx
+                vs[j] = v[j] + dt*sv
+                kx[i, j] = vs[j]
+            _acceleration(p, mass, t + c[i]*dt, xs, vs, kv[i])
+        for j in range(dim):
+            sx = 0.0
+            sv = 0.0
+            for k in range(nstages):
+                sx += b[k]*kx[k, j]
+                sv += b[k]*kv[k, j]
+            dx[j] = dt*sx
+            dv[j] = dt*sv
+        nterms = nstages
+        if endStage:
+            for j in range(dim):
+                xs[j] = x[j] + dx[j]
+                vs[j] = v[j] + dv[j]
+                kx[nstages, j] = vs[j]
+            _acceleration(p, mass, t + dt, xs, vs, kv[nstages])
+            nterms = nstages + 1
+        if errMode == 0:
+            return 0.0, 0.0
+        errX5 = 0.0
+        errV5 = 0.0
+        errX3 = 0.0
+        errV3 = 0.0
+        for j in range(dim):
+            sx = 0.0
+            sv = 0.0
+            sx3 = 0.0
+            sv3 = 0.0
+            for k in range(nterms):
+                sx += E[k]*kx[k, j]
+                sv += E[k]*kv[k, j]
+                sx3 += E3[k]*kx[k, j]
+                sv3 += E3[k]*kv[k, j]
+            errX5 += (dt*sx)**2
+            errV5 += (dt*sv)**2
+            errX3 += (dt*sx3)**2
+            errV3 += (dt*sv3)**2
+        if errMode == 1:
+            return math.sqrt(errX5), math.sqrt(errV5)
+        # Combination of the 5th and 3rd order estimates used by DOP853
+        errX = 0.0
+        errV = 0.0
+        if errX5 + 0.01*errX3 > 0.0:
+            errX = errX5/math.sqrt(errX5 + 0.01*errX3)
+        if errV5 + 0.01*errV3 > 0.0:
+            errV = errV5/math.sqrt(errV5 + 0.01*errV3)
+        return errX, errV
+
+    @_njit
+    def integrate(p, mass, c, A, b, E, E3, errMode, endStage, fsal,
+                  adaptive, order, tolerances, control, stopMode, tmax,
+                  clock, x, v, a0, stats, record, dense, tOut, xOut, vOut, aOut, n):
+        """
+        Integration loop. The loop state is kept in the arrays, so that the
+        loop can be resumed after the Python code enlarges the output buffers:
+
+        clock      -- (t, dt, nsteps, previous error ratio, a0 is valid flag)
+        x, v, a0   -- Current coordinate, velocity, and acceleration
+        stats      -- (steps made, steps rejected)
+
+        tolerances are (absTolX, relTolX, absTolV, relTolV, useX, useV).
+        control is (stepIncreaseTrigger, maxStepFactor, minStepFactor,
+        smallestDecrease, usePIController, piAlpha, piBeta). stopMode 0 means
+        TimeLimit(tmax), stopMode 1 means AboveGround. If "record" is True,
+        the states are written into the output buffers starting from row n.
+        Returns the tuple (number of rows filled, status code).
+        """
+        nstages = c.shape[0]
+        dim = x.shape[0]
+        capacity = tOut.shape[0]
+        kx = np.empty((nstages + 1, dim))
+        kv = np.empty((nstages + 1, dim))
+        xs = np.empty(dim)
+        vs = np.empty(dim)
+        dx = np.empty(dim)
+        dv = np.empty(dim)
+        t = clock[0]
+        dt = clock[1]
+        nsteps = clock[2]
+        trigger = control[0]
+        errPower = 1.0/(1.0 + order)
+        maxtries = 20
+        status = FINISHED
+        while True:
+            if stopMode == 0:
+                if not (t < tmax):
+                    break
+            elif not (x[1] >= 0.0):
+                break
+            if record and n == capacity:
+                status = BUFFER_FULL
+                break
+            if clock[4] == 0.0:
+                _acceleration(p, mass, t, x, v, a0)
+                clock[4] = 1.0
+            for j in range(dim):
+                kv[0, j] = a0[j]
+            if adaptive:
+                dt_in = dt
+                optimal_dt = dt_in
+                xMagnitude = _norm(x)
+                vMagnitude = _norm(v)
+                minStepSizeReached = False
+                itry = 0
+                while itry < maxtries:
+                    h = optimal_dt
+                    errX, errV = _rkStep(p, mass, c, A, b, E, E3, errMode,
+                                         endStage, h, t, x, v, kx, kv, xs, vs, dx, dv)
+                    nTerms = 0
+                    xRatio = 0.0
+                    if tolerances[4] != 0.0:
+                        tolX = tolerances[0] + max(xMagnitude, _norm(dx))*tolerances[1]
+                        if not (tolX > 0.0):
+                            return n, BAD_TOLERANCE
+                        xRatio = errX/tolX
+                        nTerms += 1
+                    vRatio = 0.0
+                    if tolerances[5] != 0.0:
+                        tolV = tolerances[2] + max(vMagnitude, _norm(dv))*tolerances[3]
+                        if not (tolV > 0.0):
+                            return n, BAD_TOLERANCE
+                        vRatio = errV/tolV
+                        nTerms += 1
+                    eRatio = math.sqrt((xRatio*xRatio + vRatio*vRatio)/nTerms)
+                    if eRatio <= 1.0:
+                        if control[4] != 0.0:
+                            ratio = max(eRatio, 1.0e-10)
+                            factor = (trigger/ratio)**(control[5]*errPower)* \
+                                     (clock[3]/trigger)**(control[6]*errPower)
+                            clock[3] = ratio
+                            optimal_dt = h*min(max(factor, control[2]), control[1])
+                        elif eRatio < trigger:
+                            optimal_dt = h/(eRatio/trigger)**errPower
+                            if optimal_dt/dt_in > control[1]:
+                                optimal_dt = dt_in*control[1]
+                        break
+                    else:
+                        if minStepSizeReached:
+                            break
+                        optimal_dt = h/(eRatio/math.sqrt(trigger))**errPower
+                        if optimal_dt/dt_in > control[3]:
+                            optimal_dt = dt_in*control[3]
+                        if optimal_dt/dt_in < control[2]:
+                            optimal_dt = dt_in*control[2]
+                            minStepSizeReached = True
+                    itry += 1
+                if itry + 1 >= maxtries:
+                    return n, TOO_MANY_TRIES
+                stats[1] += itry
+                t += h
+                dt = optimal_dt
+            else:
+                _rkStep(p, mass, c, A, b, E, E3, errMode, endStage,
+                        dt, t, x, v, kx, kv, xs, vs, dx, dv)
+                nsteps += 1.0
+                t = dt*nsteps
+            stats[0] += 1
+            if record and dense:
+                for j in range(dim):
+                    aOut[n - 1, j] = a0[j]
+            for j in range(dim):
+                x[j] += dx[j]
+                v[j] += dv[j]
+            if fsal:
+                for j in range(dim):
+                    a0[j] = kv[nstages, j]
+            else:
+                clock[4] = 0.0
+            if record:
+                tOut[n] = t
+                for j in range(dim):
+                    xOut[n, j] = x[j]
+                    vOut[n, j] = v[j]
+                n += 1
+        clock[0] = t
+        clock[1] = dt
+        clock[2] = nsteps
+        return n, status
+
+    return integrate
@@ -4,12 +4,27 @@ for the Computational Physics course. Classes implemented in this file are:
 
   OdeSolver   -- A base class for solving particle motion ODEs. Runs ODE
                  integration sequences with both constant and adaptive
-                 step sizes.
+                 step sizes, for single trajectories or for ensembles
+                 of trajectories stored in NumPy arrays.
+
+  PreparedRun -- Integration settings validated once, for launching many
+                 runs with different initial conditions.
+
+  StepTelemetry -- Optional instrumentation of the integration runs:
+                 step size profiles, error ratios, rejected trials,
+                 force evaluation counts, and timing.
 
   EulerSolver -- Implements the Euler ODE solving scheme.
 
   EulerCromer -- Implements the Euler-Cromer ODE solving scheme.
 
+  VelocityVerlet -- Implements the 2nd order velocity Verlet scheme
+                 (symplectic, for forces which depend only on coordinates).
+
+  Yoshida4    -- Implements the 4th order symplectic Yoshida scheme.
+
+  Yoshida6    -- Implements the 6th order symplectic Yoshida scheme.
+
   RK4         -- Implements the 4th order Runge-Kutta ODE solving scheme.
 
   RK6         -- Implements the 6th order Runge-Kutta ODE solving scheme.
@@ -18,6 +33,20 @@ for the Computational Physics course. Classes implemented in this file are:
                  method with an embedded 4th order Runge-Kutta scheme. Can be
                  used with an adaptive step size adjustment.
 
+  EmbeddedRungeKutta -- A base class for embedded Runge-Kutta schemes defined
+                 by their Butcher tableaux, with the "first same as last"
+                 reuse of the force evaluation at the end of the step.
+
+  DOPRI5      -- Implements the 5th order Dormand-Prince method with an
+                 embedded 4th order error estimate.
+
+  DOP853      -- Implements the 8th order Dormand-Prince method with embedded
+                 5th and 3rd order error estimates.
+
+  Rosenbrock23 -- Implements the linearly implicit 2nd order Rosenbrock
+                 method with an embedded 3rd order error estimate, for
+                 stiff force models. Uses finite difference Jacobians.
+
   TimeLimit   -- A running condition for use with either "run" or "evolve"
                  method of the OdeSolver class and all classes derived from
                  OdeSolver. Stops ODE integration when a predefined time
@@ -25,15 +54,35 @@ for the Computational Physics course. Classes implemented in this file are:
 
   AboveGround -- Stops ODE integration when the y coordinate of a particle
                  becomes negative.
+
+  Event       -- Base class for event functions whose zero crossings are
+                 located precisely inside the integration steps.
+
+  EventFunction -- Wraps an arbitrary callable into an event function.
+
+  GroundImpact  -- Terminal event for a particle hitting the ground.
+
+The integration loops of the explicit Runge-Kutta schemes can optionally
+be run natively by the compiled backend implemented in the cpkernels module.
 """
 
 __author__="Igor Volobouev (i.volobouev@ttu.edu)"
 __version__="0.7"
 __date__ ="Jan 31 2018"
 
+import os
+import sys
 import math
-from bisect import bisect_right
-from interpolate import interpolate_linear, interpolate_Hermite
+import time
+import pickle
+import numpy as np
+import dop853Coefficients
+from interpolate import interpolate_linear, interpolate_Hermite, \
+                        interpolate_Hermite_quintic, find_intervals, \
+                        interpolate_linear_array, interpolate_Hermite_array, \
+                        interpolate_Hermite_quintic_array
+from cphistory import ArrayHistory, StateLayout
+from cptrajectory import Trajectory
 
 # Follow the "Don't Repeat Yourself" principle. Put the common interface
 # definitions together with the common code into the base class.
@@ -48,21 +97,68 @@ class OdeSolver:
     is desired, this function can return the tuple dx, dv, errX, errV
     where errX and errV are the scalars estimating the errors in coordinate
     and velocity steps, respectively. In this case the subclass must also
-    implement the method _order(self), returning expected order of errors
-    (the n in in O(dt^n) precision of the algorithm).
+    set the class variable _estimatesErrors to True and implement the method
+    _order(self), returning expected order of errors (the n in in O(dt^n)
+    precision of the algorithm).
 
     Also, the subclasses must define the class variable _name which
     should be set to a descriptive string naming the method.
 
     The subclasses may also provide the function _setup(self) which can
     be used for additional initialization.
+
+    Subclasses which set the class variable _denseOutput to True must
+    store the acceleration at the beginning of the step in the member
+    _startAcceleration every time _step is called (this is usually
+    available from the first stage of the scheme). The solver then keeps
+    the accelerations in the history, and the "interpolate" method uses
+    quintic Hermite interpolation whose error matches the order of the
+    schemes up to the 5th order.
+
+    Explicit Runge-Kutta schemes may implement _kernelTableau(self) which
+    returns the tuple (c, a, b, e, e3, fsal) describing the scheme (see
+    the "tableau" function of the cpkernels module). If the member
+    useCompiledKernels of the solver is set to True and the force model
+    provides a compiled kernel, the integration loops of such schemes
+    are then run natively by the cpkernels module (this requires numba).
+
+    Setting the member "telemetry" to a StepTelemetry object turns on
+    the instrumentation of the "run" and "evolve" methods (and of their
+    PreparedRun and ensemble counterparts). The telemetry object is
+    filled during each run, see the StepTelemetry class for details.
+    When the member is None (the default), nothing is recorded.
+
+    Long runs can be checkpointed by setting the member "checkpointFile"
+    to a file name. The complete state of the run is then saved into this
+    file every "checkpointInterval" seconds, and an interrupted run can
+    be continued with the "resume" method. Subclasses which keep some
+    state between the steps (for example, the force evaluation reused
+    by the next step) must list the names of the members holding this
+    state in the class variable _checkpointMembers, so that the resumed
+    run reproduces the uninterrupted one exactly.
     """
+    _denseOutput = False
+    _estimatesErrors = False
+    _checkpointMembers = ()
+
+    # Largest number of points preallocated by the default history store
+    _maxInitialCapacity = 65536
+
+    # Members which describe the state of a run in progress
+    _runMembers = ("t0", "x0", "v0", "stepsMade", "stepsRejected", "eventStates",
+                   "_eventValues", "_previousErrorRatio", "_events",
+                   "estimatesErrors", "adaptiveStepSize", "absTolX",
+                   "relTolX", "absTolV", "relTolV", "stepIncreaseTrigger",
+                   "maxStepFactor", "minStepFactor", "smallestDecrease",
+                   "usePIController", "piAlpha", "piBeta")
+
     def __init__(self, F, m=1.0):
         self.Force = F
         self.mass = m*1.0
         if (self.mass <= 0.0):
             raise ValueError("Photons and exotic matter are not supported")
         # Variables that can be checked once the simulation is completed
+        self.t0 = None
         self.x0 = None
         self.v0 = None
         self.t = None
@@ -76,11 +172,40 @@ class OdeSolver:
         self.relTolV = None
         self.stepsMade = None
         self.stepsRejected = None
+        self.history = None
+        self.eventStates = None
+        self._events = ()
         # Some parameters for step size adjustments
         self.stepIncreaseTrigger = 0.5
         self.maxStepFactor = 10.0
         self.minStepFactor = 0.2
         self.smallestDecrease = 1.0/math.sqrt(2.0)
+        # Parameters of the proportional-integral step size controller.
+        # If usePIController is True, the size of the next step after an
+        # accepted step depends on both the current and the previous error
+        # ratios which results in a smoother step size sequence with fewer
+        # rejected steps. Otherwise, only the current error ratio is used.
+        self.usePIController = False
+        self.piAlpha = 0.7
+        self.piBeta = 0.4
+        self._previousErrorRatio = None
+        # Set this to True in order to run the integration loops in
+        # the compiled backend whenever possible (see _compiledRun).
+        # The first run with a new force model will then take a few
+        # seconds longer while numba compiles the loop for this model.
+        self.useCompiledKernels = False
+        # Set this to a StepTelemetry object in order to profile the runs
+        self.telemetry = None
+        self._errorRatio = None
+        # Changes of the counters of an instrumented force model (see
+        # the InstrumentedForce class in the cpforces module) over the
+        # last run, as a dictionary. None for other force models.
+        self.forceStatistics = None
+        # Set checkpointFile to a file name in order to save the state
+        # of "run" and "evolve" periodically (see the "resume" method)
+        self.checkpointFile = None
+        self.checkpointInterval = 600.0
+        self._nextCheckpoint = None
         # Run the setup function. Subclasses may be
         # able to do something useful in it.
         self._setup()
@@ -100,6 +225,9 @@ class OdeSolver:
     def _order(self):
         raise NotImplementedError("Function not implemented")
 
+    def _kernelTableau(self):
+        return None
+
     # Check the validity of absolute plus relative tolerance pair
     @staticmethod
     def _checkTol(absTol, relTol):
@@ -109,24 +237,33 @@ class OdeSolver:
             raise ValueError("Some tolerances must be positive")
 
     # The following function will check the validity of arguments
-    # given to the "run" or "evolve" methods. It will also call
-    # the "_step" function once, in order to figure out whether it
-    # provides the error estimates.
-    def _validateRunArguments(self, xInitial, vInitial, dt,
-                              runningCondition, tolerances):
+    # given to the "run" or "evolve" methods
+    def _validateRunArguments(self, xInitial, vInitial, dt, runningCondition,
+                              tolerances, events=None, tInitial=0.0):
+        self._validateSettings(dt, runningCondition, tolerances, events)
+        self._startRun(xInitial, vInitial, tInitial)
+
+    # Check the time step, the tolerances, and the event functions.
+    # These do not depend on the initial conditions, so they need to
+    # be checked only once for many runs (see the PreparedRun class).
+    def _validateSettings(self, dt, runningCondition, tolerances, events):
         # Make sure dt can be converted into a float
         dt = dt*1.0
-        # Running the simulation backwards requires special care
-        # which is beyond our purposes here
-        assert dt > 0.0, "Can not run the simulation backward in time"
-        # Remember the initial conditions
-        self.x0 = xInitial*1.0
-        self.v0 = vInitial*1.0
-        self.stepsMade = 0
-        self.stepsRejected = 0
-        # Figure out if the class estimates the errors
-        stepTuple = self._step(dt, 0.0, self.x0, self.v0)
-        self.estimatesErrors = len(stepTuple) == 4
+        # Negative dt runs the simulation backward in time
+        if not (dt != 0.0 and math.isfinite(dt)):
+            raise ValueError("Time step must be finite and non-zero")
+        if isinstance(runningCondition, TimeLimit) and \
+               runningCondition.backward != (dt < 0.0):
+            raise ValueError("Direction of the time limit does not match "
+                             "the sign of the time step")
+        # Set up the event detection
+        if events is None:
+            events = ()
+        for event in events:
+            if not callable(event):
+                raise TypeError("Event functions must be callable")
+        self._events = tuple(events)
+        self.estimatesErrors = self._estimatesErrors
         # Unpack the tolerances and check their validity
         self.adaptiveStepSize = False
         self.absTolX = None
@@ -139,6 +276,7 @@ class OdeSolver:
             assert self.estimatesErrors, "Can not use tolerances with this ODE scheme"
             if len(tolerances) == 2:
                 absTolX, relTolX = tolerances
+                absTolV, relTolV = None, None
             elif len(tolerances) == 4:
                 absTolX, relTolX, absTolV, relTolV = tolerances
             else:
@@ -154,6 +292,17 @@ class OdeSolver:
                 self._checkTol(self.absTolV, self.relTolV)
                 self.adaptiveStepSize = True
 
+    # Remember the initial conditions and reset the run statistics
+    def _startRun(self, xInitial, vInitial, tInitial=0.0):
+        self.eventStates = [[] for event in self._events]
+        self.history = None
+        self.t0 = tInitial*1.0
+        self.x0 = xInitial*1.0
+        self.v0 = vInitial*1.0
+        self.stepsMade = 0
+        self.stepsRejected = 0
+        self._previousErrorRatio = self.stepIncreaseTrigger
+
     # Make a variable time step, adjusting dt as needed
     def _makeVariableSizeStep(self, dt_in, t, x, v):
         errPower = 1.0/(1.0 + self._order())
@@ -183,10 +332,13 @@ class OdeSolver:
                 nTerms += 1
 
             eRatio = math.sqrt((xRatio*xRatio + vRatio*vRatio)/nTerms)
+            self._errorRatio = eRatio
             if eRatio <= 1.0:
                 # The estimated error is smaller than the requested tolerance.
                 # Accept this step. Check if we want to increase the step size.
-                if eRatio < self.stepIncreaseTrigger:
+                if self.usePIController:
+                    optimal_dt = dt*self._piStepFactor(eRatio, errPower)
+                elif eRatio < self.stepIncreaseTrigger:
                     optimal_dt = dt/pow(eRatio/self.stepIncreaseTrigger, errPower)
                     if optimal_dt/dt_in > self.maxStepFactor:
                         optimal_dt = dt_in*self.maxStepFactor
@@ -207,111 +359,410 @@ class OdeSolver:
         assert itry + 1 < maxtries, "Something is wrong with the variabe step tuning"
         return dt, dx, dv, optimal_dt, itry
 
+    # Step size factor of the PI controller after an accepted step.
+    # The controller aims at the error ratio of stepIncreaseTrigger.
+    def _piStepFactor(self, eRatio, errPower):
+        trigger = self.stepIncreaseTrigger
+        ratio = max(eRatio, 1.0e-10)
+        factor = pow(trigger/ratio, self.piAlpha*errPower)* \
+                 pow(self._previousErrorRatio/trigger, self.piBeta*errPower)
+        self._previousErrorRatio = ratio
+        return min(max(factor, self.minStepFactor), self.maxStepFactor)
+
+    # Vectorized _piStepFactor for the ensemble trajectories with indices
+    # "rows". In the ensemble mode, _previousErrorRatio is an array.
+    def _piStepFactorEnsemble(self, eRatio, errPower, rows):
+        trigger = self.stepIncreaseTrigger
+        ratio = np.maximum(eRatio, 1.0e-10)
+        factor = np.power(trigger/ratio, self.piAlpha*errPower)* \
+                 np.power(self._previousErrorRatio[rows]/trigger, self.piBeta*errPower)
+        self._previousErrorRatio[rows] = ratio
+        return np.clip(factor, self.minStepFactor, self.maxStepFactor)
+
+    # Make a history store. For constant step runs with a time limit
+    # the number of steps is known in advance, so the buffers can be
+    # preallocated with the right size. The time limit is often just
+    # a backstop for a terminal event, so the preallocated size is capped
+    # at _maxInitialCapacity points, and the buffers grow as needed
+    # after that. Pass history=ArrayHistory(capacity) to "run" in order
+    # to preallocate more.
+    def _makeHistory(self, dt, runningCondition):
+        capacity = 1024
+        if not self.adaptiveStepSize and isinstance(runningCondition, TimeLimit):
+            nsteps = (runningCondition.tmax - self.t0)/dt
+            if nsteps < self._maxInitialCapacity:
+                capacity = max(math.ceil(nsteps) + 2, 2)
+            else:
+                capacity = self._maxInitialCapacity
+        return ArrayHistory(capacity)
+
     # Run the simulation with a constant time step, accumulating the history
-    def _runCS(self, dt, runningCondition):
+    def _runCS(self, dt, runningCondition, history, resumed=None):
         # Make sure dt is float. Then t will be float as well.
         dt = dt*1.0
-        # Initialize the running variables
-        t = 0.0
-        x = self.x0
-        v = self.v0
-        nsteps = 0
-        # Initialize the history
-        tHistory = [t,]
-        xHistory = [x,]
-        vHistory = [v,]
+        # Initialize the running variables. The history store copies
+        # the states into its own arrays, so x and v can be updated
+        # in place without creating new objects at every step.
+        if resumed is None:
+            if self._compiledRun(dt, runningCondition, history) is not None:
+                return
+            t = self.t0
+            x = self.x0*1.0
+            v = self.v0*1.0
+            nsteps = 0
+            # Initialize the history
+            history.start(t, x, v)
+            self._startEvents(t, x, v)
+        else:
+            t, x, v, dt, nsteps = resumed
+        dense = self._denseOutput and getattr(history, "storesAccelerations", False)
+        telemetry = self.telemetry
+        checkpointing = self._startCheckpoints()
+        t0 = self.t0
         # Cycle until the running condition is no longer true
         while (runningCondition(t, x, v)):
             dx, dv = self._step(dt, t, x, v)[:2]
-            x = x + dx
-            v = v + dv
-            # If we were not accumulating the history, the
-            # use of += operator would be more appropriate
-            # (i.e., x += dx, as used inside _evolveCS method).
-            # However, the += operator does not necessarily
-            # create a new object (x can be mutable), and we
-            # do not want to fill the history with references
-            # to the same object! This illustrates, again,
-            # the distinction between Python variables and
-            # variables in other programming languages.
-            #
-            # Also, we do not use t += dt (floats are immutable
-            # so the comment above does not apply) because this
-            # can lead to accumulation of round-off errors. For
-            # x and v (or for t in the variable step size method)
-            # we have no choice but here we can avoid it.
+            if dense:
+                history.setAcceleration(self._startAcceleration)
+            if telemetry is not None:
+                telemetry._step(t, dt, None, 0)
+            # We do not use t += dt because this can lead to
+            # accumulation of round-off errors. For x and v (or
+            # for t in the variable step size method) we have
+            # no choice but here we can avoid it.
             nsteps += 1
-            t = dt*nsteps
+            if self._events and self._detectEvents(t, x, v, t0 + dt*nsteps, x + dx, v + dv):
+                t, x, v = self._terminalState
+                history.append(t, x, v)
+                break
+            x += dx
+            v += dv
+            t = t0 + dt*nsteps
             # Fill the history
-            tHistory.append(t)
-            xHistory.append(x)
-            vHistory.append(v)
+            history.append(t, x, v)
+            if checkpointing and time.monotonic() >= self._nextCheckpoint:
+                self._saveCheckpoint(runningCondition, history, t, x, v, dt, nsteps)
+        if dense:
+            history.setAcceleration(self.Force(t, x, v)/self.mass)
+        history.finish()
         self.stepsMade = nsteps
-        return tHistory, xHistory, vHistory
 
     # Run the simulation with a variable time step, accumulating the history
-    def _runVS(self, dt, runningCondition):
-        # Initialize the running variables
-        dt = dt*1.0
-        t = 0.0
-        x = self.x0
-        v = self.v0
-        # Initialize the history
-        tHistory = [t,]
-        xHistory = [x,]
-        vHistory = [v,]
+    def _runVS(self, dt, runningCondition, history, resumed=None):
+        if resumed is None:
+            if self._compiledRun(dt, runningCondition, history) is not None:
+                return
+            # Initialize the running variables
+            dt = dt*1.0
+            t = self.t0
+            x = self.x0*1.0
+            v = self.v0*1.0
+            # Initialize the history
+            history.start(t, x, v)
+            self._startEvents(t, x, v)
+        else:
+            t, x, v, dt = resumed[:4]
+        dense = self._denseOutput and getattr(history, "storesAccelerations", False)
+        telemetry = self.telemetry
+        checkpointing = self._startCheckpoints()
         # Cycle until the running condition is no longer true
         while (runningCondition(t, x, v)):
             dt, dx, dv, next_dt, nreject = self._makeVariableSizeStep(dt, t, x, v)
-            t += dt
-            x = x + dx
-            v = v + dv
-            tHistory.append(t)
-            xHistory.append(x)
-            vHistory.append(v)
-            dt = next_dt
+            if dense:
+                history.setAcceleration(self._startAcceleration)
+            if telemetry is not None:
+                telemetry._step(t, dt, self._errorRatio, nreject)
             self.stepsMade += 1
             self.stepsRejected += nreject
-        return tHistory, xHistory, vHistory
+            if self._events and self._detectEvents(t, x, v, t + dt, x + dx, v + dv):
+                t, x, v = self._terminalState
+                history.append(t, x, v)
+                break
+            t += dt
+            x += dx
+            v += dv
+            history.append(t, x, v)
+            dt = next_dt
+            if checkpointing and time.monotonic() >= self._nextCheckpoint:
+                self._saveCheckpoint(runningCondition, history, t, x, v, dt, None)
+        if dense:
+            history.setAcceleration(self.Force(t, x, v)/self.mass)
+        history.finish()
 
     # Run the simulation with a constant time step without accumulating history
-    def _evolveCS(self, dt, runningCondition):
-        # Make sure dt is float. Then t will be float as well.
-        dt = dt*1.0
-        # Initialize the running variables
-        t = 0.0
-        x = self.x0
-        v = self.v0
-        nsteps = 0
+    def _evolveCS(self, dt, runningCondition, resumed=None):
+        if resumed is None:
+            state = self._compiledRun(dt, runningCondition)
+            if state is not None:
+                return state
+            # Make sure dt is float. Then t will be float as well.
+            dt = dt*1.0
+            # Initialize the running variables
+            t = self.t0
+            x = self.x0
+            v = self.v0
+            nsteps = 0
+            self._startEvents(t, x, v)
+        else:
+            t, x, v, dt, nsteps = resumed
+        telemetry = self.telemetry
+        checkpointing = self._startCheckpoints()
+        t0 = self.t0
         # Cycle until the running condition is no longer true
         while (runningCondition(t, x, v)):
             dx, dv = self._step(dt, t, x, v)[:2]
+            if telemetry is not None:
+                telemetry._step(t, dt, None, 0)
+            nsteps += 1
+            if self._events and self._detectEvents(t, x, v, t0 + dt*nsteps, x + dx, v + dv):
+                t, x, v = self._terminalState
+                break
             x += dx
             v += dv
-            nsteps += 1
-            t = dt*nsteps
+            t = t0 + dt*nsteps
+            if checkpointing and time.monotonic() >= self._nextCheckpoint:
+                self._saveCheckpoint(runningCondition, None, t, x, v, dt, nsteps)
         self.stepsMade = nsteps
         return t, x, v
 
     # Run the simulation with a variable time step without accumulating history
-    def _evolveVS(self, dt, runningCondition):
-        # Initialize the running variables
-        dt = dt*1.0
-        t = 0.0
-        x = self.x0
-        v = self.v0
+    def _evolveVS(self, dt, runningCondition, resumed=None):
+        if resumed is None:
+            state = self._compiledRun(dt, runningCondition)
+            if state is not None:
+                return state
+            # Initialize the running variables
+            dt = dt*1.0
+            t = self.t0
+            x = self.x0
+            v = self.v0
+            self._startEvents(t, x, v)
+        else:
+            t, x, v, dt = resumed[:4]
+        telemetry = self.telemetry
+        checkpointing = self._startCheckpoints()
         # Cycle until the running condition is no longer true
         while (runningCondition(t, x, v)):
             dt, dx, dv, next_dt, nreject = self._makeVariableSizeStep(dt, t, x, v)
+            if telemetry is not None:
+                telemetry._step(t, dt, self._errorRatio, nreject)
+            self.stepsMade += 1
+            self.stepsRejected += nreject
+            if self._events and self._detectEvents(t, x, v, t + dt, x + dx, v + dv):
+                t, x, v = self._terminalState
+                break
             t += dt
             x += dx
             v += dv
             dt = next_dt
-            self.stepsMade += 1
-            self.stepsRejected += nreject
+            if checkpointing and time.monotonic() >= self._nextCheckpoint:
+                self._saveCheckpoint(runningCondition, None, t, x, v, dt, None)
         return t, x, v
 
-    def run(self, xInitial, vInitial, dt, runningCondition, tolerances=None):
+    # Run the integration loop in the compiled backend. This is possible
+    # for schemes which provide their Runge-Kutta tableau, force models
+    # which provide a compiled kernel, TimeLimit and AboveGround running
+    # conditions, no events, and the default ArrayHistory store (or no
+    # history). Returns the final tuple t, x, v, or None if the loop
+    # has to be run in Python.
+    def _compiledRun(self, dt, runningCondition, history=None):
+        if not self.useCompiledKernels or self._events:
+            return None
+        # The backend is loaded only when it is requested, as importing
+        # numba takes a noticeable time
+        import cpkernels
+        if not cpkernels.available:
+            return None
+        # Telemetry and checkpoints need the Python loops. The compiled
+        # loops also always run forward in time, starting from t = 0.
+        if self.telemetry is not None or self.checkpointFile is not None:
+            return None
+        if self.t0 != 0.0 or dt < 0.0:
+            return None
+        if history is not None and type(history) is not ArrayHistory:
+            return None
+        if type(runningCondition) is TimeLimit:
+            stopMode, tmax = 0, runningCondition.tmax*1.0
+        elif type(runningCondition) is AboveGround:
+            stopMode, tmax = 1, 0.0
+        else:
+            return None
+        tableau = _kernelTableaus.get(type(self))
+        if tableau is None:
+            rawTableau = self._kernelTableau()
+            if rawTableau is None:
+                return None
+            tableau = cpkernels.tableau(*rawTableau)
+            _kernelTableaus[type(self)] = tableau
+        kernelMethod = getattr(self.Force, "kernel", None)
+        if kernelMethod is None:
+            return None
+        kernel = cpkernels.build(kernelMethod())
+        if kernel is None:
+            return None
+        layout = StateLayout(self.x0)
+        if layout.kind == "object" or len(layout.shape) > 1:
+            return None
+        dim = 1 if layout.kind == "float" else layout.shape[0]
+        if kernel[2] is not None and kernel[2] != dim:
+            return None
+        if stopMode == 1 and dim < 2:
+            return None
+
+        # Flat copies of the initial state
+        buffer = layout.allocate(2)
+        layout.store(buffer, 0, self.x0)
+        layout.store(buffer, 1, self.v0)
+        buffer = buffer.reshape(2, dim)
+        x, v = buffer[0].copy(), buffer[1].copy()
+        a0 = np.empty(dim)
+        clock = np.array([0.0, dt*1.0, 0.0, self._previousErrorRatio, 0.0])
+        stats = np.zeros(2, dtype=np.int64)
+        adaptive = bool(self.adaptiveStepSize)
+        order = float(self._order()) if adaptive else 0.0
+        tolerances = np.zeros(6)
+        if adaptive:
+            if self.absTolX is not None:
+                tolerances[0:2] = (self.absTolX, self.relTolX)
+                tolerances[4] = 1.0
+            if self.absTolV is not None:
+                tolerances[2:4] = (self.absTolV, self.relTolV)
+                tolerances[5] = 1.0
+        control = np.array([self.stepIncreaseTrigger, self.maxStepFactor,
+                            self.minStepFactor, self.smallestDecrease,
+                            float(self.usePIController), self.piAlpha, self.piBeta])
+        c, A, b, E, E3, errMode, endStage, fsal = tableau
+        integrate = cpkernels.integrator(kernel[0])
+        record = history is not None
+        dense = record and self._denseOutput
+        if record:
+            history.start(0.0, self.x0, self.v0)
+        n = 1
+        while True:
+            if record:
+                tOut, xOut, vOut, aOut = history._rowBuffers(dim, dense)
+                if aOut is None:
+                    aOut = xOut
+            else:
+                tOut = np.empty(1)
+                xOut = vOut = aOut = np.empty((1, dim))
+            n, status = integrate(
+                kernel[1], self.mass, c, A, b, E, E3, errMode,
+                endStage, fsal, adaptive, order, tolerances, control,
+                stopMode, tmax, clock, x, v, a0, stats, record, dense,
+                tOut, xOut, vOut, aOut, n)
+            if record:
+                history._setLength(n, dense)
+            if status == cpkernels.BUFFER_FULL:
+                history._grow()
+            else:
+                break
+        assert status != cpkernels.TOO_MANY_TRIES, "Something is wrong with the variabe step tuning"
+        assert status != cpkernels.BAD_TOLERANCE, "Tolerances must be positive"
+
+        self.stepsMade = int(stats[0])
+        self.stepsRejected = int(stats[1])
+        self._previousErrorRatio = clock[3]
+        t = clock[0]
+        x = layout.box(x.reshape(layout.shape))
+        v = layout.box(v.reshape(layout.shape))
+        if record:
+            if dense:
+                history.setAcceleration(self.Force(t, x, v)/self.mass)
+            history.finish()
+        return t, x, v
+
+    # Coordinate and velocity at time t inside the step which starts
+    # at (t0, x0, v0) and ends at (t1, x1, v1). If the accelerations
+    # at the step ends are known, the interpolation is quintic in the
+    # coordinates. Otherwise it is cubic in the coordinates and linear
+    # in the velocities.
+    def _denseState(self, t, t0, x0, v0, t1, x1, v1, a0=None, a1=None):
+        if a0 is None:
+            x = interpolate_Hermite(t, t0, x0, v0, t1, x1, v1)
+            v = interpolate_linear(t, t0, v0, t1, v1)
+            return x, v
+        else:
+            return interpolate_Hermite_quintic(t, t0, x0, v0, a0, t1, x1, v1, a1)
+
+    # Calculate the initial values of the event functions
+    def _startEvents(self, t, x, v):
+        self._eventValues = [event(t, x, v) for event in self._events]
+
+    # Find the time of the event inside the step using the Illinois
+    # variant of the regula falsi method. The state between the step
+    # ends is obtained from the dense output. Returns the tuple t, x, v
+    # on the far side of the crossing (i.e., the sign of the event
+    # function there is the same as at t1).
+    def _locateEvent(self, event, t0, x0, v0, g0, t1, x1, v1, g1, a0, a1):
+        a, ga = t0, g0
+        b, gb = t1, g1
+        xb, vb = x1, v1
+        tol = 4.0*sys.float_info.epsilon*max(abs(t0), abs(t1), abs(t1 - t0))
+        side = 0
+        for i in range(100):
+            if abs(b - a) <= tol:
+                break
+            c = b - gb*(b - a)/(gb - ga)
+            if not (min(a, b) < c < max(a, b)):
+                c = 0.5*(a + b)
+            xc, vc = self._denseState(c, t0, x0, v0, t1, x1, v1, a0, a1)
+            gc = event(c, xc, vc)
+            if gc == 0.0:
+                return c, xc, vc
+            if (gc > 0.0) == (gb > 0.0):
+                b, gb, xb, vb = c, gc, xc, vc
+                if side == -1:
+                    ga *= 0.5
+                side = -1
+            else:
+                a, ga = c, gc
+                if side == 1:
+                    gb *= 0.5
+                side = 1
+        return b, xb, vb
+
+    # Acceleration at the end of the step, used for locating the events.
+    # Schemes which evaluate the force there anyway reuse that evaluation.
+    def _endAcceleration(self, t, x, v):
+        return self.Force(t, x, v)/self.mass
+
+    # Check the events over the step from (t0, x0, v0) to (t1, x1, v1).
+    # Crossings are recorded in self.eventStates. Returns True if
+    # a terminal event occurred inside the step, in which case its
+    # state is placed in self._terminalState.
+    def _detectEvents(self, t0, x0, v0, t1, x1, v1):
+        found = []
+        a0, a1 = None, None
+        for i, event in enumerate(self._events):
+            g0 = self._eventValues[i]
+            g1 = event(t1, x1, v1)
+            self._eventValues[i] = g1
+            direction = getattr(event, "direction", 0)
+            rising = g0 < 0.0 and g1 >= 0.0
+            falling = g0 > 0.0 and g1 <= 0.0
+            if (rising and direction >= 0) or (falling and direction <= 0):
+                if g1 == 0.0:
+                    state = (t1, x1*1.0, v1*1.0)
+                else:
+                    if self._denseOutput and a0 is None:
+                        a0 = self._startAcceleration
+                        a1 = self._endAcceleration(t1, x1, v1)
+                    state = self._locateEvent(event, t0, x0, v0, g0,
+                                              t1, x1, v1, g1, a0, a1)
+                found.append((abs(state[0] - t0), i, state))
+        if not found:
+            return False
+        found.sort(key=lambda item: item[:2])
+        for delta, i, state in found:
+            self.eventStates[i].append(state)
+            if getattr(self._events[i], "terminal", False):
+                self._terminalState = state
+                return True
+        return False
+
+    def run(self, xInitial, vInitial, dt, runningCondition, tolerances=None,
+            history=None, events=None, t0=0.0):
         """
         Performs ODE integration and accumulate the history (i.e., remembers
         the particle trajectory). Arguments are as follows:
@@ -336,20 +787,79 @@ class OdeSolver:
                             If this argument is set to None or omitted,
                             a constant time step is used, even if the class
                             supports stepwise error estimation.
+        history          -- History sink which receives the states (see
+                            the cphistory module). Use, for example,
+                            DecimatedHistory to keep every Nth step only,
+                            SampledHistory to keep the states at selected
+                            times, or CallbackHistory to process the states
+                            without storing them. If this argument is None
+                            or omitted, every step is stored in ArrayHistory.
+        events           -- A sequence of event functions (see the Event
+                            class) or None. Crossings of zero by the event
+                            functions are located inside the steps and
+                            recorded in the class member eventStates.
+                            The run stops at the first terminal event.
+        t0               -- Initial time
+
+        The time step can be negative, in which case the simulation runs
+        backward in time. Use TimeLimit(tmin, backward=True) as the running
+        condition for such runs. Together with the t0 argument, this allows
+        for computing segments of long trajectories independently.
 
         Upon successful completion, the class members t, x, and v will
-        contain the list of time stamps, the list of particle coordinates,
-        and the list of velocities, respectively.
+        contain the array of time stamps, the array of particle coordinates,
+        and the array of velocities, respectively. These arrays are NumPy
+        views into the buffers of the history store which is available
+        as the class member "history" (see the cphistory module). For 3-d
+        vector (V3) states, x and v have shape (n_steps + 1, 3).
         """
-        self._validateRunArguments(xInitial, vInitial, dt,
-                                   runningCondition, tolerances)
+        self._validateRunArguments(xInitial, vInitial, dt, runningCondition,
+                                   tolerances, events, t0)
+        if history is None:
+            history = self._makeHistory(dt, runningCondition)
+        self.history = history
         # Choose variable or constant step size
         if self.adaptiveStepSize:
-            self.t, self.x, self.v = self._runVS(dt, runningCondition)
+            self._instrumented(self._runVS, dt, runningCondition, history)
         else:
-            self.t, self.x, self.v = self._runCS(dt, runningCondition)
+            self._instrumented(self._runCS, dt, runningCondition, history)
+        self.t, self.x, self.v = history.t, history.x, history.v
 
-    def evolve(self, xInitial, vInitial, dt, runningCondition, tolerances=None):
+    def iterate(self, xInitial, vInitial, dt, runningCondition, tolerances=None,
+                t0=0.0):
+        """
+        Generator version of the "run" method. Yields the tuple t, x, v
+        for the initial state and after every integration step, without
+        storing anything. The arguments have the same meaning as for the
+        "run" method. Note that the arguments are validated only when the
+        first state is requested from the generator. When the generator
+        is exhausted, the class members t, x, and v contain the final state.
+        """
+        self._validateRunArguments(xInitial, vInitial, dt, runningCondition,
+                                   tolerances, None, t0)
+        dt = dt*1.0
+        t = self.t0
+        x = self.x0*1.0
+        v = self.v0*1.0
+        # Yield copies, so that the caller can safely keep them
+        # while x and v are updated in place
+        yield t, x*1.0, v*1.0
+        while (runningCondition(t, x, v)):
+            if self.adaptiveStepSize:
+                h, dx, dv, dt, nreject = self._makeVariableSizeStep(dt, t, x, v)
+                t += h
+                self.stepsRejected += nreject
+            else:
+                dx, dv = self._step(dt, t, x, v)[:2]
+                t = self.t0 + dt*(self.stepsMade + 1)
+            x += dx
+            v += dv
+            self.stepsMade += 1
+            yield t, x*1.0, v*1.0
+        self.t, self.x, self.v = t, x, v
+
+    def evolve(self, xInitial, vInitial, dt, runningCondition, tolerances=None,
+               events=None, t0=0.0):
         """
         Performs ODE integration without accumulating the history.
         Arguments are as follows:
@@ -374,59 +884,661 @@ class OdeSolver:
                             If this argument is set to None or omitted,
                             a constant time step is used, even if the class
                             supports stepwise error estimation.
+        events           -- A sequence of event functions (see the Event
+                            class) or None. Crossings of zero by the event
+                            functions are located inside the steps and
+                            recorded in the class member eventStates.
+                            The run stops at the first terminal event.
+        t0               -- Initial time
+
+        As for the "run" method, the time step can be negative.
 
         Upon successful completion, the class members t, x, and v will
         contain the final time, coordinate, and velocity of the particle.
         """
-        self._validateRunArguments(xInitial, vInitial, dt,
-                                   runningCondition, tolerances)
+        self._validateRunArguments(xInitial, vInitial, dt, runningCondition,
+                                   tolerances, events, t0)
         # Choose variable or constant step size
         if self.adaptiveStepSize:
-            self.t, self.x, self.v = self._evolveVS(dt, runningCondition)
+            self.t, self.x, self.v = self._instrumented(
+                self._evolveVS, dt, runningCondition)
+        else:
+            self.t, self.x, self.v = self._instrumented(
+                self._evolveCS, dt, runningCondition)
+
+    # Returns True if the checkpoints are enabled and schedules the first one
+    def _startCheckpoints(self):
+        if self.checkpointFile is None:
+            return False
+        self._nextCheckpoint = time.monotonic() + self.checkpointInterval
+        return True
+
+    # Save the state of the run. The loop variables are the state just
+    # after the step, including the size of the next step. The file is
+    # written under a temporary name first and then renamed, so that
+    # a crash while writing leaves the previous checkpoint intact.
+    def _saveCheckpoint(self, runningCondition, history, t, x, v, dt, nsteps):
+        names = self._runMembers + self._checkpointMembers
+        state = dict(scheme=type(self).__name__,
+                     loop=(t, x, v, dt, nsteps),
+                     runningCondition=runningCondition,
+                     history=history,
+                     members=dict((name, getattr(self, name)) for name in names))
+        temporary = self.checkpointFile + ".tmp"
+        with open(temporary, "wb") as f:
+            pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary, self.checkpointFile)
+        self._nextCheckpoint = time.monotonic() + self.checkpointInterval
+
+    def resume(self, fileName):
+        """
+        Continues the "run" or "evolve" call whose state was saved into
+        the given checkpoint file. The solver must be of the same class
+        and must use the same force model and mass as the solver which
+        made the checkpoint. Everything else, including the integration
+        settings, the running condition, the event functions, and the
+        history accumulated so far, is restored from the file, and the
+        integration proceeds exactly as if it was never interrupted.
+        Upon completion, the results are available in the same class
+        members as after the original call. The resumed run keeps making
+        checkpoints if the member "checkpointFile" of this solver is set.
+
+        Note that the running condition, the event functions, and the
+        history sink are saved with the "pickle" module, so they must be
+        picklable (all classes provided by this course are).
+        """
+        with open(fileName, "rb") as f:
+            state = pickle.load(f)
+        if state["scheme"] != type(self).__name__:
+            raise ValueError("Checkpoint was made by the %s solver"
+                             % state["scheme"])
+        for name, value in state["members"].items():
+            setattr(self, name, value)
+        resumed = state["loop"]
+        dt = resumed[3]
+        runningCondition = state["runningCondition"]
+        history = state["history"]
+        self.history = history
+        if history is None:
+            if self.adaptiveStepSize:
+                loop = self._evolveVS
+            else:
+                loop = self._evolveCS
+            self.t, self.x, self.v = self._instrumented(
+                loop, dt, runningCondition, resumed)
+        else:
+            if self.adaptiveStepSize:
+                loop = self._runVS
+            else:
+                loop = self._runCS
+            self._instrumented(loop, dt, runningCondition, history, resumed)
+            self.t, self.x, self.v = history.t, history.x, history.v
+
+    # Call one of the integration loops. If the telemetry is enabled,
+    # the force model is temporarily replaced by its timed wrapper.
+    # If the force model keeps statistics of its calls, their changes
+    # are reported in the member forceStatistics. The statistics are
+    # taken from "model" if it differs from the force being called.
+    def _instrumented(self, loop, *args, model=None):
+        if model is None:
+            model = self.Force
+        statistics = getattr(model, "statistics", None)
+        if statistics is None:
+            self.forceStatistics = None
+        else:
+            before = statistics()
+        telemetry = self.telemetry
+        force = self.Force
+        if telemetry is not None:
+            self.Force = telemetry._begin(self, force)
+        try:
+            return loop(*args)
+        finally:
+            self.Force = force
+            if telemetry is not None:
+                telemetry._end(self)
+            if statistics is not None:
+                after = statistics()
+                self.forceStatistics = dict(
+                    (key, after[key] - before[key]) for key in after)
+
+    def prepare(self, dt, runningCondition, tolerances=None, events=None):
+        """
+        Validates the integration settings once and returns a PreparedRun
+        object which can then be used to perform many runs (or evolutions)
+        with different initial conditions. The arguments have the same
+        meaning as for the "run" and "evolve" methods. This avoids
+        repeating the argument checks when a large number of short runs
+        is needed (for example, in parameter scans).
+        """
+        return PreparedRun(self, dt, runningCondition, tolerances, events)
+
+    # Convert the initial conditions of an ensemble run into arrays
+    # of shape (n_traj,) or (n_traj, dim) and validate the arguments
+    def _validateEnsembleArguments(self, xInitial, vInitial, dt,
+                                   runningCondition, tolerances, t0=0.0):
+        xInitial = np.array(xInitial, dtype=np.float64)
+        vInitial = np.array(vInitial, dtype=np.float64)
+        if xInitial.ndim not in (1, 2):
+            raise ValueError("Ensemble initial conditions must have "
+                             "shape (n_traj,) or (n_traj, dim)")
+        if xInitial.shape != vInitial.shape:
+            raise ValueError("Incompatible shapes of initial coordinates "
+                             "and velocities")
+        if len(xInitial) == 0:
+            raise ValueError("Ensemble must contain at least one trajectory")
+        self._validateRunArguments(xInitial, vInitial, dt,
+                                   runningCondition, tolerances, None, t0)
+        ntraj = len(self.x0)
+        self.stepsMade = np.zeros(ntraj, dtype=np.int64)
+        self.stepsRejected = np.zeros(ntraj, dtype=np.int64)
+        return ntraj
+
+    # Reshape per-trajectory quantities (time, time step) so that
+    # they broadcast correctly against (n_traj, dim) state arrays
+    @staticmethod
+    def _column(a, ndim):
+        return a.reshape((-1,) + (1,)*(ndim - 1))
+
+    # Euclidean norm of each trajectory state. This is what the "abs"
+    # function returns for a single scalar or V3 state.
+    @staticmethod
+    def _rowNorm(a):
+        if a.ndim == 1:
+            return np.abs(a)
+        else:
+            return np.sqrt(np.sum(a*a, axis=1))
+
+    # Evaluate the running condition and convert its result into a boolean
+    # mask with one entry per trajectory. Running conditions which do not
+    # know about ensembles (e.g., TimeLimit with a scalar t) return a single
+    # boolean which then applies to all trajectories.
+    @staticmethod
+    def _runningMask(runningCondition, t, x, v):
+        mask = np.asarray(runningCondition(t, x, v), dtype=bool)
+        ntraj = len(x)
+        if mask.size == ntraj:
+            return mask.reshape(ntraj)
+        else:
+            return np.broadcast_to(mask, (ntraj,)).copy()
+
+    # Vectorized version of _makeVariableSizeStep. Each trajectory has its
+    # own step size. The force model is always evaluated for the complete
+    # ensemble, so that any per-trajectory parameters of the force remain
+    # aligned with the rows of the state arrays. The results are kept only
+    # for the trajectories whose step is still pending.
+    def _makeVariableSizeStepEnsemble(self, dt_in, t, x, v, pending):
+        errPower = 1.0/(1.0 + self._order())
+        ndim = x.ndim
+        optimal_dt = dt_in.copy()
+        dt = dt_in.copy()
+        dx = np.zeros_like(x)
+        dv = np.zeros_like(v)
+        nreject = np.zeros(len(dt_in), dtype=np.int64)
+        minStepSizeReached = np.zeros(len(dt_in), dtype=bool)
+        sqtrig = math.sqrt(self.stepIncreaseTrigger)
+        tcol = self._column(t, ndim)
+        xMagnitude = self._rowNorm(x)
+        vMagnitude = self._rowNorm(v)
+        maxtries = 20
+
+        for itry in range(maxtries):
+            dt[pending] = optimal_dt[pending]
+            trialX, trialV, errX, errV = self._step(self._column(dt, ndim), tcol, x, v)
+
+            nTerms = 0
+            xRatio = 0.0
+            if not (self.absTolX is None):
+                tolX = self.absTolX + np.maximum(xMagnitude, self._rowNorm(trialX))*self.relTolX
+                xRatio = self._rowNorm(errX)/tolX
+                nTerms += 1
+
+            vRatio = 0.0
+            if not (self.absTolV is None):
+                tolV = self.absTolV + np.maximum(vMagnitude, self._rowNorm(trialV))*self.relTolV
+                vRatio = self._rowNorm(errV)/tolV
+                nTerms += 1
+
+            eRatio = np.sqrt((xRatio*xRatio + vRatio*vRatio)/nTerms)[pending]
+            accepted = (eRatio <= 1.0) | minStepSizeReached[pending]
+
+            # Accepted steps: check if we want to increase the step size
+            done = pending[accepted]
+            dx[done] = trialX[done]
+            dv[done] = trialV[done]
+            ratio = eRatio[accepted]
+            if self.usePIController:
+                optimal_dt[done] = dt[done]*self._piStepFactorEnsemble(ratio, errPower, done)
+            else:
+                grow = ratio < self.stepIncreaseTrigger
+                with np.errstate(divide="ignore"):
+                    factor = 1.0/np.power(ratio/self.stepIncreaseTrigger, errPower)
+                optimal_dt[done] = dt[done]*np.where(grow, factor, 1.0)
+            tooLarge = done[optimal_dt[done]/dt_in[done] > self.maxStepFactor]
+            optimal_dt[tooLarge] = dt_in[tooLarge]*self.maxStepFactor
+
+            # Rejected steps: decrease the step size
+            pending = pending[~accepted]
+            if len(pending) == 0:
+                break
+            nreject[pending] += 1
+            optimal_dt[pending] = dt[pending]/np.power(eRatio[~accepted]/sqtrig, errPower)
+            slow = pending[optimal_dt[pending]/dt_in[pending] > self.smallestDecrease]
+            optimal_dt[slow] = dt_in[slow]*self.smallestDecrease
+            tooSmall = pending[optimal_dt[pending]/dt_in[pending] < self.minStepFactor]
+            optimal_dt[tooSmall] = dt_in[tooSmall]*self.minStepFactor
+            minStepSizeReached[tooSmall] = True
+
+        assert len(pending) == 0, "Something is wrong with the variabe step tuning"
+        return dt, dx, dv, optimal_dt, nreject
+
+    # Advance the active trajectories of an ensemble by one step.
+    # The arrays are updated in place.
+    def _stepEnsembleCS(self, dt, t, x, v, running, active):
+        dx, dv = self._step(dt, t, x, v)[:2]
+        if len(active) == len(x):
+            x += dx
+            v += dv
+        else:
+            x[active] += dx[active]
+            v[active] += dv[active]
+        self.stepsMade[active] += 1
+
+    def _stepEnsembleVS(self, dt, t, x, v, running, active):
+        h, dx, dv, next_dt, nreject = self._makeVariableSizeStepEnsemble(
+            dt, t, x, v, active)
+        t[active] += h[active]
+        x[active] += dx[active]
+        v[active] += dv[active]
+        dt[active] = next_dt[active]
+        self.stepsMade[active] += 1
+        self.stepsRejected[active] += nreject[active]
+
+    # Common ensemble loop. If "history" is True, snapshots of all
+    # states are accumulated after every step.
+    def _ensembleLoop(self, dt, runningCondition, history):
+        # Force models which provide the batch evaluation method
+        # (see the cpforces module) are evaluated through it
+        force = self.Force
+        self.Force = getattr(force, "evalBatch", force)
+        try:
+            return self._instrumented(self._ensembleSteps, dt,
+                                      runningCondition, history, model=force)
+        finally:
+            self.Force = force
+
+    def _ensembleSteps(self, dt, runningCondition, history):
+        x = self.x0.copy()
+        v = self.v0.copy()
+        ntraj = len(x)
+        t0 = self.t0
+        if self.adaptiveStepSize:
+            t = np.full(ntraj, t0)
+            dt = np.full(ntraj, dt*1.0)
+            tview = self._column(t, x.ndim)
+            self._previousErrorRatio = np.full(ntraj, self.stepIncreaseTrigger)
         else:
-            self.t, self.x, self.v = self._evolveCS(dt, runningCondition)
+            dt = dt*1.0
+            t = t0
+            tview = t
+        nsteps = 0
+        if history:
+            tHistory = [np.copy(t),]
+            xHistory = [x.copy(),]
+            vHistory = [v.copy(),]
+        running = self._runningMask(runningCondition, tview, x, v)
+        while running.any():
+            active = np.flatnonzero(running)
+            if self.adaptiveStepSize:
+                self._stepEnsembleVS(dt, t, x, v, running, active)
+            else:
+                self._stepEnsembleCS(dt, t, x, v, running, active)
+                nsteps += 1
+                t = t0 + dt*nsteps
+                tview = t
+            if history:
+                tHistory.append(np.copy(t))
+                xHistory.append(x.copy())
+                vHistory.append(v.copy())
+            # Trajectories which have stopped remain stopped
+            running &= self._runningMask(runningCondition, tview, x, v)
+        if history:
+            return np.array(tHistory), np.array(xHistory), np.array(vHistory)
+        elif self.adaptiveStepSize:
+            return t, x, v
+        else:
+            return t0 + self.stepsMade*dt, x, v
+
+    def runEnsemble(self, xInitial, vInitial, dt, runningCondition, tolerances=None,
+                    t0=0.0):
+        """
+        Integrates an ensemble of trajectories at once, accumulating the
+        history. All trajectories are advanced together by each "_step"
+        call using NumPy array arithmetic. The arguments are the same as
+        for the "run" method, except that xInitial and vInitial must be
+        arrays of shape (n_traj,) or (n_traj, dim). The force model must
+        accept such arrays. Force models which have the "evalBatch" method
+        (see the cpforces module) are evaluated with this method, others
+        are simply called with the arrays. The force is always evaluated
+        for the complete ensemble, so its parameters can also be arrays
+        with one entry (row) per trajectory.
+
+        The running condition is called as runningCondition(t, x, v)
+        with the complete ensemble arrays. It can return either a single
+        boolean or a boolean array with one entry per trajectory. Once
+        a trajectory stops, it is masked out and is no longer advanced.
+        With a constant time step, t is a float. With an adaptive step
+        size, each trajectory has its own time and step size, and t is
+        an array which broadcasts against x.
+
+        Upon completion, the class members t, x, and v contain the arrays
+        of time stamps, coordinates, and velocities whose first index is
+        the step number. The states of stopped trajectories are frozen.
+        For constant step runs t is one-dimensional, for adaptive runs it
+        has shape (n_steps + 1, n_traj). The class members stepsMade and
+        stepsRejected become arrays with one entry per trajectory.
+
+        All trajectories start at the time t0. With the PI step size
+        controller turned on (see the usePIController member), each
+        trajectory keeps its own error ratio history.
+        """
+        self._validateEnsembleArguments(xInitial, vInitial, dt,
+                                        runningCondition, tolerances, t0)
+        self.t, self.x, self.v = self._ensembleLoop(dt, runningCondition, True)
+
+    def evolveEnsemble(self, xInitial, vInitial, dt, runningCondition, tolerances=None,
+                       t0=0.0):
+        """
+        Integrates an ensemble of trajectories at once without accumulating
+        the history. See the "runEnsemble" method for the description of
+        the arguments. Upon completion, the class members t, x, and v will
+        contain the arrays of final times, coordinates, and velocities
+        (one entry per trajectory).
+        """
+        self._validateEnsembleArguments(xInitial, vInitial, dt,
+                                        runningCondition, tolerances, t0)
+        self.t, self.x, self.v = self._ensembleLoop(dt, runningCondition, False)
 
     def interpolate(self, t):
         """
         This function can be invoked after calling "run" in order to
         interpolate system coordinates and velocity to an arbitrary time
         moment covered by the simulation. The interpolation is between
-        the two history points closest to the given time. The method is
-        cubic in coordinates (so that the coordinate interpolation error
-        is O(dt^4)) and linear in velocity. Note that, for precision work,
-        the interpolation error has to be at least as good as the error
-        of the ODE solving scheme. For high order ODE schemes, you should
+        the two history points closest to the given time.
+
+        For schemes with dense output (RK4, RK6, RKF45), the accelerations
+        at the history points are known, and the method is quintic in
+        coordinates (the coordinate interpolation error is O(dt^6)) with
+        velocities obtained from the derivative of the same polynomial
+        (the error is O(dt^5)). This is as good as the schemes of up to
+        the 5th order themselves, so that the simulation can be sampled
+        at arbitrary times even with large adaptive steps. For the higher
+        order schemes (RK6, DOP853, Yoshida6) the interpolation remains
+        5th order and is less precise than the integration.
+
+        For other schemes, or for histories which do not store the
+        accelerations, the method is cubic in coordinates (the coordinate
+        interpolation error is O(dt^4)) and linear in velocity. Note that,
+        for precision work, the interpolation error has to be at least as
+        good as the error of the ODE solving scheme. In this case you should
         not use this function to sample the simulation history at time
         intervals shorter than the simulation time step -- instead, just
         rerun the simulation using a smaller step.
+
+        The argument t can also be a NumPy array (or a list) of times.
+        In this case all bracketing history points are found with one
+        call to "searchsorted", the interpolation is vectorized, and the
+        function returns the arrays of coordinates and velocities. Their
+        first dimension corresponds to the times. For V3 states, these
+        arrays have shape (len(t), 3).
         """
-        try:
-            n = len(self.t)
-        except TypeError:
-            # self.t is not a sequence. Re-raise the exception
-            # with an appropriate error message.
+        if self.history is None:
+            # "evolve" and the ensemble methods do not fill the history
             raise TypeError("Please run the simulation first")
+        elif not hasattr(self.history, "state"):
+            raise TypeError("This history sink does not support interpolation")
         else:
+            n = len(self.history)
             if (n < 2):
                 raise ValueError("Not enough simulation steps")
-            tmin = self.t[0]
-            tmax = self.t[n-1]
+            if not np.isscalar(t):
+                return self._interpolateArray(np.asarray(t, dtype=np.float64))
+            tmin = min(self.t[0], self.t[n-1])
+            tmax = max(self.t[0], self.t[n-1])
             if t < tmin or t > tmax:
                 raise ValueError("Requested time is outside the simulated interval")
-            if self.adaptiveStepSize:
-                nbelow = bisect_right(self.t, t) - 1    
-            else:
-                dt = (tmax - tmin)*1.0/(n - 1)
-                nbelow = int(math.floor((t - tmin)/dt))
+            # Decimated and sampled histories are not necessarily
+            # equidistant even for constant step runs, so always
+            # look the time up in the history
+            nbelow = int(find_intervals(self.t, t))
             nabove = nbelow + 1
-            if nabove >= n:
-                nabove = n - 1
-                nbelow = nabove - 1
-            x = interpolate_Hermite(t, self.t[nbelow], self.x[nbelow], self.v[nbelow],
-                                    self.t[nabove], self.x[nabove], self.v[nabove])
-            v = interpolate_linear(t, self.t[nbelow], self.v[nbelow],
-                                   self.t[nabove], self.v[nabove])
-            return x, v
+            t0, x0, v0 = self.history.state(nbelow)
+            t1, x1, v1 = self.history.state(nabove)
+            a0, a1 = None, None
+            if getattr(self.history, "storesAccelerations", False) and \
+                   self.history.hasAccelerations():
+                a0 = self.history.acceleration(nbelow)
+                a1 = self.history.acceleration(nabove)
+            return self._denseState(t, t0, x0, v0, t1, x1, v1, a0, a1)
+
+    def trajectory(self):
+        """
+        This function can be invoked after calling "run" in order to
+        obtain the piecewise polynomial representation of the simulated
+        trajectory (the Trajectory class of the cptrajectory module).
+        The polynomial coefficients are calculated once, so this is
+        faster than the "interpolate" method when the trajectory has
+        to be examined many times. The trajectory also provides the
+        derivatives, the integrals over time intervals, and the times
+        of zero crossings. As for "interpolate", the polynomials are
+        quintic for the schemes with dense output and cubic otherwise.
+        """
+        history = self.history
+        if history is None:
+            raise TypeError("Please run the simulation first")
+        if not hasattr(history, "layout") or history.layout is None \
+               or history.layout.kind == "object":
+            raise TypeError("This history does not support trajectories")
+        a = None
+        if getattr(history, "storesAccelerations", False) and history.hasAccelerations():
+            a = history.a
+        return Trajectory(history.t, history.x, history.v, a)
+
+    # Vectorized version of "interpolate" for an array of times
+    def _interpolateArray(self, times):
+        history = self.history
+        T = history.t
+        n = len(T)
+        tmin = min(T[0], T[n-1])
+        tmax = max(T[0], T[n-1])
+        if np.any(times < tmin) or np.any(times > tmax):
+            raise ValueError("Requested time is outside the simulated interval")
+        if history.layout.kind == "object":
+            # Arbitrary state objects can not be processed by NumPy
+            states = [self.interpolate(float(tq)) for tq in times.ravel()]
+            return [st[0] for st in states], [st[1] for st in states]
+        # The history times are increasing for runs forward in time
+        # and decreasing for runs backward
+        nbelow = find_intervals(T, times)
+        nabove = nbelow + 1
+        t0 = T[nbelow]
+        t1 = T[nabove]
+        X, V = history.x, history.v
+        x0, x1 = X[nbelow], X[nabove]
+        v0, v1 = V[nbelow], V[nabove]
+        if getattr(history, "storesAccelerations", False) and history.hasAccelerations():
+            A = history.a
+            x, v = interpolate_Hermite_quintic_array(times, t0, x0, v0, A[nbelow],
+                                                     t1, x1, v1, A[nabove])
+        else:
+            x = interpolate_Hermite_array(times, t0, x0, v0, t1, x1, v1)
+            v = interpolate_linear_array(times, t0, v0, t1, v1)
+        return x, v
+
+class PreparedRun:
+    """
+    Integration settings validated in advance for a particular solver.
+    Objects of this class are created by the "prepare" method of OdeSolver.
+    Their "run" and "evolve" methods take only the initial conditions
+    (and, for "run", an optional history sink). The results are placed
+    into the members of the solver, exactly as if the corresponding solver
+    method were called. The solver can still be used directly in between,
+    with other settings: these are restored at the start of each run.
+    """
+    # Solver members which hold the validated settings
+    _settingNames = ("_events", "estimatesErrors", "adaptiveStepSize",
+                     "absTolX", "relTolX", "absTolV", "relTolV")
+
+    def __init__(self, solver, dt, runningCondition, tolerances=None,
+                 events=None):
+        solver._validateSettings(dt, runningCondition, tolerances, events)
+        self.solver = solver
+        self.dt = dt*1.0
+        self.runningCondition = runningCondition
+        self._settings = tuple(getattr(solver, name) for name in self._settingNames)
+
+    def _start(self, xInitial, vInitial, t0):
+        solver = self.solver
+        for name, value in zip(self._settingNames, self._settings):
+            setattr(solver, name, value)
+        solver._startRun(xInitial, vInitial, t0)
+        return solver
+
+    def run(self, xInitial, vInitial, history=None, t0=0.0):
+        "Same as the solver's \"run\" method with the prepared settings"
+        solver = self._start(xInitial, vInitial, t0)
+        dt, runningCondition = self.dt, self.runningCondition
+        if history is None:
+            history = solver._makeHistory(dt, runningCondition)
+        solver.history = history
+        if solver.adaptiveStepSize:
+            solver._instrumented(solver._runVS, dt, runningCondition, history)
+        else:
+            solver._instrumented(solver._runCS, dt, runningCondition, history)
+        solver.t, solver.x, solver.v = history.t, history.x, history.v
+        return solver
+
+    def evolve(self, xInitial, vInitial, t0=0.0):
+        """
+        Same as the solver's "evolve" method with the prepared settings.
+        Returns the tuple t, x, v of the final state.
+        """
+        solver = self._start(xInitial, vInitial, t0)
+        if solver.adaptiveStepSize:
+            loop = solver._evolveVS
+        else:
+            loop = solver._evolveCS
+        solver.t, solver.x, solver.v = solver._instrumented(
+            loop, self.dt, self.runningCondition)
+        return solver.t, solver.x, solver.v
+
+
+class StepTelemetry:
+    """
+    Instrumentation of the OdeSolver runs. Assign an object of this class
+    to the "telemetry" member of a solver before calling "run", "evolve",
+    or their PreparedRun and ensemble counterparts. The object is reset
+    at the start of each run and filled during the run. While it is
+    active, the force model is called through a wrapper which counts
+    and times its evaluations, and the compiled backend is not used.
+
+    After the run, the following members are available:
+
+    forceEvaluations -- Total number of force model calls (including
+                        the calls made for event location, dense output,
+                        and Jacobian estimation)
+    forceTime        -- Total time spent inside the force model, seconds
+    totalTime        -- Wall clock time of the run, seconds
+    overheadTime     -- totalTime - forceTime, i.e., the time spent
+                        by the integrator itself
+    stepsMade        -- Number of accepted steps
+    stepsRejected    -- Number of rejected trial steps
+
+    If the object was constructed with recordSteps=True (the default),
+    there is also one record for every accepted step of single trajectory
+    runs (ensemble runs produce only the totals). The records are
+    NumPy arrays with one entry per step:
+
+    stepTimes        -- Time at the start of the step
+    stepSizes        -- Accepted step size
+    errorRatios      -- Ratio of the estimated error to the tolerance
+                        for the accepted step (NaN for constant steps)
+    retries          -- Number of rejected trials before the step
+                        was accepted
+    stepEvaluations  -- Number of force evaluations made since the
+                        previous record. These include the evaluations
+                        of rejected trials, so that the steps where
+                        the force evaluations are wasted stand out.
+    """
+    def __init__(self, recordSteps=True):
+        self.recordSteps = recordSteps
+        self._reset()
+
+    def _reset(self):
+        self.forceEvaluations = 0
+        self.forceTime = 0.0
+        self.totalTime = 0.0
+        self.overheadTime = 0.0
+        self.stepsMade = 0
+        self.stepsRejected = 0
+        self._records = []
+        self._lastEvaluations = 0
+        self._convert()
+
+    def _convert(self):
+        records = np.array(self._records, dtype=np.float64).reshape(-1, 5)
+        self.stepTimes = records[:,0]
+        self.stepSizes = records[:,1]
+        self.errorRatios = records[:,2]
+        self.retries = records[:,3].astype(np.int64)
+        self.stepEvaluations = records[:,4].astype(np.int64)
+
+    # Start a run: returns the timed wrapper for the force model
+    def _begin(self, solver, force):
+        self._reset()
+        self._startTime = time.perf_counter()
+        def timedForce(t, x, v):
+            self.forceEvaluations += 1
+            start = time.perf_counter()
+            try:
+                return force(t, x, v)
+            finally:
+                self.forceTime += time.perf_counter() - start
+        # Keep the attributes which the solvers examine
+        # (such as dependsOnX) visible through the wrapper
+        for name in ("dependsOnT", "dependsOnX", "dependsOnV"):
+            if hasattr(force, name):
+                setattr(timedForce, name, getattr(force, name))
+        return timedForce
+
+    # Record an accepted step. Called by the integration loops.
+    def _step(self, t, dt, errorRatio, nreject):
+        if self.recordSteps:
+            if errorRatio is None:
+                errorRatio = np.nan
+            evaluations = self.forceEvaluations - self._lastEvaluations
+            self._lastEvaluations = self.forceEvaluations
+            self._records.append((t, dt, errorRatio, nreject, evaluations))
+
+    def _end(self, solver):
+        self.totalTime = time.perf_counter() - self._startTime
+        self.overheadTime = self.totalTime - self.forceTime
+        self.stepsMade = int(np.sum(solver.stepsMade))
+        self.stepsRejected = int(np.sum(solver.stepsRejected))
+        self._convert()
+        self._records = []
+
+    def summary(self):
+        "A short human-readable summary of the last run"
+        if self.forceEvaluations > 0:
+            perEvaluation = self.forceTime/self.forceEvaluations*1.0e6
+        else:
+            perEvaluation = 0.0
+        return ("%d steps made, %d rejected, %d force evaluations "
+                "(%.3g us each), force time %.3g s, overhead %.3g s" %
+                (self.stepsMade, self.stepsRejected, self.forceEvaluations,
+                 perEvaluation, self.forceTime, self.overheadTime))
+
 
 ###########################################################################
 #
@@ -473,6 +1585,85 @@ class EulerCromer(OdeSolver):
         return dx, dv
 
 
+class VelocityVerlet(OdeSolver):
+    """
+    Implements the velocity Verlet ODE solving scheme (kick-drift-kick).
+    This is a 2nd order symplectic scheme: for conservative forces which
+    depend only on the coordinates, it does not exhibit secular energy
+    drift, so it is well suited for long runs of oscillating systems.
+    The force model is still called as F(t, x, v), but the velocity passed
+    to it is not synchronized with the coordinate, so the scheme should not
+    be used with velocity-dependent forces (drag, Magnus force, etc).
+
+    Higher order symplectic schemes are obtained by composing velocity
+    Verlet substeps with the weights given by the class variable _weights.
+    The force evaluation at the end of each substep is reused at the start
+    of the next one, so a step costs one force evaluation per substep.
+    """
+    _name = "Velocity Verlet"
+    _weights = (1.0,)
+    _denseOutput = True
+    _checkpointMembers = ("_last",)
+
+    def _setup(self):
+        # Time, coordinate, and acceleration at the end of the last step
+        self._last = None
+
+    def _step(self, dt, t, x, v):
+        # Reuse the acceleration calculated at the end of the previous
+        # step if this step starts there (see also EmbeddedRungeKutta)
+        last = self._last
+        if last is not None and np.all(np.abs(last[0] - t) <= 4.0*sys.float_info.epsilon*np.abs(t)) \
+                and _sameState(last[1], x):
+            a = last[2]
+        else:
+            a = self.Force(t, x, v)/self.mass
+        self._startAcceleration = a
+        xi, vi = x, v
+        nsub = len(self._weights)
+        tau = 0.0
+        for i, w in enumerate(self._weights):
+            h = w*dt
+            tau += w
+            vi = vi + a*(h/2.0)
+            xi = xi + vi*h
+            if i == nsub - 1:
+                # Make the final coordinate exactly equal to what
+                # the caller will get by adding dx to x
+                dx = xi - x
+                xi = x + dx
+            a = self.Force(t + tau*dt, xi, vi)/self.mass
+            vi = vi + a*(h/2.0)
+        self._last = (t + dt, xi, a)
+        return dx, vi - v
+
+
+class Yoshida4(VelocityVerlet):
+    """
+    Implements the 4th order symplectic scheme of H. Yoshida (Phys. Lett. A
+    150, 262 (1990)) composed of three velocity Verlet substeps. Costs three
+    force evaluations per step. The same restrictions on the force model
+    apply as for the VelocityVerlet class.
+    """
+    _name = "4th order Yoshida"
+    _w1 = 1.0/(2.0 - 2.0**(1.0/3.0))
+    _weights = (_w1, 1.0 - 2.0*_w1, _w1)
+
+
+class Yoshida6(VelocityVerlet):
+    """
+    Implements the 6th order symplectic scheme of H. Yoshida (solution A
+    in Phys. Lett. A 150, 262 (1990)) composed of seven velocity Verlet
+    substeps. Costs seven force evaluations per step. The same restrictions
+    on the force model apply as for the VelocityVerlet class.
+    """
+    _name = "6th order Yoshida"
+    _w1 = -1.17767998417887
+    _w2 = 0.235573213359357
+    _w3 = 0.784513610477560
+    _weights = (_w3, _w2, _w1, 1.0 - 2.0*(_w1 + _w2 + _w3), _w1, _w2, _w3)
+
+
 class RK4(OdeSolver):
     """
     Implements the 4th order Runge-Kutta ODE solving scheme. Construct the
@@ -484,6 +1675,7 @@ class RK4(OdeSolver):
     acceleration as a function of t, x, and v (unit mass is assumed).
     """
     _name = "4th order Runge-Kutta"
+    _denseOutput = True
     
     def _setup(self):
         # For simplicity, define a function which combines
@@ -493,6 +1685,7 @@ class RK4(OdeSolver):
     def _step(self, dt, t, x, v):
         halfstep = dt/2.0
         k1x, k1v = self._f(t, x, v)
+        self._startAcceleration = k1v
         k2x, k2v = self._f(t + halfstep, x + halfstep*k1x, v + halfstep*k1v)
         k3x, k3v = self._f(t + halfstep, x + halfstep*k2x, v + halfstep*k2v)
         k4x, k4v = self._f(t + dt, x + dt*k3x, v + dt*k3v)
@@ -500,6 +1693,11 @@ class RK4(OdeSolver):
         dv = dt/6.0*(k1v + 2*k2v + 2*k3v + k4v)
         return dx, dv
 
+    def _kernelTableau(self):
+        return ((0.0, 0.5, 0.5, 1.0),
+                ((), (0.5,), (0.0, 0.5), (0.0, 0.0, 1.0)),
+                (1/6.0, 1/3.0, 1/3.0, 1/6.0), None, None, False)
+
 
 class RK6(OdeSolver):
     """
@@ -512,6 +1710,7 @@ class RK6(OdeSolver):
     acceleration as a function of t, x, and v (unit mass is assumed).
     """
     _name = "6th order Runge-Kutta"
+    _denseOutput = True
 
     def _setup(self):
         # For simplicity, define a function which combines
@@ -525,7 +1724,9 @@ class RK6(OdeSolver):
         # than the order of the scheme (order 7 requires 9 function
         # evaluations, order 8 requires 11, etc).
         sq21 = math.sqrt(21.0)
-        kx1, kv1 = self._f(dt, t, x, v)
+        a1 = self.Force(t, x, v)/self.mass
+        self._startAcceleration = a1
+        kx1, kv1 = dt*v, a1*dt
         kx2, kv2 = self._f(dt, t + dt, x + kx1, v + kv1)
         kx3, kv3 = self._f(dt, t + dt/2.0, x + (3*kx1 + kx2)/8.0, v + (3*kv1 + kv2)/8.0)
         kx4, kv4 = self._f(dt, t + 2*dt/3.0, x + (8*(kx1 + kx3) + 2*kx2)/27.0,
@@ -540,6 +1741,23 @@ class RK6(OdeSolver):
         dv = (9.0*(kv1 + kv7) + 64.0*kv3 + 49.0*(kv5 + kv6))/180.0
         return dx, dv
 
+    def _kernelTableau(self):
+        # The same coefficients as in _step
+        sq21 = math.sqrt(21.0)
+        c = (0.0, 1.0, 0.5, 2/3.0, (7-sq21)/14.0, (7+sq21)/14.0, 1.0)
+        a = ((),
+             (1.0,),
+             (3/8.0, 1/8.0),
+             (8/27.0, 2/27.0, 8/27.0),
+             (3*(3*sq21-7)/392.0, -8*(7-sq21)/392.0, 48*(7-sq21)/392.0,
+              -3*(21-sq21)/392.0),
+             (-5*(231+51*sq21)/1960.0, -40*(7+sq21)/1960.0, -320*sq21/1960.0,
+              3*(21+121*sq21)/1960.0, 392*(6+sq21)/1960.0),
+             (15*(22+7*sq21)/180.0, 120/180.0, 40*(7*sq21-5)/180.0,
+              -63*(3*sq21-2)/180.0, -14*(49+9*sq21)/180.0, 70*(7-sq21)/180.0))
+        b = (9/180.0, 0.0, 64/180.0, 0.0, 49/180.0, 49/180.0, 9/180.0)
+        return c, a, b, None, None, False
+
 
 class RKF45(OdeSolver):
     """
@@ -547,6 +1765,8 @@ class RKF45(OdeSolver):
     order Runge-Kutta scheme. Can be used with an adaptive step size adjustment.
     """
     _name = "5th order Runge-Kutta-Fehlberg"
+    _denseOutput = True
+    _estimatesErrors = True
 
     def _setup(self):
         # For simplicity, define a function which combines
@@ -554,7 +1774,9 @@ class RKF45(OdeSolver):
         self._f = lambda h, t, x, v: (h*v, self.Force(t, x, v)/self.mass*h)
 
     def _step(self, dt, t, x, v):
-        kx1, kv1 = self._f(dt, t, x, v)
+        a1 = self.Force(t, x, v)/self.mass
+        self._startAcceleration = a1
+        kx1, kv1 = dt*v, a1*dt
         kx2, kv2 = self._f(dt, t+dt/4.0, x + 0.25*kx1, v + 0.25*kv1)
         kx3, kv3 = self._f(dt, t+3*dt/8.0, x + (3*kx1 + 9*kx2)/32.0,
                                            v + (3*kv1 + 9*kv2)/32.0)
@@ -574,6 +1796,379 @@ class RKF45(OdeSolver):
     def _order(self):
         return 4
 
+    def _kernelTableau(self):
+        c = (0.0, 1/4.0, 3/8.0, 12/13.0, 1.0, 1/2.0)
+        a = ((),
+             (1/4.0,),
+             (3/32.0, 9/32.0),
+             (1932/2197.0, -7200/2197.0, 7296/2197.0),
+             (439/216.0, -8.0, 3680/513.0, -845/4104.0),
+             (-8/27.0, 2.0, -3544/2565.0, 1859/4104.0, -11/40.0))
+        b4 = (25/216.0, 0.0, 1408/2565.0, 2197/4104.0, -0.2, 0.0)
+        b5 = (16/135.0, 0.0, 6656/12825.0, 28561/56430.0, -9/50.0, 2/55.0)
+        e = tuple(w5 - w4 for w5, w4 in zip(b5, b4))
+        return c, a, b5, e, None, False
+
+
+# Runge-Kutta tableaux converted for the compiled backend, by solver class
+_kernelTableaus = dict()
+
+# Linear combination of stage derivatives. Zero coefficients are skipped.
+# Vectors with a fused "axpy" method (such as V3) are accumulated without
+# creating temporary objects.
+def _lincomb(coefficients, vectors):
+    total = None
+    for c, k in zip(coefficients, vectors):
+        if c != 0.0:
+            if total is None:
+                total = k*c
+                axpy = getattr(total, "axpy", None)
+            elif axpy is not None:
+                axpy(c, k)
+            else:
+                total += k*c
+    return total
+
+# Exact comparison of two particle states
+def _sameState(a, b):
+    if isinstance(a, np.ndarray) or isinstance(b, np.ndarray):
+        return np.array_equal(a, b)
+    return a == b
+
+# Returns the acceleration from the tuple (t, x, v, a) if this tuple
+# refers to the state (t, x, v), and None otherwise. The constant step
+# size loops calculate the time as t0 + dt*nsteps which can differ from
+# t + dt by round-off, so the time is compared with a tolerance.
+def _cachedAcceleration(cache, t, x, v):
+    if cache is not None and \
+            np.all(np.abs(cache[0] - t) <= 4.0*sys.float_info.epsilon*np.abs(t)) \
+            and _sameState(cache[1], x) and _sameState(cache[2], v):
+        return cache[3]
+    return None
+
+
+class EmbeddedRungeKutta(OdeSolver):
+    """
+    Base class for embedded Runge-Kutta schemes whose last force evaluation
+    is made at the end of the step ("first same as last", FSAL). When the
+    step is accepted, this evaluation is reused as the first stage of the
+    next step, saving one force evaluation per step.
+
+    The subclasses must define the following class variables:
+
+    _c -- Stage times as fractions of the step, starting with 0.0
+    _a -- Lower triangular rows of stage coefficients, one row per stage
+    _b -- Weights of the propagated solution
+    _e -- Error estimate weights. The last weight refers to the force
+          evaluation at the end of the step.
+
+    The subclasses must also implement _order(self). The method
+    _errorEstimate(self, dt, kx, kv) can be overridden if the error
+    estimate is not a simple linear combination of stages.
+    """
+    _denseOutput = True
+    _estimatesErrors = True
+    _checkpointMembers = ("_start", "_fsal")
+
+    def _setup(self):
+        # Time, coordinate, velocity, and acceleration at the start of
+        # the last trial step (reused when the trial is rejected and
+        # the step is retried with a smaller size) and at its end (reused
+        # when the trial is accepted and the next step starts there)
+        self._start = None
+        self._fsal = None
+
+    def _errorEstimate(self, dt, kx, kv):
+        return abs(dt*_lincomb(self._e, kx)), abs(dt*_lincomb(self._e, kv))
+
+    def _step(self, dt, t, x, v):
+        # Reuse the force evaluation at the end of the previous step if
+        # this step starts there, or the first stage of the previous trial
+        # if this is a retry after a rejected trial. The integration loops
+        # update x and v in place, so the start state is copied.
+        a1 = _cachedAcceleration(self._fsal, t, x, v)
+        if a1 is not None:
+            self._start = self._fsal
+        else:
+            a1 = _cachedAcceleration(self._start, t, x, v)
+            if a1 is None:
+                a1 = self.Force(t, x, v)/self.mass
+                self._start = (t*1.0, x*1.0, v*1.0, a1)
+        self._startAcceleration = a1
+        kx = [v,]
+        kv = [a1,]
+        for ci, ai in zip(self._c[1:], self._a[1:]):
+            xi = x + dt*_lincomb(ai, kx)
+            vi = v + dt*_lincomb(ai, kv)
+            kx.append(vi)
+            kv.append(self.Force(t + ci*dt, xi, vi)/self.mass)
+        dx = dt*_lincomb(self._b, kx)
+        dv = dt*_lincomb(self._b, kv)
+        # The last stage, at the end of the step
+        t1 = t + dt
+        x1 = x + dx
+        v1 = v + dv
+        a2 = self.Force(t1, x1, v1)/self.mass
+        kx.append(v1)
+        kv.append(a2)
+        self._fsal = (t1, x1, v1, a2)
+        errX, errV = self._errorEstimate(dt, kx, kv)
+        return dx, dv, errX, errV
+
+    def _endAcceleration(self, t, x, v):
+        a = _cachedAcceleration(self._fsal, t, x, v)
+        if a is None:
+            a = self.Force(t, x, v)/self.mass
+        return a
+
+    def _kernelTableau(self):
+        return self._c, self._a, self._b, self._e, None, True
+
+
+class DOPRI5(EmbeddedRungeKutta):
+    """
+    Implements the 5th order Dormand-Prince method with an embedded 4th order
+    error estimate. Can be used with an adaptive step size adjustment. Uses
+    six force evaluations per step.
+    """
+    _name = "5th order Dormand-Prince"
+    _c = (0.0, 1/5.0, 3/10.0, 4/5.0, 8/9.0, 1.0)
+    _a = ((),
+          (1/5.0,),
+          (3/40.0, 9/40.0),
+          (44/45.0, -56/15.0, 32/9.0),
+          (19372/6561.0, -25360/2187.0, 64448/6561.0, -212/729.0),
+          (9017/3168.0, -355/33.0, 46732/5247.0, 49/176.0, -5103/18656.0))
+    _b = (35/384.0, 0.0, 500/1113.0, 125/192.0, -2187/6784.0, 11/84.0)
+    _e = (-71/57600.0, 0.0, 71/16695.0, -71/1920.0, 17253/339200.0,
+          -22/525.0, 1/40.0)
+
+    def _order(self):
+        return 4
+
+
+class DOP853(EmbeddedRungeKutta):
+    """
+    Implements the 8th order Dormand-Prince method with embedded 5th and 3rd
+    order error estimates (Hairer, Norsett, and Wanner). Can be used with an
+    adaptive step size adjustment. Uses twelve force evaluations per step.
+    Recommended for smooth force models and tight tolerances. Note that
+    the dense output ("interpolate" method and event location) is the
+    5th order quintic Hermite interpolation between the steps rather
+    than the 7th order continuous extension of the original DOP853 code.
+    """
+    _name = "8th order Dormand-Prince"
+    _c = dop853Coefficients.C
+    _a = dop853Coefficients.A
+    _b = dop853Coefficients.B
+
+    # Combine the 5th and 3rd order estimates in the same
+    # manner as the original DOP853 code
+    @staticmethod
+    def _combineErrors(err5, err3):
+        denom = err5*err5 + 0.01*err3*err3
+        if isinstance(denom, np.ndarray):
+            positive = denom > 0.0
+            return np.where(positive, err5*err5/np.sqrt(np.where(positive, denom, 1.0)), 0.0)
+        elif denom > 0.0:
+            return err5*err5/math.sqrt(denom)
+        else:
+            return 0.0
+
+    def _errorEstimate(self, dt, kx, kv):
+        E3 = dop853Coefficients.E3
+        E5 = dop853Coefficients.E5
+        errX = self._combineErrors(abs(dt*_lincomb(E5, kx)), abs(dt*_lincomb(E3, kx)))
+        errV = self._combineErrors(abs(dt*_lincomb(E5, kv)), abs(dt*_lincomb(E3, kv)))
+        return errX, errV
+
+    def _kernelTableau(self):
+        return (self._c, self._a, self._b, dop853Coefficients.E5,
+                dop853Coefficients.E3, True)
+
+    def _order(self):
+        return 7
+
+
+class Rosenbrock23(OdeSolver):
+    """
+    Implements the 2nd order linearly implicit Rosenbrock method with an
+    embedded 3rd order error estimate (the "modified Rosenbrock formula"
+    of L.F. Shampine and M.W. Reichelt, SIAM J. Sci. Comput. 18, 1 (1997),
+    also used by the "ode23s" function of Matlab). Can be used with an
+    adaptive step size adjustment. This scheme remains stable for stiff
+    force models (strong drag, heavy damping) where the explicit schemes
+    are forced to make tiny steps.
+
+    The Jacobian of the force with respect to coordinates and velocities,
+    together with the derivative of the force with respect to time, is
+    estimated by finite differences. For a state with n components, this
+    takes 2n + 1 force evaluations (fewer if the force model declares that
+    it does not depend on some of its arguments). The Jacobian is reused for
+    subsequent steps. It is recalculated after "jacobianMaxAge" steps, when
+    the integration does not continue from the end of the previous step,
+    and when a step is rejected (unless the Jacobian was already calculated
+    at the start of that step). The step itself costs two force evaluations
+    (the evaluation at the start of the step is taken from the end of the
+    previous step or from the rejected trial).
+
+    The particle state can be a float, a V3 object, or a NumPy array.
+    All components of the state are coupled through the Jacobian, so the
+    cost of a step grows as the cube of the number of components. For
+    this reason, the scheme should not be used with large ensembles.
+    """
+    _name = "2nd order Rosenbrock"
+    _denseOutput = True
+    _estimatesErrors = True
+    _d = 1.0/(2.0 + math.sqrt(2.0))
+    _e32 = 6.0 + math.sqrt(2.0)
+    _checkpointMembers = ("jacobianUpdates", "_layout", "_jacobian", "_dfdt",
+                          "_jacobianPoint", "_jacobianAge", "_start", "_fsal")
+
+    def _setup(self):
+        # Maximum number of steps made with the same Jacobian
+        self.jacobianMaxAge = 20
+        # Number of times the Jacobian was calculated (can be examined
+        # after the run to check how often it had to be updated)
+        self.jacobianUpdates = 0
+        self._layout = None
+        self._jacobian = None
+        self._dfdt = None
+        self._jacobianPoint = None
+        self._jacobianAge = 0
+        # Time, coordinate, velocity, and acceleration at the start
+        # and at the end of the last trial step (see EmbeddedRungeKutta)
+        self._start = None
+        self._fsal = None
+
+    # Conversion of particle states into flat float64 arrays and back
+    def _flatten(self, state):
+        buffer = self._layout.allocate(1)
+        self._layout.store(buffer, 0, state)
+        return buffer.reshape(-1)
+
+    def _unflatten(self, flat):
+        return self._layout.box(flat.reshape(self._layout.shape))
+
+    # In the ensemble mode, times and time steps are columns of values,
+    # one per trajectory. Spread them over all state components.
+    def _flatTime(self, t):
+        if isinstance(t, np.ndarray):
+            return np.broadcast_to(t, self._layout.shape).ravel()
+        return t
+
+    def _updateJacobian(self, t, x, v, X, V, A0):
+        n = len(X)
+        sqeps = math.sqrt(sys.float_info.epsilon)
+        J = np.zeros((2*n, 2*n))
+        J[:n, n:] = np.eye(n)
+        # Skip the derivatives with respect to the arguments which
+        # the force model declares it does not depend upon (see
+        # the cpforces module)
+        arguments = []
+        if getattr(self.Force, "dependsOnX", True):
+            arguments.append((X, 0))
+        if getattr(self.Force, "dependsOnV", True):
+            arguments.append((V, n))
+        for j in range(n):
+            for Y, offset in arguments:
+                Yp = Y.copy()
+                Yp[j] += sqeps*max(abs(Y[j]), 1.0)
+                # Use the exactly representable difference
+                h = Yp[j] - Y[j]
+                if offset == 0:
+                    a = self.Force(t, self._unflatten(Yp), v)/self.mass
+                else:
+                    a = self.Force(t, x, self._unflatten(Yp))/self.mass
+                J[n:, offset + j] = (self._flatten(a) - A0)/h
+        dfdt = np.zeros(2*n)
+        if getattr(self.Force, "dependsOnT", True):
+            tp = t + sqeps*np.maximum(np.abs(t), 1.0)
+            a = self.Force(tp, x, v)/self.mass
+            dfdt[n:] = (self._flatten(a) - A0)/self._flatTime(tp - t)
+        self._jacobian = J
+        self._dfdt = dfdt
+        self._jacobianPoint = (t, X.copy(), V.copy())
+        self._jacobianAge = 0
+        self.jacobianUpdates += 1
+
+    def _step(self, dt, t, x, v):
+        if self._layout is None or not self._layout.matches(x):
+            layout = StateLayout(x)
+            if layout.kind == "object":
+                raise TypeError("Unsupported particle state type")
+            # Forget the Jacobian and the force evaluation made
+            # for the states of a different shape or type
+            self._layout = layout
+            self._jacobian = None
+            self._jacobianPoint = None
+            self._start = None
+            self._fsal = None
+        X = self._flatten(x)
+        V = self._flatten(v)
+        n = len(X)
+        # Reuse the force evaluation at the end of the previous step,
+        # or at the start of the rejected trial if this is a retry
+        a0 = _cachedAcceleration(self._fsal, t, x, v)
+        continued = a0 is not None
+        if continued:
+            self._start = self._fsal
+        else:
+            a0 = _cachedAcceleration(self._start, t, x, v)
+            if a0 is None:
+                a0 = self.Force(t, x, v)/self.mass
+                self._start = (t*1.0, x*1.0, v*1.0, a0)
+        self._startAcceleration = a0
+        A0 = self._flatten(a0)
+        # Decide whether the Jacobian has to be updated. A retry after
+        # a rejected trial refreshes the Jacobian unless it was calculated
+        # at the start of this step.
+        point = self._jacobianPoint
+        if self._jacobian is None or self._jacobianAge >= self.jacobianMaxAge or \
+                (not continued and not (np.array_equal(point[0], t) and np.array_equal(point[1], X)
+                                        and np.array_equal(point[2], V))):
+            self._updateJacobian(t, x, v, X, V, A0)
+        self._jacobianAge += 1
+        # The matrix W = I - dt*d*J is the same for all stages
+        h = self._flatTime(dt)
+        if isinstance(h, np.ndarray):
+            h = np.concatenate((h, h))
+            hd = h[:, np.newaxis]*self._d
+        else:
+            hd = h*self._d
+        Winv = np.linalg.inv(np.eye(2*n) - hd*self._jacobian)
+        T = (h*self._d)*self._dfdt
+        Y = np.concatenate((X, V))
+        F0 = np.concatenate((V, A0))
+        k1 = Winv.dot(F0 + T)
+        Y1 = Y + (0.5*h)*k1
+        a1 = self.Force(t + 0.5*dt, self._unflatten(Y1[:n]),
+                        self._unflatten(Y1[n:]))/self.mass
+        F1 = np.concatenate((Y1[n:], self._flatten(a1)))
+        k2 = Winv.dot(F1 - k1) + k1
+        dY = h*k2
+        dx = self._unflatten(dY[:n])
+        dv = self._unflatten(dY[n:])
+        # The force at the end of the step is needed for the error estimate
+        t2 = t + dt
+        x2 = x + dx
+        v2 = v + dv
+        a2 = self.Force(t2, x2, v2)/self.mass
+        F2 = np.concatenate((self._flatten(v2), self._flatten(a2)))
+        k3 = Winv.dot(F2 - self._e32*(k2 - F1) - 2.0*(k1 - F0) + T)
+        err = (h/6.0)*(k1 - 2.0*k2 + k3)
+        self._fsal = (t2, x2, v2, a2)
+        return dx, dv, abs(self._unflatten(err[:n])), abs(self._unflatten(err[n:]))
+
+    def _endAcceleration(self, t, x, v):
+        a = _cachedAcceleration(self._fsal, t, x, v)
+        if a is None:
+            a = self.Force(t, x, v)/self.mass
+        return a
+
+    def _order(self):
+        return 2
+
 
 ###########################################################################
 #
@@ -581,12 +2176,66 @@ class RKF45(OdeSolver):
 #
 ###########################################################################
 
+class Event:
+    """
+    Base class for events detected during ODE integration with the "run"
+    or "evolve" methods of the OdeSolver class. Derived classes should
+    override the __call__ function which is called as event(t, x, v) and
+    should return a float. The events are the zero crossings of this
+    function. Their times are refined by root finding with the dense
+    output of the solver, so the events are located much more precisely
+    than the integration step.
+
+    direction -- 0 to detect all crossings, 1 to detect only crossings
+                 from negative to positive values, -1 to detect only
+                 crossings from positive to negative values.
+    terminal  -- If True, the integration stops at the event.
+
+    Plain functions with "direction" and "terminal" attributes (or
+    without them, in which case the defaults 0 and False are assumed)
+    can be used as event functions as well.
+    """
+    direction = 0
+    terminal = False
+    def __call__(self, t, x, v):
+        raise NotImplementedError("Function not implemented")
+
+class EventFunction(Event):
+    "Wraps a callable g(t, x, v) with the event direction and terminal flag"
+    def __init__(self, g, direction=0, terminal=False):
+        self.g = g
+        self.direction = direction
+        self.terminal = terminal
+    def __call__(self, t, x, v):
+        return self.g(t, x, v)
+
+class GroundImpact(Event):
+    """
+    Stops ODE integration at the moment when the y coordinate of
+    a particle crosses zero going down
+    """
+    direction = -1
+    terminal = True
+    def __call__(self, t, x, v):
+        return x.y
+
 class TimeLimit:
-    def __init__(self, tmax):
+    """
+    Running condition which stops the simulation at the time limit tmax.
+    For simulations backward in time (with negative time step), construct
+    it with backward=True. The simulation then continues while t > tmax.
+    """
+    def __init__(self, tmax, backward=False):
         self.tmax = tmax
+        self.backward = backward
     def __call__(self, t, x, v):
+        if self.backward:
+            return t > self.tmax
         return t < self.tmax
 
 class AboveGround:
     def __call__(self, t, x, v):
+        if isinstance(x, np.ndarray):
+            # Ensemble of 3-d coordinates with shape (n_traj, 3)
+            return x[:,1] >= 0.0
         return x.y >= 0.0
@@ -0,0 +1,240 @@
+"""
+This module implements parameter sweeps of ODE integrations for the
+Computational Physics course. Classes implemented in this file are:
+
+  ParameterSweep -- Runs one simulation for every point of a parameter
+                    grid on a pool of worker processes and collects the
+                    observables into a preallocated NumPy array. Supports
+                    chunked scheduling, progress reporting, and periodic
+                    checkpoints from which an interrupted sweep can be
+                    resumed.
+
+Example: bifurcation diagram of the driven pendulum, with 100 angles
+sampled for every combination of the driving force and the initial angle:
+
+    def makeSolver(F_D, theta0):
+        return RK4(DrivenPendulum(1.0, 0.5, F_D, 2.0/3.0))
+
+    def angles(solver, F_D, theta0):
+        ...run the solver and return 100 sampled angles...
+
+    sweep = ParameterSweep(makeSolver, (F_D_values, theta0_values),
+                           angles, outputShape=(100,),
+                           checkpointFile="bifurcation.npz")
+    result = sweep.run()  # shape (len(F_D_values), len(theta0_values), 100)
+"""
+
+import os
+import sys
+import time
+import multiprocessing
+import numpy as np
+
+# State of the worker processes, set up by _initWorker
+_worker = None
+
+def _initWorker(solverFactory, axes, observable, outputShape, buffer):
+    global _worker
+    values = np.frombuffer(buffer, dtype=np.float64)
+    _worker = (solverFactory, axes, observable, outputShape, values)
+
+# Evaluate the observables for a chunk of grid points. The results are
+# written directly into the shared output buffer.
+def _runChunk(chunk):
+    solverFactory, axes, observable, outputShape, values = _worker
+    first, last = chunk
+    gridShape = tuple(len(a) for a in axes)
+    width = int(np.prod(outputShape, dtype=np.int64))
+    for index in range(first, last):
+        point = tuple(a[i] for a, i in zip(axes, np.unravel_index(index, gridShape)))
+        solver = solverFactory(*point)
+        result = np.asarray(observable(solver, *point), dtype=np.float64)
+        if result.size != width:
+            raise ValueError("Observable returned %d values, expected %d"
+                             % (result.size, width))
+        values[index*width:(index + 1)*width] = result.ravel()
+    return chunk
+
+
+class ParameterSweep:
+    """
+    Parameter sweep over the Cartesian product of several one-dimensional
+    parameter arrays. The constructor arguments are as follows:
+
+    solverFactory   -- Callable which is called as solverFactory(*point),
+                       where "point" is the tuple of parameter values,
+                       and returns the ODE solver (or any other object
+                       needed by the observable) for this grid point.
+    grid            -- Sequence of one-dimensional arrays (or lists) of
+                       parameter values, one array per parameter. The
+                       values are not converted to floats, so integer
+                       or other parameters can be swept as well.
+    observable      -- Callable which is called as observable(solver, *point).
+                       It should run the simulation and return a number
+                       or an array of numbers with the shape outputShape.
+    outputShape     -- Shape of the observable values for one grid point.
+                       Use () for a single number.
+    processes       -- Number of worker processes. None means the number
+                       of CPUs. 0 runs the sweep in the calling process,
+                       which is convenient for debugging.
+    chunkSize       -- Number of grid points given to a worker at once.
+                       The default gives each worker about 8 chunks,
+                       which balances the load while keeping the
+                       scheduling overhead small.
+    progress        -- Callable which is called as progress(done, total)
+                       after every completed chunk, with the numbers of
+                       completed grid points. If True, a simple progress
+                       line is printed to the standard error stream.
+    checkpointFile  -- Name of the .npz file for saving the results
+                       of the completed chunks. If this file already
+                       exists, the sweep is resumed from it: the chunks
+                       which are already done are not run again.
+    checkpointInterval -- Minimum time between checkpoints, in seconds.
+
+    The solver factory and the observable are sent to the worker processes,
+    so with the "spawn" process start method (the default on Windows and
+    Mac OS) they must be module-level functions. The observable values
+    of all grid points are written by the workers directly into a shared
+    memory array, so that no results have to be pickled and restacked.
+
+    After calling "run", the class member "values" contains the result
+    array of shape grid shape + outputShape, and the member "completed"
+    contains the boolean array (of the grid shape) of the points which
+    were calculated. The values for the points which were not calculated
+    are NaN.
+    """
+    def __init__(self, solverFactory, grid, observable, outputShape=(),
+                 processes=None, chunkSize=None, progress=None,
+                 checkpointFile=None, checkpointInterval=60.0):
+        if not callable(solverFactory) or not callable(observable):
+            raise TypeError("Solver factory and observable must be callable")
+        # Each axis keeps its own type (numbers of any kind, strings, or
+        # other objects), so the factory gets the parameters as given
+        self.axes = tuple(np.array(a).ravel() for a in grid)
+        if not self.axes or min(len(a) for a in self.axes) == 0:
+            raise ValueError("Parameter grid must not be empty")
+        if processes is not None and processes < 0:
+            raise ValueError("Number of processes can not be negative")
+        if chunkSize is not None and chunkSize < 1:
+            raise ValueError("Chunk size must be positive")
+        self.solverFactory = solverFactory
+        self.observable = observable
+        self.outputShape = tuple(outputShape)
+        self.processes = processes
+        self.chunkSize = chunkSize
+        self.progress = progress
+        self.checkpointFile = checkpointFile
+        self.checkpointInterval = checkpointInterval*1.0
+        self.gridShape = tuple(len(a) for a in self.axes)
+        self.values = None
+        self.completed = None
+
+    def _chunks(self, npoints, processes):
+        chunkSize = self.chunkSize
+        if chunkSize is None:
+            chunkSize = max(1, npoints//(8*max(processes, 1)))
+        return [(first, min(first + chunkSize, npoints))
+                for first in range(0, npoints, chunkSize)]
+
+    # Load the results of an interrupted sweep. Returns the flat arrays
+    # of the values and of the completion flags, or None.
+    def _loadCheckpoint(self, npoints, width):
+        if self.checkpointFile is None or not os.path.exists(self.checkpointFile):
+            return None
+        # Object parameter axes are stored pickled
+        with np.load(self.checkpointFile, allow_pickle=True) as data:
+            values = data["values"]
+            completed = data["completed"]
+            axes = [data["axis%d" % i] for i in range(int(data["naxes"]))]
+        if len(axes) != len(self.axes) or not all(
+                np.array_equal(a, b) for a, b in zip(axes, self.axes)):
+            raise ValueError("Checkpoint file %s was made for a different "
+                             "parameter grid" % self.checkpointFile)
+        if values.size != npoints*width:
+            raise ValueError("Checkpoint file %s was made for a different "
+                             "observable shape" % self.checkpointFile)
+        return values.ravel(), completed.ravel()
+
+    # Write the checkpoint into a temporary file first, so that an
+    # interruption while writing does not destroy the previous one
+    def _saveCheckpoint(self, values, completed):
+        base = self.checkpointFile
+        if base.endswith(".npz"):
+            base = base[:-4]
+        temporary = base + ".tmp.npz"
+        axes = dict(("axis%d" % i, a) for i, a in enumerate(self.axes))
+        np.savez(temporary, values=values, completed=completed,
+                 naxes=len(self.axes), **axes)
+        os.replace(temporary, self.checkpointFile)
+
+    def _report(self, done, total):
+        if self.progress is True:
+            sys.stderr.write("\rParameter sweep: %d of %d points done" % (done, total))
+            if done == total:
+                sys.stderr.write("\n")
+            sys.stderr.flush()
+        elif self.progress:
+            self.progress(done, total)
+
+    def run(self):
+        """
+        Runs the sweep (or the part of it which is not yet done according
+        to the checkpoint file) and returns the array of observable values
+        """
+        npoints = int(np.prod(self.gridShape, dtype=np.int64))
+        width = int(np.prod(self.outputShape, dtype=np.int64))
+        processes = self.processes
+        if processes is None:
+            processes = os.cpu_count() or 1
+        processes = min(processes, npoints)
+
+        # Shared output buffer. It is filled with NaN initially.
+        buffer = multiprocessing.RawArray("d", npoints*width)
+        values = np.frombuffer(buffer, dtype=np.float64)
+        values[:] = np.nan
+        completed = np.zeros(npoints, dtype=bool)
+        saved = self._loadCheckpoint(npoints, width)
+        if saved is not None:
+            values[:] = saved[0]
+            completed[:] = saved[1]
+
+        chunks = [chunk for chunk in self._chunks(npoints, processes)
+                  if not completed[chunk[0]:chunk[1]].all()]
+        done = int(np.count_nonzero(completed))
+        self._report(done, npoints)
+        lastCheckpoint = time.time()
+
+        initArgs = (self.solverFactory, self.axes, self.observable,
+                    self.outputShape, buffer)
+        pool = None
+        if processes > 0 and chunks:
+            pool = multiprocessing.Pool(processes, _initWorker, initArgs)
+            results = pool.imap_unordered(_runChunk, chunks)
+        else:
+            _initWorker(*initArgs)
+            results = (_runChunk(chunk) for chunk in chunks)
+        try:
+            for first, last in results:
+                done += last - first - int(np.count_nonzero(completed[first:last]))
+                completed[first:last] = True
+                self._report(done, npoints)
+                if self.checkpointFile is not None and \
+                       time.time() - lastCheckpoint >= self.checkpointInterval:
+                    self._saveCheckpoint(values, completed)
+                    lastCheckpoint = time.time()
+            if pool is not None:
+                pool.close()
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+            if self.checkpointFile is not None:
+                self._saveCheckpoint(values, completed)
+
+        # Copy the results out of the shared buffer. Points of the
+        # interrupted chunks may have been partially filled.
+        result = values.reshape(npoints, width).copy()
+        result[~completed] = np.nan
+        self.values = result.reshape(self.gridShape + self.outputShape)
+        self.completed = completed.reshape(self.gridShape)
+        return self.values
@@ -0,0 +1,281 @@
+"""
+This module implements piecewise polynomial representations of particle
+trajectories for the Computational Physics course. Classes implemented
+in this file are:
+
+  Trajectory -- Spline through the points of a simulated trajectory.
+                The polynomial coefficients of all intervals between the
+                points are calculated once, when the object is built, and
+                stored in a contiguous array. After that, evaluating the
+                coordinates and their derivatives, integrating over time
+                intervals, and finding the times at which some function
+                of the state crosses zero only need to look up the right
+                interval (which is an O(log n) binary search).
+
+A Trajectory is usually obtained from an ODE solver after the run, with
+the "trajectory" method of the solver (see the cpode module).
+"""
+
+import numpy as np
+from interpolate import find_intervals, Hermite_quintic_coefficients
+
+
+class Trajectory:
+    """
+    Piecewise polynomial trajectory passing through the coordinates x
+    with velocities v at the times t. If the accelerations a are given
+    as well, the polynomials are of degree 5 (quintic Hermite spline,
+    the same as the dense output of the high order ODE schemes), and
+    the coordinate interpolation error is O(dt^6). Otherwise, they are
+    of degree 3 (cubic Hermite spline) with O(dt^4) error.
+
+    The times must be monotonic (decreasing times come from the runs
+    backward in time). The coordinates, velocities, and accelerations are
+    NumPy arrays whose first dimension corresponds to the times, e.g.,
+    shape (n,) for 1-d motion or (n, 3) for 3-d vectors. The results of
+    all methods are NumPy arrays: for a single time, the shape of one
+    coordinate, and for an array of times, the shape of the time array
+    followed by the shape of one coordinate.
+
+    The coefficients are available as the member "coefficients", an array
+    of shape (n - 1, degree + 1) + coordinate shape. The polynomial for
+    interval i is sum_k coefficients[i, k]*(t - t[i])**k.
+    """
+    def __init__(self, t, x, v, a=None):
+        T = np.array(t, dtype=np.float64)
+        X = np.asarray(x, dtype=np.float64)
+        V = np.asarray(v, dtype=np.float64)
+        n = len(T)
+        if T.ndim != 1 or n < 2:
+            raise ValueError("Need a one-dimensional array of at least two times")
+        if X.shape[0] != n or V.shape != X.shape:
+            raise ValueError("Incompatible shapes of times, coordinates, "
+                             "and velocities")
+        steps = np.diff(T)
+        if not (np.all(steps > 0.0) or np.all(steps < 0.0)):
+            raise ValueError("Times must be strictly monotonic")
+        self.t = T
+        self.stateShape = X.shape[1:]
+        h = steps.reshape((n - 1,) + (1,)*len(self.stateShape))
+        x0, x1 = X[:-1], X[1:]
+        v0, v1 = V[:-1], V[1:]
+        if a is None:
+            self.degree = 3
+            slope = (x1 - x0)/h
+            C = np.empty((n - 1, 4) + self.stateShape)
+            C[:,0] = x0
+            C[:,1] = v0
+            C[:,2] = (3.0*slope - 2.0*v0 - v1)/h
+            C[:,3] = (v0 + v1 - 2.0*slope)/(h*h)
+        else:
+            A = np.asarray(a, dtype=np.float64)
+            if A.shape != X.shape:
+                raise ValueError("Incompatible shapes of coordinates "
+                                 "and accelerations")
+            self.degree = 5
+            C = np.empty((n - 1, 6) + self.stateShape)
+            # Convert the coefficients in the normalized time into powers of t - t[i]
+            c = Hermite_quintic_coefficients(h, x0, v0, A[:-1], x1, v1, A[1:])
+            for k in range(6):
+                C[:,k] = c[k]/h**k
+        self.coefficients = C
+        # Coefficients of the derivatives, by order, made when first needed
+        self._derivatives = {0: C}
+        # Integrals of the coordinates from t[0] to each t[i]
+        powers = np.arange(1, self.degree + 2, dtype=np.float64)
+        self._antiderivative = C/powers.reshape((1, -1) + (1,)*len(self.stateShape))
+        lengths = self._horner(self._antiderivative, h.reshape(-1))*h
+        self._cumulative = np.concatenate((np.zeros((1,) + self.stateShape),
+                                           np.cumsum(lengths, axis=0)))
+
+    def __len__(self):
+        return len(self.t)
+
+    @property
+    def tmin(self):
+        return min(self.t[0], self.t[-1])
+
+    @property
+    def tmax(self):
+        return max(self.t[0], self.t[-1])
+
+    # Evaluate polynomials with coefficients C (one row per point)
+    # at the local times u using the Horner scheme
+    def _horner(self, C, u):
+        u = u.reshape(u.shape + (1,)*len(self.stateShape))
+        result = C[:,-1]
+        for k in range(C.shape[1] - 2, -1, -1):
+            result = result*u + C[:,k]
+        return result
+
+    # Interval indices and local times for an array of times
+    def _locate(self, times):
+        if np.any(times < self.tmin) or np.any(times > self.tmax):
+            raise ValueError("Requested time is outside of the trajectory")
+        i = find_intervals(self.t, times)
+        return i, times - self.t[i]
+
+    def _evaluate(self, C, t):
+        times = np.asarray(t, dtype=np.float64)
+        flat = times.reshape(-1)
+        i, u = self._locate(flat)
+        result = self._horner(C[i], u)
+        return result.reshape(times.shape + self.stateShape)
+
+    # Coefficients of the derivative of the given order
+    def _derivativeCoefficients(self, order):
+        C = self._derivatives.get(order)
+        if C is None:
+            C = self._derivativeCoefficients(order - 1)
+            if C.shape[1] == 1:
+                C = np.zeros_like(C)
+            else:
+                factors = np.arange(1, C.shape[1], dtype=np.float64)
+                C = C[:,1:]*factors.reshape((1, -1) + (1,)*len(self.stateShape))
+            self._derivatives[order] = C
+        return C
+
+    def __call__(self, t):
+        "Coordinates at time t (a number or an array of times)"
+        return self._evaluate(self.coefficients, t)
+
+    def derivative(self, t, order=1):
+        """
+        Derivative of the coordinates of the given order at time t.
+        The first derivative is continuous at the trajectory points.
+        For the quintic splines, the second derivative is continuous
+        as well.
+        """
+        if order < 0:
+            raise ValueError("Derivative order can not be negative")
+        return self._evaluate(self._derivativeCoefficients(order), t)
+
+    def velocity(self, t):
+        "Velocity at time t"
+        return self.derivative(t, 1)
+
+    def acceleration(self, t):
+        "Acceleration at time t"
+        return self.derivative(t, 2)
+
+    def integral(self, ta, tb):
+        """
+        Integral of the coordinates over time from ta to tb. The arguments
+        can be numbers or arrays (which must broadcast against each other).
+        Useful, for example, for calculating time averages.
+        """
+        ta, tb = np.broadcast_arrays(np.asarray(ta, dtype=np.float64),
+                                     np.asarray(tb, dtype=np.float64))
+        return self._primitive(tb) - self._primitive(ta)
+
+    # Integral of the coordinates from t[0] to t
+    def _primitive(self, times):
+        flat = times.reshape(-1)
+        i, u = self._locate(flat)
+        uu = u.reshape(u.shape + (1,)*len(self.stateShape))
+        result = self._cumulative[i] + self._horner(self._antiderivative[i], u)*uu
+        return result.reshape(times.shape + self.stateShape)
+
+    def roots(self, function, direction=0, samples=4, tol=None):
+        """
+        Times at which function(t, x, v) crosses zero, in the order of
+        the trajectory times. The function is called with arrays: t has
+        shape (m,), and x and v have shape (m,) + coordinate shape. It
+        must return an array of shape (m,).
+
+        Each interval between the trajectory points is divided into
+        "samples" subintervals, and every sign change between consecutive
+        subinterval ends is refined with the Illinois variant of the
+        regula falsi method (all crossings are refined together). Pairs
+        of crossings closer to each other than the subintervals can be
+        missed.
+
+        direction -- If positive, only the crossings from negative to
+                     positive values are found. If negative, only the
+                     crossings from positive to negative values.
+                     If 0, all crossings are found.
+        tol       -- Time tolerance for the refinement. By default, it
+                     is a few units of the floating point precision.
+        """
+        if samples < 1:
+            raise ValueError("Number of samples must be positive")
+        T = self.t
+        fractions = np.arange(samples, dtype=np.float64)/samples
+        grid = (T[:-1,np.newaxis] + np.diff(T)[:,np.newaxis]*fractions).ravel()
+        grid = np.append(grid, T[-1])
+        g = self._call(function, grid)
+        g0, g1 = g[:-1], g[1:]
+        rising = (g0 < 0.0) & (g1 >= 0.0)
+        falling = (g0 > 0.0) & (g1 <= 0.0)
+        if direction > 0:
+            found = rising
+        elif direction < 0:
+            found = falling
+        else:
+            found = rising | falling
+        k = np.flatnonzero(found)
+        if tol is None:
+            tol = 4.0*np.finfo(np.float64).eps*max(abs(T[0]), abs(T[-1]), abs(T[-1] - T[0]))
+        return self._refine(function, grid[k], g0[k], grid[k+1], g1[k], tol)
+
+    def crossings(self, value=0.0, component=None, direction=0, period=None, **kwargs):
+        """
+        Times at which a coordinate crosses the given value. For vector
+        coordinates, the component index must be given (e.g., component=1
+        for the y coordinate of 3-d motion). If "period" is given, the
+        coordinate is treated as an angle and the crossings of all values
+        value + k*period (for integer k) are found. This is useful, for
+        example, for Poincare sections of pendulum motion. Other keyword
+        arguments are passed to the "roots" method.
+        """
+        def offset(x):
+            if component is not None:
+                x = x[...,component]
+            return x - value
+        if period is None:
+            return self.roots(lambda t, x, v: offset(x), direction, **kwargs)
+        # The sine below crosses zero at value + k*period/2 and has
+        # the same sign as x - value near value + k*period. The crossings
+        # at the odd multiples of period/2 are then thrown away.
+        w = 2.0*np.pi/period
+        times = self.roots(lambda t, x, v: np.sin(w*offset(x)), direction, **kwargs)
+        return times[np.cos(w*offset(self(times))) > 0.0]
+
+    def _call(self, function, times):
+        return np.asarray(function(times, self(times), self.velocity(times)),
+                          dtype=np.float64).reshape(times.shape)
+
+    # Vectorized Illinois method for the brackets [a, b] with
+    # function values ga and gb of opposite signs (or gb == 0)
+    def _refine(self, function, a, ga, b, gb, tol):
+        a, ga, b, gb = a.copy(), ga.copy(), b.copy(), gb.copy()
+        side = np.zeros(len(a), dtype=np.int64)
+        active = np.flatnonzero(gb != 0.0)
+        for i in range(100):
+            active = active[np.abs(b[active] - a[active]) > tol]
+            if len(active) == 0:
+                break
+            aa, bb = a[active], b[active]
+            gaa, gbb = ga[active], gb[active]
+            c = bb - gbb*(bb - aa)/(gbb - gaa)
+            outside = ~((np.minimum(aa, bb) < c) & (c < np.maximum(aa, bb)))
+            c[outside] = 0.5*(aa[outside] + bb[outside])
+            gc = self._call(function, c)
+            exact = gc == 0.0
+            sameAsB = ((gc > 0.0) == (gbb > 0.0)) & ~exact
+            # The root is between a and c
+            j = active[sameAsB]
+            b[j], gb[j] = c[sameAsB], gc[sameAsB]
+            ga[j[side[j] == -1]] *= 0.5
+            side[j] = -1
+            # The root is between c and b
+            other = ~sameAsB & ~exact
+            j = active[other]
+            a[j], ga[j] = c[other], gc[other]
+            gb[j[side[j] == 1]] *= 0.5
+            side[j] = 1
+            # Exact zeros
+            j = active[exact]
+            b[j], gb[j] = c[exact], 0.0
+            active = active[~exact]
+        return b
@@ -1,12 +1,22 @@
 """
 This module implements a few simple trajectory interpolation methods
 for the Computational Physics course
+
+The functions interpolate_linear, interpolate_Hermite, and
+interpolate_Hermite_quintic work with a single time t. The functions
+interpolate_linear_array, interpolate_Hermite_array, and
+interpolate_Hermite_quintic_array are their vectorized versions which
+process arrays of times at once, and the function "resample" interpolates
+a complete trajectory to new times. The function Hermite_quintic_coefficients
+provides the polynomial used by both quintic interpolation functions.
 """
 
 __author__="Igor Volobouev (i.volobouev@ttu.edu)"
 __version__="0.1"
 __date__ ="Jan 29 2018"
 
+import numpy as np
+
 
 def interpolate_linear(t, t0, x0, t1, x1):
     """
@@ -56,3 +66,194 @@ def interpolate_Hermite(t, t0, x0, v0, t1, x1, v1):
     h01 = t*t*(3.0 - 2.0*t)
     h11 = t*t*onemt
     return h00*x0 + h10*timeDelta*v0 + h01*x1 - h11*timeDelta*v1
+
+
+def Hermite_quintic_coefficients(h, x0, v0, a0, x1, v1, a1):
+    """
+    Coefficients c0, ..., c5 of the fifth-degree polynomial
+    x(s) = c0 + c1*s + ... + c5*s**5 in the normalized time s = (t - t0)/h
+    which matches the coordinates x, velocities v, and accelerations a
+    at the interval ends s = 0 and s = 1 (h is the interval length t1 - t0).
+    Works with numbers, V3 objects, and NumPy arrays (in which case h must
+    broadcast against the states). Returns the list of coefficients.
+    """
+    d = x1 - x0
+    hv0 = v0*h
+    hv1 = v1*h
+    hha0 = a0*(h*h)
+    hha1 = a1*(h*h)
+    return [x0, hv0, hha0*0.5,
+            d*10.0 - hv0*6.0 - hv1*4.0 - hha0*1.5 + hha1*0.5,
+            d*(-15.0) + hv0*8.0 + hv1*7.0 + hha0*1.5 - hha1,
+            d*6.0 - (hv0 + hv1)*3.0 - hha0*0.5 + hha1*0.5]
+
+
+# Value and derivative with respect to s of the quintic
+# polynomial with coefficients c, evaluated with the Horner scheme
+def _quintic(c, s):
+    x = c[5]*s + c[4]
+    dx = c[5]*(5.0*s) + c[4]*4.0
+    for k in (3, 2, 1):
+        x = x*s + c[k]
+        dx = dx*s + c[k]*float(k)
+    return x*s + c[0], dx
+
+
+def interpolate_Hermite_quintic(t, t0, x0, v0, a0, t1, x1, v1, a1):
+    """
+    Interpolate to time t the position and velocity of a particle which
+    had coordinate x0, velocity v0, and acceleration a0 at a time t0 and
+    coordinate x1, velocity v1, and acceleration a1 at a time t1. The
+    coordinate is interpolated using a fifth-degree polynomial (the
+    interpolation error is O(dt^6)) and the velocity is obtained from
+    the derivative of that polynomial (the error is O(dt^5)). Returns
+    the tuple x, v.
+    """
+    if t0 > t1:
+        t0, x0, v0, a0, t1, x1, v1, a1 = t1, x1, v1, a1, t0, x0, v0, a0
+    if t0 == t1 and not x0 == x1:
+        raise ValueError("Interpolated quantity can not have two "
+                         "different values at the same time")
+    if t < t0 or t > t1:
+        raise ValueError("Time argument outside of the given interval")
+    if t == t0:
+        return x0, v0
+    if t == t1:
+        return x1, v1
+    h = 1.0*(t1 - t0)
+    s = (t - t0)/h
+    x, dx = _quintic(Hermite_quintic_coefficients(h, x0, v0, a0, x1, v1, a1), s)
+    return x, dx/h
+
+
+# Position of the times t inside the intervals [t0, t1] (or [t1, t0]),
+# as numbers between 0 and 1, together with the signed interval lengths.
+# Times outside of their intervals are found by masking. x0 and x1 are
+# the values at the interval ends, used to check the empty intervals.
+def _intervalPositions(t, t0, x0, t1, x1):
+    t, t0, t1 = np.broadcast_arrays(np.asarray(t, dtype=np.float64),
+                                    np.asarray(t0, dtype=np.float64),
+                                    np.asarray(t1, dtype=np.float64))
+    outside = (t < np.minimum(t0, t1)) | (t > np.maximum(t0, t1))
+    if np.any(outside):
+        raise ValueError("Time argument outside of the given interval")
+    h = t1 - t0
+    empty = h == 0.0
+    if np.any(empty) and np.any(_differ(x0, x1, t.shape)[empty]):
+        raise ValueError("Interpolated quantity can not have two "
+                         "different values at the same time")
+    s = np.where(empty, 0.0, (t - t0)/np.where(empty, 1.0, h))
+    return s, h
+
+# Boolean array (one entry per time) which tells whether two
+# states differ. The states are NumPy arrays whose leading
+# dimensions are those of the times, or V3Array-like objects.
+def _differ(x0, x1, shape):
+    different = x0 != x1
+    if isinstance(different, np.ndarray) and different.ndim > len(shape):
+        different = different.reshape(different.shape[:len(shape)] + (-1,)).any(axis=-1)
+    return np.broadcast_to(different, shape)
+
+# Make the interpolation coefficients broadcast against the states.
+# NumPy array states may have more dimensions than the times (e.g.,
+# shape (n, 3) for 3-d vectors). V3Array-like states keep their
+# components in separate arrays with the shape of the times.
+def _expand(c, x):
+    if isinstance(x, np.ndarray) and x.ndim > c.ndim:
+        return c.reshape(c.shape + (1,)*(x.ndim - c.ndim))
+    return c
+
+
+def interpolate_linear_array(t, t0, x0, t1, x1):
+    """
+    Vectorized version of interpolate_linear. The arguments t, t0, and t1
+    are arrays of times (or numbers) which are broadcast against each
+    other: each time t is interpolated inside its own interval [t0, t1].
+    x0 and x1 are NumPy arrays whose leading dimensions match the shape
+    of the times (for example, shape (n,) for scalar quantities or (n, 3)
+    for 3-d vectors) or V3Array objects. Raises ValueError if any time
+    is outside of its interval.
+    """
+    s, h = _intervalPositions(t, t0, x0, t1, x1)
+    s = _expand(s, x0)
+    return (1.0 - s)*x0 + s*x1
+
+
+def interpolate_Hermite_array(t, t0, x0, v0, t1, x1, v1):
+    """
+    Vectorized version of interpolate_Hermite (cubic Hermite interpolation
+    of coordinates from the coordinates and velocities at the interval
+    ends). See interpolate_linear_array for the description of the
+    argument shapes.
+    """
+    s, h = _intervalPositions(t, t0, x0, t1, x1)
+    s = _expand(s, x0)
+    h = _expand(h, x0)
+    onemt = 1.0 - s
+    h00 = onemt*onemt*(1.0 + 2.0*s)
+    h10 = onemt*onemt*s*h
+    h01 = s*s*(3.0 - 2.0*s)
+    h11 = s*s*onemt*h
+    return h00*x0 + h10*v0 + h01*x1 - h11*v1
+
+
+def interpolate_Hermite_quintic_array(t, t0, x0, v0, a0, t1, x1, v1, a1):
+    """
+    Vectorized version of interpolate_Hermite_quintic. Returns the tuple
+    x, v of the interpolated coordinates and velocities. See
+    interpolate_linear_array for the description of the argument shapes.
+    """
+    s, h = _intervalPositions(t, t0, x0, t1, x1)
+    # Any length works for the empty intervals (where s is 0)
+    h = np.where(h == 0.0, 1.0, h)
+    s = _expand(s, x0)
+    h = _expand(h, x0)
+    x, dx = _quintic(Hermite_quintic_coefficients(h, x0, v0, a0, x1, v1, a1), s)
+    v = dx/h
+    # Reproduce the states at the interval ends exactly
+    if isinstance(x, np.ndarray):
+        end = s == 1.0
+        x = np.where(end, x1, x)
+        v = np.where(end, v1, np.where(s == 0.0, v0, v))
+    return x, v
+
+
+def find_intervals(T, t):
+    """
+    For each time in t, find the index i of the interval [T[i], T[i+1]]
+    of the monotonic (increasing or decreasing) sequence of knots T which
+    contains this time. Times outside of the knot range are assigned to
+    the first or the last interval.
+    """
+    T = np.asarray(T, dtype=np.float64)
+    n = len(T)
+    if n < 2:
+        raise ValueError("Need at least two knots")
+    if T[n-1] >= T[0]:
+        i = np.searchsorted(T, t, side="right") - 1
+    else:
+        i = n - 2 - (np.searchsorted(T[::-1], t, side="right") - 1)
+    return np.clip(i, 0, n - 2)
+
+
+def resample(t, T, X, V=None):
+    """
+    Interpolate the trajectory with coordinates X (and, optionally,
+    velocities V) at the times T to the new times t. T must be monotonic.
+    X and V are NumPy arrays whose first dimension corresponds to the
+    times T, or V3Array objects. If V is not given, the coordinates are
+    interpolated linearly and the function returns the interpolated
+    coordinates. Otherwise, the coordinates are interpolated with cubic
+    Hermite polynomials, the velocities linearly, and the function
+    returns the tuple x, v.
+    """
+    t = np.asarray(t, dtype=np.float64)
+    T = np.asarray(T, dtype=np.float64)
+    i = find_intervals(T, t)
+    t0, t1 = T[i], T[i+1]
+    if V is None:
+        return interpolate_linear_array(t, t0, X[i], t1, X[i+1])
+    v0, v1 = V[i], V[i+1]
+    x = interpolate_Hermite_array(t, t0, X[i], v0, t1, X[i+1], v1)
+    v = interpolate_linear_array(t, t0, v0, t1, v1)
+    return x, v
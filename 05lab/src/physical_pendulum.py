@@ -9,6 +9,7 @@ __date__ ="Feb 25 2016"
 
 import cpforces
 import math
+import numpy as np
 
 class DrivenPendulum(cpforces.BasicForce):
     """
@@ -21,6 +22,10 @@ class DrivenPendulum(cpforces.BasicForce):
 
     F_D and omegaD are the amplitude and the frequency of the generalized
     driving force.
+
+    The force can be evaluated for NumPy arrays of angles and angular
+    velocities (e.g., with the ensemble mode of the ODE solvers). F_D
+    can then be an array as well, with one amplitude per trajectory.
     """
     def __init__(self, omega0, dissipationCoefficient, F_D, omegaD):
         self.omega0 = omega0
@@ -28,15 +33,28 @@ class DrivenPendulum(cpforces.BasicForce):
         self.F_D = F_D
         self.omegaD = omegaD
     def __call__(self, t, theta, omega):
+        if isinstance(theta, np.ndarray):
+            return self.evalBatch(t, theta, omega)
         return -self.omega0*self.omega0*math.sin(theta) - self.q*omega + \
                self.F_D*math.cos(self.omegaD*t)
+    def evalBatch(self, t, theta, omega):
+        return -self.omega0*self.omega0*np.sin(theta) - self.q*omega + \
+               self.F_D*np.cos(self.omegaD*t)
+    def kernel(self):
+        # The compiled kernel works with a single trajectory only
+        if isinstance(self.F_D, np.ndarray):
+            return None
+        return ("drivenPendulum", (self.omega0, self.q, self.F_D, self.omegaD), 1)
 
 def standard_angle(angle):
     """
-    This function converts all angles to the standard range [-Pi, Pi)
+    This function converts all angles to the standard range [-Pi, Pi).
+    Works for NumPy arrays of angles as well.
     """
     twopi = 2.0*math.pi
     a = angle % twopi
+    if isinstance(a, np.ndarray):
+        return np.where(a >= math.pi, a - twopi, a)
     if a >= math.pi:
         a -= twopi
     return a
@@ -1,5 +1,12 @@
 """
 This module provides a reasonably complete vector class for 3-d calculations.
+Classes implemented in this file are:
+
+  V3      -- A single 3-d vector.
+
+  V3Array -- Many 3-d vectors stored as three NumPy arrays of components
+             ("structure of arrays"). Supports the same operations as V3,
+             performed on all vectors at once.
 """
 
 __author__="Igor Volobouev (i.volobouev@ttu.edu)"
@@ -7,9 +14,14 @@ __version__="0.5"
 __date__ ="Jan 29 2018"
 
 import math
+import numpy as np
 
 class V3:
     "Basic 3-d vector class."
+    # Vectors are created in large numbers during ODE integration.
+    # Without the per-instance dictionary they are smaller and faster.
+    __slots__ = ("x", "y", "z")
+
     def __init__(self, x=0.0, y=0.0, z=0.0):
         # Use floats for internal representation
         self.x = x*1.0
@@ -154,3 +166,243 @@ class V3:
         self.y /= other
         self.z /= other
         return self
+
+    __itruediv__ = __idiv__
+
+    # Fused in-place operations which do not create temporary vectors
+    def axpy(self, a, other):
+        "Add a*other to this vector in place. Returns this vector."
+        self.x += a*other.x
+        self.y += a*other.y
+        self.z += a*other.z
+        return self
+
+    def assign(self, other):
+        "Copy the components of another vector into this one."
+        self.x = other.x
+        self.y = other.y
+        self.z = other.z
+        return self
+
+
+class V3Array:
+    """
+    Array of 3-d vectors stored as three contiguous NumPy arrays of
+    components x, y, and z. The methods mirror those of V3 and operate
+    on all vectors at once. Methods which return a number for V3 return
+    a NumPy array with one number per vector.
+
+    Arithmetic operations accept another V3Array of the same length,
+    a single V3 (applied to every vector), and numbers or NumPy arrays
+    with one number per vector (for multiplication and division).
+    Indexing with an integer returns a V3 object, indexing with a slice,
+    an index array, or a boolean mask returns a V3Array.
+
+    The constructor takes the arrays of x, y, and z components. Omitted
+    components are zero, and V3Array() is an empty array of vectors.
+    """
+    __slots__ = ("x", "y", "z")
+    # Make NumPy arrays defer to the arithmetic operators of this
+    # class, so that array*V3Array scales the vectors one by one
+    __array_ufunc__ = None
+
+    def __init__(self, x=None, y=None, z=None):
+        if x is None and y is None and z is None:
+            x = np.zeros(0)
+        x, y, z = (0.0 if c is None else c for c in (x, y, z))
+        x, y, z = np.broadcast_arrays(np.asarray(x, dtype=np.float64),
+                                      np.asarray(y, dtype=np.float64),
+                                      np.asarray(z, dtype=np.float64))
+        if x.ndim != 1:
+            raise ValueError("V3Array components must be one-dimensional")
+        self.x = np.array(x)
+        self.y = np.array(y)
+        self.z = np.array(z)
+
+    @classmethod
+    def zeros(cls, n):
+        "Array of n zero vectors."
+        return cls(np.zeros(n), 0.0, 0.0)
+
+    @classmethod
+    def fromArray(cls, a):
+        "Construct from an array of shape (n, 3)."
+        a = np.asarray(a, dtype=np.float64)
+        if a.ndim != 2 or a.shape[1] != 3:
+            raise ValueError("Expected an array of shape (n, 3)")
+        return cls(a[:,0], a[:,1], a[:,2])
+
+    @classmethod
+    def fromV3(cls, vectors):
+        "Construct from a sequence of V3 objects."
+        vectors = list(vectors)
+        return cls([v.x for v in vectors], [v.y for v in vectors],
+                   [v.z for v in vectors])
+
+    def toArray(self):
+        "Array of shape (n, 3)."
+        return np.column_stack((self.x, self.y, self.z))
+
+    def __len__(self):
+        return len(self.x)
+
+    def __getitem__(self, i):
+        if isinstance(i, (int, np.integer)):
+            return V3(float(self.x[i]), float(self.y[i]), float(self.z[i]))
+        return V3Array(self.x[i], self.y[i], self.z[i])
+
+    def __setitem__(self, i, value):
+        self.x[i] = value.x
+        self.y[i] = value.y
+        self.z[i] = value.z
+
+    def __iter__(self):
+        for i in range(len(self.x)):
+            yield self[i]
+
+    def __repr__(self):
+        return "V3Array(" + repr(self.toArray().tolist()) + ")"
+
+    def lengthSquared(self):
+        "Spatial lengths of the vectors, squared."
+        return self.x*self.x + self.y*self.y + self.z*self.z
+
+    def length(self):
+        "Spatial lengths of the vectors."
+        return np.sqrt(self.lengthSquared())
+
+    def direction(self):
+        "Directions of the vectors. Zero vectors get the direction of x axis."
+        length = self.length()
+        nonzero = length > 0.0
+        scale = np.where(nonzero, 1.0/np.where(nonzero, length, 1.0), 0.0)
+        return V3Array(np.where(nonzero, self.x*scale, 1.0),
+                       self.y*scale, self.z*scale)
+
+    def phi(self):
+        "Azimuthal angles."
+        return np.arctan2(self.y, self.x)
+
+    def cosTheta(self):
+        "Cosines of the polar angles."
+        length = self.length()
+        nonzero = length > 0.0
+        return np.where(nonzero, self.z/np.where(nonzero, length, 1.0), 0.0)
+
+    def theta(self):
+        "Polar angles."
+        cosTheta = self.cosTheta()
+        # Same method as in V3: acos looses precision near the poles
+        lengthSquared = self.lengthSquared()
+        ratio = (self.x*self.x + self.y*self.y)/np.where(lengthSquared > 0.0, lengthSquared, 1.0)
+        th = np.arcsin(np.sqrt(np.minimum(ratio, 1.0)))
+        nearPole = np.where(cosTheta > 0.0, th, math.pi - th)
+        return np.where(np.abs(cosTheta) < 0.99,
+                        np.arccos(np.clip(cosTheta, -1.0, 1.0)), nearPole)
+
+    def dot(self, other):
+        "Scalar products with other vectors, unit metric."
+        return self.x*other.x + self.y*other.y + self.z*other.z
+
+    def cross(self, other):
+        "Cross products with other vectors, unit metric."
+        return V3Array(self.y*other.z - self.z*other.y,
+                       self.z*other.x - self.x*other.z,
+                       self.x*other.y - self.y*other.x)
+
+    def project(self, other):
+        "Projections onto the directions of other vectors."
+        othermag2 = other.lengthSquared()
+        assert np.all(othermag2 > 0.0)
+        return other * (self.dot(other)/othermag2)
+
+    def angle(self, other):
+        "Angles between the vectors in radians."
+        u = self.direction()
+        v = other.direction()
+        cosa = u.dot(v)
+        # Same method as in V3: acos looses precision for small angles
+        # (note that v can be a single V3 while u is always an array)
+        small = 2.0*np.arcsin(np.minimum((u - v).length()/2.0, 1.0))
+        large = math.pi - 2.0*np.arcsin(np.minimum((u + v).length()/2.0, 1.0))
+        return np.where(np.abs(cosa) < 0.99,
+                        np.arccos(np.clip(cosa, -1.0, 1.0)),
+                        np.where(cosa > 0.0, small, large))
+
+    def __neg__(self):
+        return V3Array(-self.x, -self.y, -self.z)
+
+    def __pos__(self):
+        return V3Array(self.x, self.y, self.z)
+
+    def __abs__(self):
+        return self.length()
+
+    def __eq__(self, other):
+        return (self.x == other.x) & (self.y == other.y) & (self.z == other.z)
+
+    def __ne__(self, other):
+        return ~self.__eq__(other)
+
+    def __add__(self, other):
+        return V3Array(self.x+other.x, self.y+other.y, self.z+other.z)
+
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        return V3Array(self.x-other.x, self.y-other.y, self.z-other.z)
+
+    def __rsub__(self, other):
+        return V3Array(other.x-self.x, other.y-self.y, other.z-self.z)
+
+    def __mul__(self, other):
+        return V3Array(self.x*other, self.y*other, self.z*other)
+
+    def __rmul__(self, other):
+        return self*other
+
+    def __truediv__(self, other):
+        if np.any(np.asarray(other) == 0.0):
+            raise ZeroDivisionError("3-d vector divided by zero")
+        return V3Array(self.x/other, self.y/other, self.z/other)
+
+    # Mutators
+    def __iadd__(self, other):
+        self.x += other.x
+        self.y += other.y
+        self.z += other.z
+        return self
+
+    def __isub__(self, other):
+        self.x -= other.x
+        self.y -= other.y
+        self.z -= other.z
+        return self
+
+    def __imul__(self, other):
+        self.x *= other
+        self.y *= other
+        self.z *= other
+        return self
+
+    def __itruediv__(self, other):
+        if np.any(np.asarray(other) == 0.0):
+            raise ZeroDivisionError("3-d vector divided by zero")
+        self.x /= other
+        self.y /= other
+        self.z /= other
+        return self
+
+    def axpy(self, a, other):
+        "Add a*other to these vectors in place. Returns this object."
+        self.x += a*other.x
+        self.y += a*other.y
+        self.z += a*other.z
+        return self
+
+    def assign(self, other):
+        "Copy the components of other vectors into these ones."
+        self.x[:] = other.x
+        self.y[:] = other.y
+        self.z[:] = other.z
+        return self
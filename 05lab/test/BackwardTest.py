@@ -0,0 +1,69 @@
+"""
+Created: Sun Oct 18 11:22:40 2026
+Description: checks the runs backward in time (negative time step) with
+             a nonzero initial time, against the exact solution x = cos(t)
+             of the harmonic oscillator. Run with 05lab/src in PYTHONPATH.
+"""
+import numpy as np
+from cpode import *
+from cpforces import *
+from cphistory import *
+
+spring = RestoringForce(1.0, 0.0)
+t0 = 10.0
+x0 = np.cos(t0)
+v0 = -np.sin(t0)
+stop = TimeLimit(0.0, backward=True)
+
+for scheme, tolerances, limit in ((RK4, None, 1e-8), (DOP853, None, 1e-12),
+                                  (RKF45, (1e-10, 1e-10), 1e-8),
+                                  (DOP853, (1e-12, 1e-12), 1e-10),
+                                  (Rosenbrock23, (1e-8, 1e-8), 1e-4)):
+    name = scheme.name() + (" adaptive" if tolerances else " constant")
+    solver = scheme(spring)
+    solver.run(x0, v0, -0.01, stop, tolerances, t0=t0)
+    assert solver.t[0] == t0, name + ": initial time"
+    assert np.all(np.diff(solver.t) < 0.0), name + ": times must decrease"
+    assert solver.t[-1] <= 0.0, name + ": final time"
+    assert np.max(np.abs(solver.x - np.cos(solver.t))) < limit, name + ": coordinates"
+    assert np.max(np.abs(solver.v + np.sin(solver.t))) < limit, name + ": velocities"
+    #interpolation inside the decreasing history; the quintic Hermite error
+    #of the long adaptive steps is about 2e-9 in either direction
+    times = np.linspace(0.5, 9.5, 37)
+    x, v = solver.interpolate(times)
+    assert np.max(np.abs(x - np.cos(times))) < max(10*limit, 1e-8), name + ": interpolation"
+    #states sampled on the way, in the order of the run
+    solver.run(x0, v0, -0.01, stop, tolerances, t0=t0,
+               history=SampledHistory([1.0, 2.0, 3.0, 10.0]))
+    assert np.array_equal(solver.t, [10.0, 3.0, 2.0, 1.0]), name + ": sampled times"
+    assert np.max(np.abs(solver.x - np.cos(solver.t))) < 10*limit, name + ": samples"
+    print(name, "ok")
+
+#running forward and then backward returns to the initial state
+solver = RK4(spring)
+solver.evolve(1.0, 0.0, 0.01, TimeLimit(10.0))
+solver.evolve(solver.x, solver.v, -0.01, stop, t0=solver.t)
+assert abs(solver.t) < 1e-12 and abs(solver.x - 1.0) < 1e-8 and abs(solver.v) < 1e-8, \
+       "return to the initial state"
+print("forward and back ok")
+
+#the direction of the time limit must agree with the time step
+try:
+    solver.run(1.0, 0.0, -0.01, TimeLimit(10.0))
+    raise AssertionError("mismatched time limit was accepted")
+except ValueError:
+    pass
+print("time limit direction ok")
+
+#ensembles go backward as well; at these tolerances the error estimates are
+#near round-off, so the vectorized error norm moves the last step by ~1e-6
+X0 = np.array([1.0, 0.5, -0.3])
+ensemble = DOP853(spring)
+solver = DOP853(spring)
+ensemble.evolveEnsemble(X0*x0, X0*v0, -0.1, stop, (1e-12, 1e-12), t0=t0)
+for i, a in enumerate(X0):
+    solver.evolve(a*x0, a*v0, -0.1, stop, (1e-12, 1e-12), t0=t0)
+    assert solver.stepsMade == ensemble.stepsMade[i], "ensemble step count"
+    assert abs(ensemble.t[i] - solver.t) < 1e-5, "ensemble time"
+    assert abs(ensemble.x[i] - a*np.cos(ensemble.t[i])) < 1e-10, "ensemble coordinate"
+print("backward ensemble ok")
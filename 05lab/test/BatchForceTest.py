@@ -0,0 +1,64 @@
+"""
+Created: Sun Oct 18 14:36:18 2026
+Description: checks that the batch evaluation of forces ("evalBatch")
+             agrees with the force evaluated state by state, including the
+             piecewise drag formulas on both sides of their thresholds.
+             Run with 05lab/src in PYTHONPATH.
+"""
+import numpy as np
+from cpforces import *
+from physical_pendulum import *
+from v3 import V3
+
+rng = np.random.default_rng(2026)
+n = 200
+X = rng.uniform(-100.0, 1000.0, size=(n, 3))
+# Speeds from 0 to 500 m/s cover the golf ball and the transonic bullet regimes
+V = rng.normal(size=(n, 3))
+V *= (rng.uniform(0.0, 500.0, size=n)/np.linalg.norm(V, axis=1))[:, np.newaxis]
+t = 1.5
+
+def scalarResults(force, t, X, V):
+    results = []
+    for x, v in zip(X, V):
+        f = force(t, V3(*x), V3(*v))
+        results.append((f.x, f.y, f.z))
+    return np.array(results)
+
+forces = dict(gravity=ForceOfGravity(2.0),
+              magnus=MagnusForce(V3(0.1, 0.2, 0.3), 5.0),
+              quadraticDrag=QuadraticDrag(0.3, 0.01, 1.2),
+              bulletDrag=BulletDrag(1.0e-4, 1.2),
+              golfBallDrag=GolfBallDrag(),
+              altitudeDrag=AltitudeDrag(0.3, 0.01, 1.2),
+              restoring=RestoringForce(3.0, V3(1.0, 2.0, 3.0)))
+forces["composite"] = forces["gravity"] + 2.0*forces["golfBallDrag"] - forces["magnus"]
+forces["instrumented"] = InstrumentedForce(forces["composite"])
+for name, force in forces.items():
+    batch = force.evalBatch(t, X, V)
+    assert batch.shape == X.shape, name + ": shape"
+    assert np.allclose(batch, scalarResults(force, t, X, V), rtol=1e-12, atol=1e-12), name
+    print(name, "ok")
+
+#1-d states
+theta = rng.uniform(-3.0, 3.0, size=n)
+omega = rng.uniform(-2.0, 2.0, size=n)
+times = rng.uniform(0.0, 10.0, size=n)
+for name, force in (("gravity, 1-d", ForceOfGravity(1.0)),
+                    ("restoring, 1-d", RestoringForce(2.0, 0.5)),
+                    ("pendulum", DrivenPendulum(1.0, 0.5, 1.2, 2.0/3.0))):
+    batch = force.evalBatch(times, theta, omega)
+    if name.startswith("gravity"):
+        expected = np.full(n, force(0.0, 0.0, 0.0).y)
+    else:
+        expected = [force(tt, x, v) for tt, x, v in zip(times, theta, omega)]
+    assert np.allclose(batch, expected, rtol=1e-13, atol=1e-13), name
+    print(name, "ok")
+
+#per-trajectory driving amplitudes of the pendulum
+amplitudes = np.linspace(0.5, 1.5, n)
+batch = DrivenPendulum(1.0, 0.5, amplitudes, 2.0/3.0).evalBatch(t, theta, omega)
+expected = [DrivenPendulum(1.0, 0.5, a, 2.0/3.0)(t, x, v)
+            for a, x, v in zip(amplitudes, theta, omega)]
+assert np.allclose(batch, expected, rtol=1e-13, atol=1e-13), "pendulum amplitudes"
+print("pendulum amplitudes ok")
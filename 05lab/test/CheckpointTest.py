@@ -0,0 +1,98 @@
+"""
+Created: Sun Oct 18 10:48:52 2026
+Description: checks that a run interrupted after a checkpoint and continued
+             with "resume" reproduces the uninterrupted run bit for bit,
+             for several schemes, constant and adaptive steps, events, and
+             runs with and without history. Run with 05lab/src in PYTHONPATH.
+"""
+import os
+import tempfile
+import numpy as np
+from cpode import *
+from cpforces import *
+from cphistory import *
+from physical_pendulum import *
+from v3 import V3
+
+class Interrupted(Exception):
+    pass
+
+#the number of running condition calls after which the run is interrupted.
+#It is kept outside of the condition object, which is saved in checkpoints.
+interruptAfter = [None]
+
+class InterruptibleLimit(TimeLimit):
+    "Time limit which interrupts the run after a given number of calls"
+    def __call__(self, t, x, v):
+        if interruptAfter[0] is not None:
+            interruptAfter[0] -= 1
+            if interruptAfter[0] < 0:
+                raise Interrupted()
+        return TimeLimit.__call__(self, t, x, v)
+
+#event functions are saved in checkpoints, so they can not be lambdas
+def verticalVelocity(t, x, v):
+    return v.y
+
+def same(a, b):
+    return np.array_equal(np.asarray(a), np.asarray(b))
+
+def check(name, makeSolver, x0, v0, dt, tmax, tolerances=None, events=None,
+          history=None, evolve=False):
+    checkpointFile = os.path.join(tempfile.mkdtemp(), "run.ckpt")
+    arguments = (x0, v0, dt, InterruptibleLimit(tmax), tolerances)
+    def start(solver, history):
+        if evolve:
+            solver.evolve(*arguments, events=events)
+        else:
+            solver.run(*arguments, history=history, events=events)
+    #uninterrupted run
+    interruptAfter[0] = None
+    reference = makeSolver()
+    start(reference, history() if history else None)
+    #interrupted run, checkpointed after every step
+    interrupted = makeSolver()
+    interrupted.checkpointFile = checkpointFile
+    interrupted.checkpointInterval = 0.0
+    interruptAfter[0] = reference.stepsMade//2
+    try:
+        start(interrupted, history() if history else None)
+        raise AssertionError(name + ": the run was not interrupted")
+    except Interrupted:
+        pass
+    interruptAfter[0] = None
+    resumed = makeSolver()
+    resumed.resume(checkpointFile)
+    assert resumed.stepsMade == reference.stepsMade, name + ": number of steps"
+    assert same(resumed.t, reference.t), name + ": times"
+    if isinstance(reference.x, V3):
+        assert resumed.x == reference.x and resumed.v == reference.v, name + ": state"
+    else:
+        assert same(resumed.x, reference.x), name + ": coordinates"
+        assert same(resumed.v, reference.v), name + ": velocities"
+    if events:
+        assert all(reference.eventStates), name + ": events were not found"
+    for mine, theirs in zip(resumed.eventStates, reference.eventStates):
+        assert len(mine) == len(theirs), name + ": number of events"
+        for a, b in zip(mine, theirs):
+            assert a[0] == b[0], name + ": event times"
+    os.remove(checkpointFile)
+    os.rmdir(os.path.dirname(checkpointFile))
+    print(name, "ok")
+
+pendulum = DrivenPendulum(1.0, 0.5, 1.2, 2.0/3.0)
+mass = 0.145
+projectile = ForceOfGravity(mass) + QuadraticDrag(0.3, 0.0042, 1.2)
+spring = RestoringForce(4.0, 0.0)
+
+check("RK4 constant", lambda: RK4(pendulum), 0.2, 0.0, 0.04, 60.0)
+check("RK4 evolve", lambda: RK4(pendulum), 0.2, 0.0, 0.04, 60.0, evolve=True)
+check("DOP853 adaptive", lambda: DOP853(pendulum), 0.2, 0.0, 0.1, 60.0, (1e-10, 1e-10))
+check("DOP853 sampled", lambda: DOP853(pendulum), 0.2, 0.0, 0.1, 60.0, (1e-10, 1e-10),
+      history=lambda: SampledHistory(np.arange(0.0, 60.0, 3.0*np.pi)))
+check("RKF45 decimated", lambda: RKF45(pendulum), 0.2, 0.0, 0.1, 60.0, (1e-9, 1e-9),
+      history=lambda: DecimatedHistory(5))
+check("VelocityVerlet", lambda: VelocityVerlet(spring), 1.0, 0.0, 0.01, 30.0)
+check("Rosenbrock23", lambda: Rosenbrock23(pendulum), 0.2, 0.0, 0.1, 60.0, (1e-7, 1e-7))
+check("RK4 events", lambda: RK4(projectile, mass), V3(0, 1, 0), V3(30, 30, 0), 0.01,
+      10.0, events=[EventFunction(verticalVelocity, -1), GroundImpact()])
@@ -0,0 +1,79 @@
+"""
+Created: Sun Oct 18 15:52:26 2026
+Description: checks the fused evaluators made by CompositeForce.compile:
+             they must agree with the composite force for V3, float, and
+             NumPy array states, return new objects, and refuse constant
+             terms which do not fit V3 states. Run with 05lab/src in
+             PYTHONPATH.
+"""
+import numpy as np
+from cpode import *
+from cpforces import *
+from v3 import V3
+
+def same(a, b):
+    return np.allclose((a.x, a.y, a.z), (b.x, b.y, b.z), rtol=1e-15, atol=0.0)
+
+rng = np.random.default_rng(99)
+states = [(float(t), V3(*x), V3(*v)) for t, x, v in
+          zip(rng.uniform(0.0, 10.0, 20), rng.normal(size=(20, 3)),
+              30.0*rng.normal(size=(20, 3)))]
+
+magnus = MagnusForce(V3(0.0, 0.0, 1.0e-3), 100.0)
+composites = dict(withConstant=ForceOfGravity(0.045) + 2.0*GolfBallDrag() - magnus,
+                  variableOnly=QuadraticDrag(0.3, 0.01, 1.2) + magnus*0.5,
+                  constantOnly=ForceOfGravity(1.0)*3.0)
+for name, force in composites.items():
+    fused = force.compile()
+    for t, x, v in states:
+        assert same(fused(t, x, v), force(t, x, v)), name
+    t, x, v = states[0]
+    first = fused(t, x, v)
+    assert fused(t, x, v) is not first, name + ": new object for every call"
+    assert fused.kernel() == force.kernel(), name + ": kernel description"
+    print(name, "ok")
+
+#solvers give the same results with the fused evaluator
+force = composites["withConstant"]
+reference = RK4(force)
+reference.run(V3(), V3(40.0, 30.0, 0.0), 0.01, AboveGround())
+solver = RK4(force.compile())
+solver.run(V3(), V3(40.0, 30.0, 0.0), 0.01, AboveGround())
+assert len(solver.t) == len(reference.t), "solver steps"
+assert np.allclose(solver.x, reference.x, rtol=1e-13, atol=1e-13), "solver coordinates"
+print("solver ok")
+
+#float and NumPy array states
+spring = RestoringForce(2.0, 0.5) + RestoringForce(1.0, 0.0)*0.5
+fused = spring.compile()
+assert fused(0.0, 1.5, 0.0) == spring(0.0, 1.5, 0.0), "float state"
+X = rng.normal(size=5)
+assert np.array_equal(fused(0.0, X, X), spring(0.0, X, X)), "array state"
+print("float and array states ok")
+
+#forces defined by the user, including constant terms which
+#are not 3-d vectors and can not be added to V3 forces
+class Scaled(BasicForce):
+    dependsOnT = False
+    dependsOnX = False
+    def __init__(self):
+        self.scale = 1.0
+    def __call__(self, t, x, v):
+        return v*self.scale
+term = Scaled()
+fused = (2.0*term).compile()
+assert fused(0.0, 0.0, 1.0) == 2.0, "user force"
+class ConstantNumber(BasicForce):
+    dependsOnT = False
+    dependsOnX = False
+    dependsOnV = False
+    def __call__(self, t, x, v):
+        return 1.0
+fused = (ConstantNumber() + term).compile()
+assert fused(0.0, 0.0, 2.0) == 3.0, "float constant with float states"
+try:
+    fused(0.0, V3(), V3(1.0, 0.0, 0.0))
+    raise AssertionError("float constant was added to a V3 force")
+except TypeError:
+    pass
+print("constant terms ok")
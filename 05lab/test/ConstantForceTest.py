@@ -0,0 +1,45 @@
+"""
+Created: Sun Oct 18 16:05:49 2026
+Description: checks the argument dependencies declared by the forces and
+             the hoisting of constant terms out of CompositeForce: the
+             constant terms are evaluated once, the cached sum can not be
+             modified by the caller, and the results do not change.
+             Run with 05lab/src in PYTHONPATH.
+"""
+import numpy as np
+from cpode import *
+from cpforces import *
+from v3 import V3
+
+gravity = ForceOfGravity(2.0)
+drag = QuadraticDrag(0.3, 0.01, 1.2)
+assert gravity.isConstant() and not drag.isConstant(), "basic forces"
+force = gravity + drag
+assert not force.isConstant(), "composite with a variable term"
+assert not force.dependsOnT and not force.dependsOnX and force.dependsOnV, "composite flags"
+assert (gravity*3.0 - ForceOfGravity(1.0)).isConstant(), "constant composite"
+spring = RestoringForce(1.0, 0.0)
+assert (spring + drag).dependsOnX and (spring + drag).dependsOnV, "combined flags"
+print("dependencies ok")
+
+#the constant term is evaluated only once per composite force
+counted = InstrumentedForce(gravity, cacheSize=0)
+assert counted.isConstant(), "wrapper keeps the flags"
+force = counted + drag
+solver = RK4(force)
+solver.evolve(V3(), V3(10.0, 20.0, 0.0), 0.01, AboveGround())
+assert counted.evaluations == 1, "constant evaluations"
+print("hoisting ok")
+
+#the results agree with the explicit sum of the terms
+for v in (V3(1.0, 2.0, 3.0), V3(-30.0, 5.0, 0.0)):
+    expected = gravity(0.0, None, None) + drag(0.0, V3(), v)
+    result = force(0.0, V3(), v)
+    assert abs(result - expected) < 1e-15*abs(expected), "composite value"
+
+#modifying the returned force must not affect the cached constant
+constant = gravity*3.0
+first = constant(0.0, V3(), V3())
+first += V3(1.0, 1.0, 1.0)
+assert constant(0.0, V3(), V3()) == gravity.f*3.0, "cached constant"
+print("constant sums ok")
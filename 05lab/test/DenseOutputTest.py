@@ -0,0 +1,47 @@
+"""
+Created: Sun Oct 18 14:58:03 2026
+Description: checks the dense output of RK4, RK6, and RKF45: the stored
+             accelerations, and the interpolation error between the steps
+             which should not exceed the integration error at the steps.
+             Run with 05lab/src in PYTHONPATH.
+"""
+import numpy as np
+from cpode import *
+from cpforces import *
+from cphistory import *
+
+#harmonic oscillator x = cos(t), the acceleration is -x
+spring = RestoringForce(1.0, 0.0)
+for scheme in (RK4, RK6, RKF45):
+    for dt in (0.2, 0.1):
+        name = "%s, dt = %g" % (scheme.name(), dt)
+        solver = scheme(spring)
+        solver.run(1.0, 0.0, dt, TimeLimit(10.0))
+        assert solver.history.hasAccelerations(), name + ": accelerations"
+        assert np.array_equal(solver.history.a, -solver.x), name + ": acceleration values"
+        knotError = np.max(np.abs(solver.x - np.cos(solver.t)))
+        middle = 0.5*(solver.t[1:] + solver.t[:-1])
+        x, v = solver.interpolate(middle)
+        assert np.max(np.abs(x - np.cos(middle))) < 1.5*knotError, name + ": coordinates"
+        assert np.max(np.abs(v + np.sin(middle))) < 2.0*knotError, name + ": velocities"
+        print(name, "ok")
+
+#without the accelerations the interpolation is cubic, and it becomes
+#the dominant error for the 6th order scheme
+solver = RK6(spring)
+solver.run(1.0, 0.0, 0.1, TimeLimit(10.0), history=DecimatedHistory(1))
+assert not solver.history.hasAccelerations(), "decimated history accelerations"
+middle = 0.5*(solver.t[1:] + solver.t[:-1])
+x, v = solver.interpolate(middle)
+knotError = np.max(np.abs(solver.x - np.cos(solver.t)))
+assert np.max(np.abs(x - np.cos(middle))) > 10.0*knotError, "cubic interpolation"
+print("cubic interpolation ok")
+
+#large adaptive steps
+solver = RKF45(spring)
+solver.run(1.0, 0.0, 0.1, TimeLimit(20.0), (1e-10, 1e-10))
+knotError = np.max(np.abs(solver.x - np.cos(solver.t)))
+times = np.linspace(0.0, solver.t[-1], 1001)
+x, v = solver.interpolate(times)
+assert np.max(np.abs(x - np.cos(times))) < 2.0*knotError, "adaptive step interpolation"
+print("adaptive steps ok")
@@ -0,0 +1,38 @@
+"""
+Created: Sun Oct 18 13:41:55 2026
+Description: checks the embedded Dormand-Prince schemes: convergence order
+             with constant steps and the number of force evaluations per
+             accepted and rejected step ("first same as last" reuse).
+             Run with 05lab/src in PYTHONPATH.
+"""
+import math
+import numpy as np
+from cpode import *
+from cpforces import *
+from v3 import V3
+
+#convergence order on the harmonic oscillator, x = cos(t)
+spring = RestoringForce(1.0, 0.0)
+for scheme, order, steps in ((DOPRI5, 5, (0.2, 0.1)), (DOP853, 8, (0.4, 0.2))):
+    errors = []
+    for dt in steps:
+        solver = scheme(spring)
+        solver.evolve(1.0, 0.0, dt, TimeLimit(10.0 - dt/2))
+        errors.append(abs(solver.x - math.cos(solver.t)))
+    measured = math.log(errors[0]/errors[1], 2.0)
+    assert abs(measured - order) < 0.5, "%s order is %g" % (scheme.name(), measured)
+    print(scheme.name(), "order %.2f ok" % measured)
+
+#every trial step, accepted or rejected, costs the number of stages
+#minus one; only the very first step makes the extra evaluation
+projectile = ForceOfGravity(1.0) + QuadraticDrag(0.3, 0.01, 1.2)
+for scheme, perStep in ((DOPRI5, 6), (DOP853, 12)):
+    for events in (None, [GroundImpact()]):
+        force = InstrumentedForce(projectile, cacheSize=0)
+        solver = scheme(force)
+        solver.evolve(V3(0.0, 0.0, 0.0), V3(30.0, 30.0, 0.0), 1.0, TimeLimit(100.0),
+                      (1e-9, 1e-9), events=events)
+        assert solver.stepsRejected > 0, "the test needs rejected steps"
+        trials = solver.stepsMade + solver.stepsRejected
+        assert force.evaluations == perStep*trials + 1, "%s force evaluations" % scheme.name()
+    print(scheme.name(), "force evaluations ok")
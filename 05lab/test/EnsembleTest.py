@@ -0,0 +1,61 @@
+"""
+Created: Sun Oct 18 10:12:31 2026
+Description: checks that ensemble runs reproduce single trajectory runs,
+             for constant and adaptive steps (with both step size
+             controllers), per-trajectory running conditions, and t0.
+             Run with 05lab/src in PYTHONPATH.
+"""
+import numpy as np
+from cpode import *
+from cpforces import *
+from physical_pendulum import *
+from v3 import V3
+
+#pendulum ensemble: a range of initial angles, no chaos
+force = DrivenPendulum(1.0, 0.5, 0.5, 2.0/3.0)
+theta_0 = np.linspace(0.1, 1.0, 10)
+omega_0 = np.zeros(len(theta_0))
+
+#constant step: the same arithmetic as single runs
+ensemble = RK4(force)
+ensemble.evolveEnsemble(theta_0, omega_0, 0.01, TimeLimit(20.0))
+single = RK4(force)
+for i, theta in enumerate(theta_0):
+    single.evolve(theta, 0.0, 0.01, TimeLimit(20.0))
+    assert abs(single.t - ensemble.t[i]) < 1e-12, "constant step time"
+    assert abs(single.x - ensemble.x[i]) < 1e-12, "constant step angle"
+    assert abs(single.v - ensemble.v[i]) < 1e-12, "constant step velocity"
+print("constant step ensemble ok")
+
+#adaptive step: every trajectory has its own step sequence. The
+#damping amplifies the errors backward in time, so that run is short.
+for usePI in (False, True):
+    for t0, dt, stop in ((0.0, 0.1, TimeLimit(20.0)), (5.0, 0.1, TimeLimit(25.0)),
+                         (25.0, -0.1, TimeLimit(20.0, backward=True))):
+        ensemble = RKF45(force)
+        ensemble.usePIController = usePI
+        ensemble.evolveEnsemble(theta_0, omega_0, dt, stop, (1e-9, 1e-9), t0=t0)
+        single = RKF45(force)
+        single.usePIController = usePI
+        for i, theta in enumerate(theta_0):
+            single.evolve(theta, 0.0, dt, stop, (1e-9, 1e-9), t0=t0)
+            assert single.stepsMade == ensemble.stepsMade[i], "adaptive step count"
+            assert single.stepsRejected == ensemble.stepsRejected[i], "adaptive rejections"
+            assert abs(single.t - ensemble.t[i]) < 1e-6, "adaptive time"
+            assert abs(single.x - ensemble.x[i]) < 1e-6, "adaptive angle"
+print("adaptive step ensemble ok")
+
+#projectiles: each trajectory stops when it hits the ground
+mass = 0.145
+force = ForceOfGravity(mass) + QuadraticDrag(0.3, 0.0042, 1.2)
+angles = np.radians(np.linspace(15.0, 75.0, 7))
+X0 = np.zeros((len(angles), 3))
+V0 = 40.0*np.column_stack((np.cos(angles), np.sin(angles), np.zeros(len(angles))))
+ensemble = RK4(force, mass)
+ensemble.runEnsemble(X0, V0, 0.01, AboveGround())
+single = RK4(force, mass)
+for i in range(len(angles)):
+    single.run(V3(*X0[i]), V3(*V0[i]), 0.01, AboveGround())
+    assert single.stepsMade == ensemble.stepsMade[i], "projectile step count"
+    assert np.max(np.abs(single.x[-1] - ensemble.x[-1][i])) < 1e-9, "projectile landing"
+print("projectile ensemble ok")
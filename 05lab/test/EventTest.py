@@ -0,0 +1,55 @@
+"""
+Created: Sun Oct 18 11:05:16 2026
+Description: checks that the events are located precisely inside the
+             integration steps, against exactly known crossing times.
+             Run with 05lab/src in PYTHONPATH.
+"""
+import math
+import numpy as np
+from cpode import *
+from cpforces import *
+from v3 import V3
+
+#harmonic oscillator x = cos(t): zero crossings at pi/2 + k*pi,
+#turning points (v crossing zero going down) at 2*k*pi
+spring = RestoringForce(1.0, 0.0)
+for scheme in (RK4, DOP853):
+    for tolerances in (None, (1e-10, 1e-10)):
+        if tolerances is not None and not scheme._estimatesErrors:
+            continue
+        solver = scheme(spring)
+        crossings = EventFunction(lambda t, x, v: x)
+        turns = EventFunction(lambda t, x, v: v, direction=-1)
+        solver.run(1.0, 0.0, 0.01, TimeLimit(20.0), tolerances,
+                   events=[crossings, turns])
+        times = np.array([state[0] for state in solver.eventStates[0]])
+        expected = math.pi/2.0 + math.pi*np.arange(len(times))
+        assert len(times) == 6, scheme.name() + ": number of crossings"
+        assert np.max(np.abs(times - expected)) < 1e-7, scheme.name() + ": crossing times"
+        times = np.array([state[0] for state in solver.eventStates[1]])
+        expected = 2.0*math.pi*np.arange(1, len(times) + 1)
+        assert len(times) == 3, scheme.name() + ": number of turning points"
+        #velocities come from the derivative of the interpolating
+        #polynomial which is one order less precise
+        assert np.max(np.abs(times - expected)) < 1e-6, scheme.name() + ": turning times"
+        print(scheme.name(), "adaptive" if tolerances else "constant", "oscillator ok")
+
+#projectile without drag: the flight ends at the ground impact,
+#at the time 2*v0y/g, and the apex is at v0y/g
+mass = 1.0
+g = 9.80665
+gravity = ForceOfGravity(mass)
+for scheme in (RK4, RK6, DOP853):
+    solver = scheme(gravity, mass)
+    apex = EventFunction(lambda t, x, v: v.y, direction=-1)
+    solver.run(V3(0, 0, 0), V3(20, 20, 0), 0.05, TimeLimit(100.0),
+               events=[apex, GroundImpact()])
+    limit = 1e-9
+    tApex = solver.eventStates[0][0][0]
+    tImpact, xImpact, vImpact = solver.eventStates[1][0]
+    assert abs(tApex - 20.0/g) < limit, scheme.name() + ": apex time"
+    assert abs(tImpact - 40.0/g) < limit, scheme.name() + ": impact time"
+    assert abs(xImpact.y) < limit, scheme.name() + ": impact height"
+    #the terminal event stops the run at the impact
+    assert solver.t[-1] == tImpact, scheme.name() + ": run did not stop"
+    print(scheme.name(), "projectile ok")
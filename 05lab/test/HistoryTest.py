@@ -0,0 +1,61 @@
+"""
+Created: Sun Oct 18 13:04:27 2026
+Description: checks the array history stores of OdeSolver.run: a huge
+             time limit used as a backstop for a terminal event, growth
+             of the buffers past their initial capacity, and pickling of
+             the filled part only. Run with 05lab/src in PYTHONPATH.
+"""
+import pickle
+import numpy as np
+from cpode import *
+from cpforces import *
+from cphistory import *
+from v3 import V3
+
+gravity = ForceOfGravity(1.0)
+x0 = V3(0.0, 10.0, 0.0)
+v0 = V3(1.0, 5.0, 0.0)
+
+#huge time limit with a terminal event stopping the run early
+solver = RK4(gravity)
+solver.run(x0, v0, 0.001, TimeLimit(1.0e8), events=[GroundImpact()])
+assert solver.history.capacity <= OdeSolver._maxInitialCapacity, "initial capacity"
+g = 9.80665
+tImpact = (5.0 + np.sqrt(25.0 + 2.0*g*10.0))/g
+assert abs(solver.t[-1] - tImpact) < 1e-6, "impact time"
+assert abs(solver.x[-1,1]) < 1e-9, "impact height"
+print("time limit backstop ok")
+
+#infinite time limit
+solver.run(x0, v0, 0.01, TimeLimit(np.inf), events=[GroundImpact()])
+assert abs(solver.t[-1] - tImpact) < 1e-6, "impact time, infinite limit"
+print("infinite time limit ok")
+
+#buffers growing from a small capacity must reproduce the default run
+spring = RestoringForce(1.0, 0.0)
+reference = RK4(spring)
+reference.run(1.0, 0.0, 0.01, TimeLimit(30.0))
+solver = RK4(spring)
+solver.run(1.0, 0.0, 0.01, TimeLimit(30.0), history=ArrayHistory(2))
+assert solver.history.capacity >= len(solver.t), "capacity after growth"
+assert np.array_equal(solver.t, reference.t), "times after growth"
+assert np.array_equal(solver.x, reference.x), "coordinates after growth"
+assert np.array_equal(solver.history.a, reference.history.a), "accelerations after growth"
+print("buffer growth ok")
+
+#pickles keep only the filled part of the buffers
+history = ArrayHistory(100000)
+solver.run(1.0, 0.0, 0.01, TimeLimit(1.0), history=history)
+restored = pickle.loads(pickle.dumps(history, pickle.HIGHEST_PROTOCOL))
+assert len(pickle.dumps(history)) < 100*len(history)*8, "pickle size"
+assert np.array_equal(restored.t, history.t), "unpickled times"
+assert np.array_equal(restored.x, history.x), "unpickled coordinates"
+assert np.array_equal(restored.a, history.a), "unpickled accelerations"
+n = len(restored)
+restored.append(2.0, 0.5, 0.5)
+assert len(restored) == n + 1 and restored.t[-1] == 2.0, "append after unpickling"
+empty = pickle.loads(pickle.dumps(SampledHistory([5.0])))
+empty.start(0.0, V3(), V3())
+for i in range(1, 4):
+    empty.append(float(i), V3(), V3())
+print("pickling ok")
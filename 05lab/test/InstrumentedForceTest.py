@@ -0,0 +1,58 @@
+"""
+Created: Sun Oct 18 16:31:40 2026
+Description: checks the counting and caching force wrapper: the counters,
+             the LRU cache, the protection of the cached results, and the
+             statistics reported by the ODE solvers.
+             Run with 05lab/src in PYTHONPATH.
+"""
+import numpy as np
+from cpode import *
+from cpforces import *
+from v3 import V3
+
+projectile = ForceOfGravity(1.0) + QuadraticDrag(0.3, 0.01, 1.2)
+x0, v0 = V3(), V3(30.0, 30.0, 0.0)
+
+#RKF45 recomputes the first stage of a rejected trial, which the cache
+#then answers; the results must not change
+reference = RKF45(projectile)
+reference.run(x0, v0, 1.0, AboveGround(), (1e-9, 1e-9))
+counted = InstrumentedForce(projectile)
+solver = RKF45(counted)
+solver.run(x0, v0, 1.0, AboveGround(), (1e-9, 1e-9))
+assert np.array_equal(solver.x, reference.x), "cached results"
+assert solver.stepsRejected > 0, "the test needs rejected steps"
+assert counted.cacheHits == solver.stepsRejected, "cache hits"
+assert counted.calls == counted.evaluations + counted.cacheHits, "calls"
+stats = solver.forceStatistics
+assert stats["evaluations"] == counted.evaluations and stats["cacheHits"] == counted.cacheHits
+solver.run(x0, v0, 1.0, AboveGround(), (1e-9, 1e-9))
+assert solver.forceStatistics["calls"] == stats["calls"], "statistics of the last run only"
+print("solver statistics ok")
+
+#least recently used results are dropped first
+force = InstrumentedForce(QuadraticDrag(0.3, 0.01, 1.2), cacheSize=2)
+a, b, c = V3(1.0, 0.0, 0.0), V3(0.0, 1.0, 0.0), V3(0.0, 0.0, 1.0)
+for v in (a, b, a, c, a, b):
+    force(0.0, x0, v)
+assert force.evaluations == 4 and force.cacheHits == 2, "LRU cache"
+force.reset()
+assert force.calls == 0 and force.evaluations == 0 and force.cacheHits == 0, "reset"
+
+#modifying a result must not modify the cache
+result = force(0.0, x0, a)
+result += V3(1.0, 1.0, 1.0)
+assert force(0.0, x0, a) == QuadraticDrag(0.3, 0.01, 1.2)(0.0, x0, a), "protected results"
+print("cache ok")
+
+#batch evaluations are counted but not cached
+V = np.array([[1.0, 2.0, 3.0], [4.0, 5.0, 6.0]])
+force.reset()
+force.evalBatch(0.0, V, V)
+force.evalBatch(0.0, V, V)
+assert force.calls == 2 and force.evaluations == 2 and force.cacheHits == 0, "batches"
+counting = InstrumentedForce(RestoringForce(1.0, 0.0), cacheSize=0)
+for i in range(3):
+    counting(0.0, 1.0, 0.0)
+assert counting.evaluations == 3 and counting.cacheHits == 0, "counting only"
+print("counting ok")
@@ -0,0 +1,54 @@
+"""
+Created: Sun Oct 18 15:10:44 2026
+Description: checks that OdeSolver.interpolate called with an array of
+             times agrees with the calls made one time at a time, for
+             quintic and cubic interpolation, V3 and float states, and
+             runs backward in time. Run with 05lab/src in PYTHONPATH.
+"""
+import numpy as np
+from cpode import *
+from cpforces import *
+from cphistory import *
+from v3 import V3
+
+def check(name, solver, times):
+    x, v = solver.interpolate(times)
+    for i, t in enumerate(times):
+        xs, vs = solver.interpolate(float(t))
+        if isinstance(xs, V3):
+            xs, vs = (xs.x, xs.y, xs.z), (vs.x, vs.y, vs.z)
+        assert np.allclose(x[i], xs, rtol=1e-14, atol=1e-14), name + ": coordinates"
+        assert np.allclose(v[i], vs, rtol=1e-14, atol=1e-14), name + ": velocities"
+    print(name, "ok")
+
+rng = np.random.default_rng(7)
+spring = RestoringForce(1.0, 0.0)
+solver = RKF45(spring)
+solver.run(1.0, 0.0, 0.1, TimeLimit(10.0), (1e-8, 1e-8))
+times = np.sort(rng.uniform(0.0, solver.t[-1], 200))
+check("quintic, float", solver, times)
+
+solver.run(1.0, 0.0, 0.1, TimeLimit(10.0), (1e-8, 1e-8), history=DecimatedHistory(3))
+check("cubic, float", solver, times)
+
+projectile = ForceOfGravity(1.0) + QuadraticDrag(0.3, 0.01, 1.2)
+solver = RK4(projectile)
+solver.run(V3(0.0, 0.0, 0.0), V3(20.0, 20.0, 0.0), 0.05, AboveGround())
+times = rng.uniform(0.0, solver.t[-1], 100)
+x, v = solver.interpolate(list(times))
+assert x.shape == (100, 3) and v.shape == (100, 3), "V3 shapes"
+check("quintic, V3", solver, times)
+
+solver = DOP853(spring)
+solver.run(1.0, 0.0, -0.1, TimeLimit(-10.0, backward=True), (1e-10, 1e-10))
+check("backward", solver, rng.uniform(solver.t[-1], 0.0, 100))
+
+#the history points themselves are reproduced exactly
+x, v = solver.interpolate(solver.t)
+assert np.array_equal(x, solver.x) and np.array_equal(v, solver.v), "history points"
+try:
+    solver.interpolate(np.array([-1.0, 1.0]))
+    raise AssertionError("time outside of the run was accepted")
+except ValueError:
+    pass
+print("history points ok")
@@ -0,0 +1,81 @@
+"""
+Created: Sun Oct 18 17:02:58 2026
+Description: checks the vectorized interpolation functions of the
+             interpolate module against their single time versions and
+             against polynomials which they must reproduce exactly.
+             Run with 05lab/src in PYTHONPATH.
+"""
+import numpy as np
+from interpolate import *
+from v3 import V3, V3Array
+
+rng = np.random.default_rng(21)
+n = 300
+t0 = rng.uniform(-5.0, 5.0, n)
+t1 = t0 + rng.uniform(-2.0, 2.0, n)
+s = rng.uniform(0.0, 1.0, n)
+s[:3] = (0.0, 1.0, 0.5)
+t = t0 + s*(t1 - t0)
+x0, v0, a0, x1, v1, a1 = rng.normal(size=(6, n))
+
+def close(a, b):
+    return np.allclose(a, b, rtol=1e-12, atol=1e-12)
+
+#agreement with the single time versions
+assert close(interpolate_linear_array(t, t0, x0, t1, x1),
+             [interpolate_linear(*args) for args in zip(t, t0, x0, t1, x1)]), "linear"
+assert close(interpolate_Hermite_array(t, t0, x0, v0, t1, x1, v1),
+             [interpolate_Hermite(*args) for args in zip(t, t0, x0, v0, t1, x1, v1)]), "cubic"
+x, v = interpolate_Hermite_quintic_array(t, t0, x0, v0, a0, t1, x1, v1, a1)
+expected = np.array([interpolate_Hermite_quintic(*args) for args in
+                     zip(t, t0, x0, v0, a0, t1, x1, v1, a1)])
+assert close(x, expected[:,0]) and close(v, expected[:,1]), "quintic"
+print("single time versions ok")
+
+#polynomials of the interpolation degree are reproduced exactly
+def polynomial(c, t):
+    return sum(ck*t**k for k, ck in enumerate(c)), \
+           sum(k*ck*t**(k - 1) for k, ck in enumerate(c) if k > 0), \
+           sum(k*(k - 1)*ck*t**(k - 2) for k, ck in enumerate(c) if k > 1)
+for degree, name in ((1, "linear"), (3, "cubic"), (5, "quintic")):
+    c = rng.normal(size=degree + 1)
+    P0, V0, A0 = polynomial(c, t0)
+    P1, V1, A1 = polynomial(c, t1)
+    P, V, A = polynomial(c, t)
+    if degree == 1:
+        assert close(interpolate_linear_array(t, t0, P0, t1, P1), P), name
+    elif degree == 3:
+        assert close(interpolate_Hermite_array(t, t0, P0, V0, t1, P1, V1), P), name
+    else:
+        x, v = interpolate_Hermite_quintic_array(t, t0, P0, V0, A0, t1, P1, V1, A1)
+        assert close(x, P) and close(v, V), name
+print("polynomials ok")
+
+#3-d states as (n, 3) arrays and as V3Array objects
+X0, V0, X1, V1 = rng.normal(size=(4, n, 3))
+x = interpolate_Hermite_array(t, t0, X0, V0, t1, X1, V1)
+for k in range(3):
+    assert close(x[:,k], interpolate_Hermite_array(t, t0, X0[:,k], V0[:,k],
+                                                   t1, X1[:,k], V1[:,k])), "(n, 3) states"
+va = interpolate_Hermite_array(t, t0, V3Array.fromArray(X0), V3Array.fromArray(V0),
+                               t1, V3Array.fromArray(X1), V3Array.fromArray(V1))
+assert close(va.toArray(), x), "V3Array states"
+print("3-d states ok")
+
+#knot lookup and resampling
+T = np.linspace(0.0, 10.0, 11)
+times = np.array([0.0, 0.5, 5.0, 9.99, 10.0])
+assert np.array_equal(find_intervals(T, times), [0, 0, 5, 9, 9]), "increasing knots"
+assert np.array_equal(find_intervals(T[::-1], times), [9, 9, 4, 0, 0]), "decreasing knots"
+X = np.sin(T)
+assert close(resample(T, T, X), X), "resample at the knots"
+xr, vr = resample(times, T, X, np.cos(T))
+assert close(xr, [interpolate_Hermite(tt, T[i], X[i], np.cos(T[i]), T[i+1], X[i+1], np.cos(T[i+1]))
+                  for tt, i in zip(times, find_intervals(T, times))]), "resample"
+try:
+    interpolate_linear_array([2.0], [0.0], np.zeros(1), [1.0], np.ones(1))
+    raise AssertionError("time outside of the interval was accepted")
+except ValueError:
+    pass
+assert close(interpolate_linear_array([1.0], [1.0], np.ones(1), [1.0], np.ones(1)), [1.0])
+print("knots ok")
@@ -0,0 +1,54 @@
+"""
+Created: Sun Oct 18 10:31:07 2026
+Description: checks that the integration loops run by the compiled backend
+             (cpkernels, requires numba) agree with the Python loops, for
+             constant and adaptive steps. Run with 05lab/src in PYTHONPATH.
+"""
+import numpy as np
+import cpkernels
+from cpode import *
+from cpforces import *
+from physical_pendulum import *
+from v3 import V3
+
+if not cpkernels.available:
+    print("numba is not installed, the compiled backend can not be checked")
+    raise SystemExit(0)
+
+def compare(scheme, force, mass, x0, v0, dt, stop, tolerances, limit):
+    python = scheme(force, mass)
+    python.run(x0, v0, dt, stop, tolerances)
+    compiled = scheme(force, mass)
+    compiled.useCompiledKernels = True
+    compiled.run(x0, v0, dt, stop, tolerances)
+    if tolerances is None:
+        #constant step: the same steps must be made
+        assert len(python.t) == len(compiled.t), scheme.name() + ": number of steps"
+        pairs = ((python.t, compiled.t), (python.x, compiled.x), (python.v, compiled.v))
+    else:
+        #adaptive step: the error estimates cancel many digits, so the
+        #round-off alone changes the step sizes. Compare at common times.
+        tmax = min(python.t[-1], compiled.t[-1])
+        times = np.linspace(0.0, tmax, 101)
+        pairs = tuple(zip(python.interpolate(times), compiled.interpolate(times)))
+    for a, b in pairs:
+        deviation = np.max(np.abs(np.asarray(a) - np.asarray(b)))
+        assert deviation < limit, "%s: deviation %g" % (scheme.name(), deviation)
+
+#projectile with drag, 3-d states
+mass = 0.145
+projectile = ForceOfGravity(mass) + QuadraticDrag(0.3, 0.0042, 1.2)
+#driven pendulum, scalar states, regular motion
+pendulum = DrivenPendulum(1.0, 0.5, 0.5, 2.0/3.0)
+
+for scheme in (RK4, RK6, RKF45, DOPRI5, DOP853):
+    compare(scheme, projectile, mass, V3(0, 1, 0), V3(30, 30, 0), 0.01,
+            AboveGround(), None, 1e-9)
+    compare(scheme, pendulum, 1.0, 0.2, 0.0, 0.04, TimeLimit(50.0), None, 1e-9)
+    print(scheme.name(), "constant step ok")
+    if scheme._estimatesErrors:
+        compare(scheme, projectile, mass, V3(0, 1, 0), V3(30, 30, 0), 0.01,
+                AboveGround(), (1e-9, 1e-9), 1e-7)
+        compare(scheme, pendulum, 1.0, 0.2, 0.0, 0.04, TimeLimit(50.0),
+                (1e-9, 1e-9), 1e-7)
+        print(scheme.name(), "adaptive step ok")
@@ -0,0 +1,54 @@
+"""
+Created: Sun Oct 18 15:37:12 2026
+Description: checks the prepared runs: they must reproduce the ordinary
+             "run" and "evolve" calls exactly, keep their settings when
+             the solver is used directly in between, and no force
+             evaluations may be wasted on probing the scheme.
+             Run with 05lab/src in PYTHONPATH.
+"""
+import numpy as np
+from cpode import *
+from cpforces import *
+from v3 import V3
+
+projectile = ForceOfGravity(1.0) + QuadraticDrag(0.3, 0.01, 1.2)
+x0 = V3(0.0, 0.0, 0.0)
+velocities = [V3(10.0, 10.0, 0.0), V3(20.0, 30.0, 5.0), V3(5.0, 40.0, 0.0)]
+
+for scheme, tolerances in ((RK4, None), (RKF45, (1e-8, 1e-8)), (DOP853, (1e-10, 1e-10))):
+    name = scheme.name()
+    solver = scheme(projectile)
+    prepared = solver.prepare(0.01, TimeLimit(10.0), tolerances, events=[GroundImpact()])
+    reference = scheme(projectile)
+    for v0 in velocities:
+        reference.run(x0, v0, 0.01, TimeLimit(10.0), tolerances, events=[GroundImpact()])
+        prepared.run(x0, v0)
+        assert np.array_equal(solver.t, reference.t), name + ": run times"
+        assert np.array_equal(solver.x, reference.x), name + ": run coordinates"
+        assert solver.eventStates[0][0][0] == reference.eventStates[0][0][0], name + ": event"
+        # Direct use of the solver with different settings in between
+        solver.evolve(x0, v0, 0.05, AboveGround())
+        reference.evolve(x0, v0, 0.01, TimeLimit(10.0), tolerances, events=[GroundImpact()])
+        t, x, v = prepared.evolve(x0, v0)
+        assert t == reference.t and x == reference.x and v == reference.v, name + ": evolve"
+    print(name, "ok")
+
+#constant step runs cost exactly four evaluations per RK4 step
+force = InstrumentedForce(projectile, cacheSize=0)
+solver = RK4(force)
+solver.evolve(x0, velocities[0], 0.01, TimeLimit(1.0))
+assert force.evaluations == 4*solver.stepsMade, "RK4 force evaluations"
+force = InstrumentedForce(projectile, cacheSize=0)
+prepared = RK4(force).prepare(0.01, TimeLimit(1.0))
+for v0 in velocities:
+    prepared.evolve(x0, v0)
+assert force.evaluations == 4*prepared.solver.stepsMade*len(velocities), "prepared evaluations"
+print("force evaluations ok")
+
+#schemes without error estimates reject the tolerances
+try:
+    RK4(projectile).prepare(0.01, TimeLimit(1.0), (1e-8, 1e-8))
+    raise RuntimeError("tolerances were accepted")
+except AssertionError:
+    pass
+print("error estimate declarations ok")
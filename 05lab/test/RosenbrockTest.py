@@ -0,0 +1,44 @@
+"""
+Created: Sun Oct 18 14:02:13 2026
+Description: checks the Rosenbrock23 stiff solver: accuracy on a stiff
+             overdamped oscillator with the exactly known solution, and
+             the number of force evaluations per step and per Jacobian.
+             Run with 05lab/src in PYTHONPATH.
+"""
+import math
+import numpy as np
+from cpode import *
+from cpforces import *
+
+class LinearDrag(BasicForce):
+    "Drag force -b*v"
+    dependsOnT = False
+    dependsOnX = False
+    def __init__(self, b):
+        self.b = b
+    def __call__(self, t, x, v):
+        return -self.b*v
+
+#x'' = -k x - b x' with roots -1 and -k of the characteristic equation
+k = 1000.0
+force = RestoringForce(k, 0.0) + LinearDrag(k + 1.0)
+def exact(t):
+    return (k*math.exp(-t) - math.exp(-k*t))/(k - 1.0)
+
+solver = Rosenbrock23(force)
+solver.run(1.0, 0.0, 0.01, TimeLimit(5.0), (1e-8, 1e-6))
+error = max(abs(x - exact(t)) for t, x in zip(solver.t, solver.x))
+assert error < 1e-4, "stiff solution error %g" % error
+# An explicit scheme would need steps below 2/k for stability
+assert solver.stepsMade < 2000, "too many steps for a stiff solver"
+print("stiff solution ok")
+
+#every trial costs two force evaluations; the Jacobian adds one evaluation
+#per argument the force depends on (here x and v)
+counted = InstrumentedForce(force, cacheSize=0)
+solver = Rosenbrock23(counted)
+solver.evolve(1.0, 0.0, 0.5, TimeLimit(5.0), (1e-8, 1e-6))
+assert solver.stepsRejected > 0, "the test needs rejected steps"
+trials = solver.stepsMade + solver.stepsRejected
+assert counted.evaluations == 2*trials + 1 + 2*solver.jacobianUpdates, "force evaluations"
+print("force evaluations ok")
@@ -0,0 +1,82 @@
+"""
+Created: Sun Oct 18 16:47:21 2026
+Description: checks the parallel parameter sweeps: worker processes and
+             the calling process must give the same results as a plain
+             loop, an interrupted sweep must resume from its checkpoint
+             without repeating the completed points, and the parameter
+             types must be kept. Run with 05lab/src in PYTHONPATH.
+"""
+import os
+import tempfile
+import numpy as np
+from cpode import *
+from cpforces import *
+from cpsweep import ParameterSweep
+from v3 import V3
+
+def makeSolver(speed, angle):
+    return RK4(ForceOfGravity(1.0) + QuadraticDrag(0.3, 0.01, 1.2))
+
+def rangeAndTime(solver, speed, angle):
+    v0 = V3(speed*np.cos(angle), speed*np.sin(angle), 0.0)
+    solver.evolve(V3(), v0, 0.01, TimeLimit(100.0), events=[GroundImpact()])
+    return solver.x.x, solver.t
+
+if __name__ == "__main__":
+    speeds = np.linspace(10.0, 40.0, 7)
+    angles = np.linspace(0.2, 1.2, 5)
+    expected = np.array([[rangeAndTime(makeSolver(s, a), s, a) for a in angles]
+                         for s in speeds])
+    for processes in (0, 2):
+        sweep = ParameterSweep(makeSolver, (speeds, angles), rangeAndTime,
+                               outputShape=(2,), processes=processes, chunkSize=3)
+        assert np.array_equal(sweep.run(), expected), "%d processes" % processes
+        assert sweep.completed.all()
+    print("sweep ok")
+
+    #interrupt the sweep after a few points, then resume it
+    calls = []
+    def failing(solver, speed, angle):
+        if len(calls) == 12:
+            raise KeyboardInterrupt
+        calls.append((speed, angle))
+        return rangeAndTime(solver, speed, angle)
+    checkpoint = os.path.join(tempfile.mkdtemp(), "sweep.npz")
+    sweep = ParameterSweep(makeSolver, (speeds, angles), failing, outputShape=(2,),
+                           processes=0, chunkSize=4, checkpointFile=checkpoint,
+                           checkpointInterval=0.0)
+    try:
+        sweep.run()
+        raise AssertionError("the sweep was not interrupted")
+    except KeyboardInterrupt:
+        pass
+    assert os.path.exists(checkpoint), "checkpoint file"
+    resumedCalls = []
+    def counting(solver, speed, angle):
+        resumedCalls.append((speed, angle))
+        return rangeAndTime(solver, speed, angle)
+    sweep = ParameterSweep(makeSolver, (speeds, angles), counting, outputShape=(2,),
+                           processes=0, chunkSize=4, checkpointFile=checkpoint)
+    assert np.array_equal(sweep.run(), expected), "resumed sweep"
+    # The three completed chunks of four points are not run again
+    assert len(resumedCalls) == speeds.size*angles.size - 12, "repeated points"
+    assert not set(resumedCalls) & set(calls), "repeated points"
+    try:
+        ParameterSweep(makeSolver, (speeds[:-1], angles), counting, outputShape=(2,),
+                       processes=0, checkpointFile=checkpoint).run()
+        raise AssertionError("checkpoint of a different grid was accepted")
+    except ValueError:
+        pass
+    os.remove(checkpoint)
+    print("resume ok")
+
+    #the parameters keep their types
+    seen = []
+    def describe(solver, n, label):
+        seen.append((type(n), type(label)))
+        return n*len(label)
+    sweep = ParameterSweep(lambda n, label: None, ([1, 2, 3], ["a", "bb"]),
+                           describe, processes=0)
+    assert np.array_equal(sweep.run(), [[1, 2], [2, 4], [3, 6]]), "typed axes"
+    assert all(issubclass(a, np.integer) and issubclass(b, str) for a, b in seen)
+    print("parameter types ok")
@@ -0,0 +1,47 @@
+"""
+Created: Sun Oct 18 15:24:30 2026
+Description: checks the symplectic schemes (velocity Verlet, Yoshida 4th
+             and 6th order): convergence order, bounded energy error over
+             long runs, and the number of force evaluations per step.
+             Run with 05lab/src in PYTHONPATH.
+"""
+import math
+import numpy as np
+from cpode import *
+from cpforces import *
+
+#convergence order on the harmonic oscillator, x = cos(t)
+spring = RestoringForce(1.0, 0.0)
+for scheme, order in ((VelocityVerlet, 2), (Yoshida4, 4), (Yoshida6, 6)):
+    errors = []
+    for dt in (0.2, 0.1):
+        solver = scheme(spring)
+        solver.evolve(1.0, 0.0, dt, TimeLimit(10.0 - dt/2))
+        errors.append(abs(solver.x - math.cos(solver.t)))
+    measured = math.log(errors[0]/errors[1], 2.0)
+    assert abs(measured - order) < 0.3, "%s order is %g" % (scheme.name(), measured)
+    print(scheme.name(), "order %.2f ok" % measured)
+
+#the energy error of a symplectic scheme oscillates without growing,
+#while the energy of the RK4 solution keeps drifting away
+def energyErrors(scheme):
+    solver = scheme(spring)
+    solver.run(1.0, 0.0, 0.2, TimeLimit(5000.0))
+    dE = np.abs(0.5*(solver.x**2 + solver.v**2) - 0.5)
+    half = len(dE)//2
+    return np.max(dE[:half]), np.max(dE[half:])
+
+for scheme in (VelocityVerlet, Yoshida4):
+    first, second = energyErrors(scheme)
+    assert second < 1.01*first, scheme.name() + ": energy drift"
+first, second = energyErrors(RK4)
+assert second > 1.5*first, "RK4 energy drift is expected"
+print("energy conservation ok")
+
+#one force evaluation per substep, the last one is reused by the next step
+for scheme, substeps in ((VelocityVerlet, 1), (Yoshida4, 3), (Yoshida6, 7)):
+    force = InstrumentedForce(spring, cacheSize=0)
+    solver = scheme(force)
+    solver.evolve(1.0, 0.0, 0.1, TimeLimit(10.0))
+    assert force.evaluations == substeps*solver.stepsMade + 1, scheme.name() + ": evaluations"
+print("force evaluations ok")
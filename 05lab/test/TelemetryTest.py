@@ -0,0 +1,49 @@
+"""
+Created: Sun Oct 18 16:18:07 2026
+Description: checks the step telemetry of OdeSolver: the step records
+             must be consistent with the run, the force evaluations must
+             be counted exactly, and the telemetry must not change the
+             results. Run with 05lab/src in PYTHONPATH.
+"""
+import numpy as np
+from cpode import *
+from cpforces import *
+from v3 import V3
+
+projectile = ForceOfGravity(1.0) + QuadraticDrag(0.3, 0.01, 1.2)
+x0, v0 = V3(), V3(30.0, 30.0, 0.0)
+
+for scheme, tolerances in ((RK4, None), (RKF45, (1e-9, 1e-9)), (DOPRI5, (1e-9, 1e-9))):
+    name = scheme.name()
+    reference = scheme(projectile)
+    reference.run(x0, v0, 0.5, AboveGround(), tolerances)
+    counted = InstrumentedForce(projectile, cacheSize=0)
+    solver = scheme(counted)
+    solver.telemetry = StepTelemetry()
+    solver.run(x0, v0, 0.5, AboveGround(), tolerances)
+    tm = solver.telemetry
+    assert np.array_equal(solver.t, reference.t), name + ": results"
+    assert tm.stepsMade == solver.stepsMade and tm.stepsRejected == solver.stepsRejected, \
+           name + ": step counts"
+    assert len(tm.stepSizes) == solver.stepsMade, name + ": records"
+    assert np.array_equal(tm.stepTimes, solver.t[:-1]), name + ": step times"
+    assert np.allclose(tm.stepSizes, np.diff(solver.t), rtol=1e-12), name + ": step sizes"
+    assert np.sum(tm.retries) == solver.stepsRejected, name + ": retries"
+    assert tm.forceEvaluations == counted.evaluations, name + ": force evaluations"
+    assert np.sum(tm.stepEvaluations) <= tm.forceEvaluations, name + ": step evaluations"
+    if tolerances is None:
+        assert np.all(np.isnan(tm.errorRatios)), name + ": constant step error ratios"
+    else:
+        assert np.all(tm.errorRatios <= 1.0), name + ": error ratios"
+        assert solver.stepsRejected > 0, "the test needs rejected steps"
+    assert tm.forceTime <= tm.totalTime and tm.overheadTime >= 0.0, name + ": times"
+    assert "steps made" in tm.summary()
+    print(name, "ok")
+
+#totals only
+solver = RK4(projectile)
+solver.telemetry = StepTelemetry(recordSteps=False)
+solver.evolve(x0, v0, 0.01, AboveGround())
+assert solver.telemetry.stepsMade == solver.stepsMade and len(solver.telemetry.stepSizes) == 0
+assert solver.telemetry.forceEvaluations == 4*solver.stepsMade, "evolve force evaluations"
+print("totals ok")
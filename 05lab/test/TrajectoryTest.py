@@ -0,0 +1,70 @@
+"""
+Created: Sun Oct 18 17:20:33 2026
+Description: checks the Trajectory splines: agreement with the solver
+             interpolation, derivatives, integrals, and zero crossings
+             against the exact solution x = cos(t) of the harmonic
+             oscillator. Run with 05lab/src in PYTHONPATH.
+"""
+import numpy as np
+from cpode import *
+from cpforces import *
+from cphistory import *
+from cptrajectory import Trajectory
+
+spring = RestoringForce(1.0, 0.0)
+solver = RK6(spring)
+solver.run(1.0, 0.0, 0.05, TimeLimit(20.0))
+trajectory = solver.trajectory()
+assert trajectory.coefficients.shape[1] == 6, "quintic spline"
+tmax = solver.t[-1]
+times = np.linspace(0.0, tmax, 997)
+
+#the same polynomials as the solver interpolation
+x, v = solver.interpolate(times)
+assert np.allclose(trajectory(times), x, rtol=0.0, atol=1e-13), "coordinates"
+assert np.allclose(trajectory.velocity(times), v, rtol=0.0, atol=1e-12), "velocities"
+assert np.allclose(trajectory(solver.t), solver.x, rtol=0.0, atol=1e-15), "history points"
+print("interpolation ok")
+
+#derivatives and integrals of cos(t)
+limit = 1e-8
+assert np.max(np.abs(trajectory(times) - np.cos(times))) < limit, "x"
+assert np.max(np.abs(trajectory.derivative(times) + np.sin(times))) < limit, "dx/dt"
+assert np.max(np.abs(trajectory.acceleration(times) + np.cos(times))) < 1e-6, "d2x/dt2"
+assert np.allclose(trajectory.derivative(times, 0), trajectory(times)), "derivative of order 0"
+tb = np.linspace(0.0, tmax, 50)
+assert np.max(np.abs(trajectory.integral(0.0, tb) - np.sin(tb))) < limit, "integral from 0"
+assert np.max(np.abs(trajectory.integral(tb, tmax) - (np.sin(tmax) - np.sin(tb)))) < limit, \
+       "integral to tmax"
+print("derivatives and integrals ok")
+
+#zero crossings at pi/2 + k*pi, down for even k and up for odd k
+k = np.arange(int((tmax - np.pi/2)/np.pi) + 1)
+exact = np.pi/2 + k*np.pi
+assert np.max(np.abs(trajectory.crossings() - exact)) < limit, "all crossings"
+assert np.max(np.abs(trajectory.crossings(direction=-1) - exact[::2])) < limit, "down"
+assert np.max(np.abs(trajectory.crossings(direction=1) - exact[1::2])) < limit, "up"
+turning = trajectory.roots(lambda t, x, v: v)
+assert np.max(np.abs(turning - np.pi*np.arange(1, len(turning) + 1))) < 1e-7, "turning points"
+print("crossings ok")
+
+#angles: x = t crosses pi + 2*pi*k with the period 2*pi
+T = np.linspace(0.0, 20.0, 21)
+line = Trajectory(T, T, np.ones_like(T), np.zeros_like(T))
+angles = line.crossings(np.pi, period=2.0*np.pi)
+assert np.allclose(angles, [np.pi, 3*np.pi, 5*np.pi], rtol=0.0, atol=1e-12), "periodic crossings"
+print("periodic crossings ok")
+
+#cubic splines from histories without accelerations, and backward runs
+solver.run(1.0, 0.0, 0.05, TimeLimit(20.0), history=DecimatedHistory(2))
+cubic = solver.trajectory()
+assert cubic.coefficients.shape[1] == 4, "cubic spline"
+x, v = solver.interpolate(times)
+assert np.allclose(cubic(times), x, rtol=0.0, atol=1e-13), "cubic coordinates"
+solver.run(np.cos(10.0), -np.sin(10.0), -0.05, TimeLimit(0.0, backward=True), t0=10.0)
+backward = solver.trajectory()
+inside = np.linspace(solver.t[-1], 10.0, 301)
+assert np.max(np.abs(backward(inside) - np.cos(inside))) < limit, "backward trajectory"
+assert np.max(np.abs(backward.integral(10.0, inside) - (np.sin(inside) - np.sin(10.0)))) < limit, \
+       "backward integral"
+print("cubic and backward trajectories ok")
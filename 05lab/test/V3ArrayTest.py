@@ -0,0 +1,72 @@
+"""
+Created: Sun Oct 18 14:20:36 2026
+Description: checks that V3Array reproduces the V3 methods vector by
+             vector, and the fused in-place operations of both classes.
+             Run with 05lab/src in PYTHONPATH.
+"""
+import numpy as np
+from v3 import V3, V3Array
+
+rng = np.random.default_rng(12345)
+n = 50
+a = V3Array.fromArray(rng.normal(size=(n, 3)))
+b = V3Array.fromArray(rng.normal(size=(n, 3)))
+s = rng.uniform(0.5, 2.0, size=n)
+
+def close(x, y):
+    return np.allclose(x, y, rtol=1e-13, atol=1e-13)
+
+def asArray(vectors):
+    return np.array([(v.x, v.y, v.z) for v in vectors])
+
+#methods returning numbers
+for name in ("lengthSquared", "length", "phi", "cosTheta", "theta"):
+    expected = [getattr(v, name)() for v in a]
+    assert close(getattr(a, name)(), expected), name
+for name in ("dot", "angle"):
+    expected = [getattr(u, name)(w) for u, w in zip(a, b)]
+    assert close(getattr(a, name)(b), expected), name
+print("scalar methods ok")
+
+#methods and operators returning vectors
+assert close(a.direction().toArray(), asArray(v.direction() for v in a)), "direction"
+assert close(a.cross(b).toArray(), asArray(u.cross(w) for u, w in zip(a, b))), "cross"
+assert close(a.project(b).toArray(), asArray(u.project(w) for u, w in zip(a, b))), "project"
+assert close((a + b).toArray(), asArray(u + w for u, w in zip(a, b))), "sum"
+assert close((a - b).toArray(), asArray(u - w for u, w in zip(a, b))), "difference"
+assert close((a*s).toArray(), asArray(u*c for u, c in zip(a, s))), "product"
+assert close((s*a).toArray(), asArray(u*c for u, c in zip(a, s))), "reflected product"
+assert close((a/s).toArray(), asArray(u/c for u, c in zip(a, s))), "ratio"
+shift = V3(1.0, -2.0, 3.0)
+assert close((a + shift).toArray(), asArray(u + shift for u in a)), "sum with V3"
+print("vector methods ok")
+
+#in-place operations
+c = +a
+c.axpy(2.0, b)
+assert close(c.toArray(), (a + b*2.0).toArray()), "V3Array.axpy"
+c.assign(b)
+assert np.array_equal(c.toArray(), b.toArray()), "V3Array.assign"
+c *= s
+assert close(c.toArray(), (b*s).toArray()), "V3Array *="
+u = V3(1.0, 2.0, 3.0)
+w = u
+u.axpy(0.5, V3(2.0, 2.0, 2.0))
+assert w is u and u == V3(2.0, 3.0, 4.0), "V3.axpy"
+u.assign(V3())
+assert u == V3(), "V3.assign"
+print("in-place operations ok")
+
+#indexing and construction
+assert isinstance(a[3], V3) and a[3] == V3(a.x[3], a.y[3], a.z[3]), "integer index"
+assert len(a[a.x > 0.0]) == np.count_nonzero(a.x > 0.0), "boolean mask"
+assert len(V3Array()) == 0, "empty array"
+assert np.array_equal(V3Array(y=[1.0, 2.0]).toArray(), [[0, 1, 0], [0, 2, 0]]), "omitted components"
+assert len(V3Array.fromV3(list(a))) == n, "fromV3"
+assert not hasattr(V3(), "__dict__") and not hasattr(a, "__dict__"), "slots"
+try:
+    V3Array(1.0, 2.0, 3.0)
+    raise AssertionError("0-d components were accepted")
+except ValueError:
+    pass
+print("construction ok")
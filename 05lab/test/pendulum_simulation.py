@@ -3,6 +3,7 @@
 from cpode import *
 from physical_pendulum import *
 from pylab import *
+import numpy as np
 import math
 
 # System parameters
@@ -55,12 +56,8 @@ ylabel('Angular Velocity (radians/s)')
 npoints = 200
 period = 2*math.pi/omegaD
 pendulum.run(thetaInitial, omegaInitial, dt, TimeLimit(period*(npoints+1)))
-theta = []
-omega = []
-for i in range(npoints):
-    x, v = pendulum.interpolate(period*i)
-    theta.append(standard_angle(x))
-    omega.append(v)
+x, omega = pendulum.interpolate(period*np.arange(npoints))
+theta = standard_angle(x)
 
 subplot(2,2,4); scatter(theta, omega)
 title('Pendulum Poincare Section')